@@ -0,0 +1,236 @@
+
+# -*- coding: utf-8 -*-
+"""
+Servidor HTTP local que imita `POST /v1/chat/completions` (formato OpenAI).
+
+Permite medir el pipeline sin red: latencia configurable (media + jitter),
+una tasa de respuestas 429 y respuestas fijas por campo. El pipeline lo usa
+apuntando `OPENAI_BASE_URL` a `server.base_url`.
+
+    python -m benchmarks.mock_llm --port 8765 --latency-ms 300 --rate-429 0.05
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+DEFAULT_RESPONSES = {
+    "fecha": "15/03/2023",
+    "cuit": "20-12345678-6",
+}
+
+_FIELD_RE = re.compile(r'Extraé "(\w+)"')
+_BATCH_RE = re.compile(r'Recorte (\d+): "(\w+)"')
+
+
+class MockLLMServer:
+    """Chat completions falso en un hilo de fondo.
+
+    - `latency_ms` / `jitter_ms`: demora por request (uniforme en ±jitter)
+    - `rate_429`: probabilidad de responder 429 con "try again in Nms"
+    - `empty_rate`: probabilidad de responder {} (dato no encontrado)
+    - `responses`: valor por campo ("fecha", "cuit"); la página completa
+      devuelve {"fechas": [fecha], "cuits": [cuit]} y un lote de recortes
+      {"1": valor, "2": valor, ...}
+    - `image_latency_ms`: demora extra por cada imagen después de la primera
+    - `quota_rpm`: cupo real de requests por minuto (ventana deslizante);
+      cada respuesta informa `x-ratelimit-*` y al agotarse responde 429 con
+      `retry-after-ms` (0 = sin cupo)
+
+    `peak_in_flight` registra el máximo de requests atendidas a la vez.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, rate_429: float = 0.0, empty_rate: float = 0.0,
+                 responses: Optional[Dict[str, str]] = None, seed: Optional[int] = None,
+                 quota_rpm: int = 0, image_latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.image_latency_ms = image_latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.empty_rate = empty_rate
+        self.responses = dict(DEFAULT_RESPONSES, **(responses or {}))
+        self.quota_rpm = quota_rpm
+        self._window: deque = deque()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.images = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.service_times: List[float] = []
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # --- lógica de respuesta ---
+
+    def _quota(self, now: float):
+        # ventana deslizante de 60 s; se llama con el lock tomado
+        while self._window and now - self._window[0] >= 60.0:
+            self._window.popleft()
+        accepted = len(self._window) < self.quota_rpm
+        if accepted:
+            self._window.append(now)
+        remaining = self.quota_rpm - len(self._window)
+        reset = 60.0 - (now - self._window[0]) if self._window else 0.0
+        return accepted, {
+            "x-ratelimit-limit-requests": str(self.quota_rpm),
+            "x-ratelimit-remaining-requests": str(remaining),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        }
+
+    def _roll(self, images: int = 1):
+        with self._lock:
+            self.requests += 1
+            self.images += images
+            headers: Dict[str, str] = {}
+            over_quota = False
+            if self.quota_rpm:
+                accepted, headers = self._quota(time.monotonic())
+                over_quota = not accepted
+            limited = over_quota or self._rng.random() < self.rate_429
+            empty = self._rng.random() < self.empty_rate
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms))
+            delay += self.image_latency_ms * max(0, images - 1)
+            if limited:
+                self.rate_limited += 1
+                wait_ms = 50
+                if over_quota:
+                    wait_ms = int(1000 * (60.0 - (time.monotonic() - self._window[0])))
+                headers["retry-after-ms"] = str(max(1, wait_ms))
+        return limited, empty, delay / 1000.0, headers
+
+    def _answer(self, body: dict, empty: bool) -> dict:
+        text = " ".join(
+            part.get("text", "")
+            for msg in body.get("messages", []) if isinstance(msg.get("content"), list)
+            for part in msg["content"]
+        )
+        m = _FIELD_RE.search(text)
+        batch = _BATCH_RE.findall(text)
+        if empty:
+            content = {}
+        elif batch:
+            content = {n: self.responses.get(field) for n, field in batch}
+        elif m:
+            field = m.group(1)
+            content = {field: self.responses[field]} if field in self.responses else {}
+        else:
+            content = {"fechas": [self.responses["fecha"]], "cuits": [self.responses["cuit"]]}
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(content)},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 300, "completion_tokens": 20, "total_tokens": 320},
+        }
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):   # silencioso
+                pass
+
+            def _send(self, status: int, payload: dict, headers: Optional[dict] = None):
+                raw = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_POST(self):
+                t0 = time.perf_counter()
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found"}})
+                    return
+                images = sum(
+                    1 for msg in body.get("messages", []) if isinstance(msg.get("content"), list)
+                    for part in msg["content"] if part.get("type") == "image_url"
+                )
+                limited, empty, delay, headers = server._roll(max(1, images))
+                with server._lock:
+                    server.in_flight += 1
+                    server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+                time.sleep(delay)
+                with server._lock:
+                    server.in_flight -= 1
+                if limited:
+                    headers["x-should-retry"] = "false"
+                    self._send(429, {"error": {
+                        "message": f"Rate limit reached. Please try again in {headers['retry-after-ms']}ms.",
+                        "type": "requests", "code": "rate_limit_exceeded",
+                    }}, headers=headers)
+                else:
+                    self._send(200, server._answer(body, empty), headers=headers)
+                with server._lock:
+                    server.service_times.append(time.perf_counter() - t0)
+
+        return Handler
+
+
+def main():
+    p = argparse.ArgumentParser(description="Mock local de chat completions")
+    p.add_argument("--host", type=str, default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--latency-ms", type=float, default=300.0)
+    p.add_argument("--jitter-ms", type=float, default=100.0)
+    p.add_argument("--rate-429", type=float, default=0.0)
+    p.add_argument("--empty-rate", type=float, default=0.0)
+    p.add_argument("--quota-rpm", type=int, default=0, help="Cupo de requests/min con headers x-ratelimit-*")
+    p.add_argument("--image-latency-ms", type=float, default=0.0, help="Demora extra por imagen adicional en un lote")
+    p.add_argument("--responses", type=str, default=None, help='JSON, ej: {"fecha": "01/02/2023"}')
+    args = p.parse_args()
+    server = MockLLMServer(args.host, args.port, args.latency_ms, args.jitter_ms, args.rate_429,
+                           args.empty_rate, json.loads(args.responses) if args.responses else None,
+                           quota_rpm=args.quota_rpm, image_latency_ms=args.image_latency_ms)
+    print(f"[OK] Mock LLM en {server.base_url} (OPENAI_BASE_URL)")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+
+# -*- coding: utf-8 -*-
+"""
+Benchmark de `process_folder` sin red.
+
+Genera (o reutiliza) un lote sintético, levanta el mock de chat completions,
+apunta `OPENAI_BASE_URL` a él y corre el pipeline. Informa docs/s, llamadas
+LLM por documento y p50/p95 de latencia por PDF (y del mock por request).
+
+    PYTHONPATH=src python -m benchmarks.run --docs 60 --workers 4 --latency-ms 200
+    PYTHONPATH=src python -m benchmarks.run --baseline bench.json --tolerance 0.15
+
+Con `--baseline` compara contra un resultado previo (`--out`) y termina con
+código 1 si docs/s cae más que la tolerancia.
+"""
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from pdf_fields.config import Settings
+
+from .mock_llm import MockLLMServer
+from .synth import make_corpus
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    xs = sorted(values)
+    k = (len(xs) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+def run_benchmark(cfg: Settings, server: MockLLMServer) -> dict:
+    """Corre `process_folder` contra el mock y resume el run_report."""
+    from pdf_fields.pipeline import process_folder
+
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    docs = len(list(Path(cfg.input_dir).glob("*.pdf")))
+    if cfg.max_files is not None:
+        docs = min(docs, cfg.max_files)
+    # --profile con top = docs deja la duración de cada PDF en el reporte
+    cfg.profile = True
+    cfg.profile_top = max(1, docs)
+
+    t0 = time.perf_counter()
+    rows = process_folder(cfg)
+    wall = time.perf_counter() - t0
+
+    report = json.loads(cfg.report_path().read_text(encoding="utf-8"))
+    counters = report.get("counters", {})
+    llm_calls = sum(v for k, v in counters.items() if k.startswith("llm.calls."))
+    per_doc = [e["seconds"] for e in report.get("slowest", [])]
+    return {
+        "docs": docs,
+        "rows": rows,
+        "wall_s": round(wall, 3),
+        "docs_per_s": round(docs / wall, 3) if wall else 0.0,
+        "llm_calls_per_doc": round(llm_calls / docs, 3) if docs else 0.0,
+        "llm_calls": {k: v for k, v in counters.items() if k.startswith("llm.")},
+        "templates": {k: v for k, v in counters.items() if k.startswith("templates.")},
+        "page_dedup": report.get("page_dedup"),
+        "text_only_share": report.get("text_only_share"),
+        "doc_latency_p50_s": round(percentile(per_doc, 0.50), 4),
+        "doc_latency_p95_s": round(percentile(per_doc, 0.95), 4),
+        "mock_requests": server.requests,
+        "mock_images": server.images,
+        "mock_429": server.rate_limited,
+        "mock_latency_p50_s": round(percentile(server.service_times, 0.50), 4),
+        "mock_latency_p95_s": round(percentile(server.service_times, 0.95), 4),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> Optional[str]:
+    """Devuelve un mensaje si hay regresión de throughput respecto a `baseline`."""
+    base = baseline.get("docs_per_s") or 0.0
+    if base and result["docs_per_s"] < base * (1.0 - tolerance):
+        return f"docs/s {result['docs_per_s']} < {base} (-{tolerance:.0%})"
+    return None
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark offline de pdf_fields")
+    p.add_argument("--corpus", type=Path, default=None, help="Carpeta con PDFs (si no, se genera uno temporal)")
+    p.add_argument("--docs", type=int, default=30)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--kinds", type=str, default="text,scanned,mixed")
+    p.add_argument("--max-pages", type=int, default=4)
+    p.add_argument("--layouts", type=int, default=0, help="Formatos fijos en el lote generado (0 = al azar)")
+    p.add_argument("--duplicates", type=float, default=0.0, help="Copias reenviadas/re-escaneadas en el lote generado (fracción de --docs)")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--async-llm", action="store_true")
+    p.add_argument("--max-in-flight", type=int, default=8)
+    p.add_argument("--batch-size", type=int, default=1, help="Recortes por request (1 = sin lotes)")
+    p.add_argument("--batch-window-ms", type=float, default=0.0)
+    p.add_argument("--scan-policy", type=str, default="all")
+    p.add_argument("--latency-ms", type=float, default=50.0)
+    p.add_argument("--jitter-ms", type=float, default=10.0)
+    p.add_argument("--rate-429", type=float, default=0.0)
+    p.add_argument("--empty-rate", type=float, default=0.0)
+    p.add_argument("--quota-rpm", type=int, default=0, help="Cupo del mock con headers x-ratelimit-* (0 = sin cupo)")
+    p.add_argument("--image-latency-ms", type=float, default=0.0, help="Demora del mock por imagen adicional en un lote")
+    p.add_argument("--no-adaptive-rate", action="store_true")
+    p.add_argument("--no-templates", action="store_true")
+    p.add_argument("--no-page-dedup", action="store_true")
+    p.add_argument("--cache", action="store_true", help="Habilita cache de resultados y memo (por defecto no)")
+    p.add_argument("--out", type=Path, default=None, help="Guarda el resultado en JSON")
+    p.add_argument("--baseline", type=Path, default=None, help="JSON previo para comparar")
+    p.add_argument("--tolerance", type=float, default=0.15)
+    args = p.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+
+    with tempfile.TemporaryDirectory(prefix="pdf_fields_bench_") as tmp:
+        tmp = Path(tmp)
+        corpus = args.corpus
+        if corpus is None:
+            corpus = tmp / "corpus"
+            make_corpus(corpus, args.docs, seed=args.seed, kinds=tuple(args.kinds.split(",")),
+                        max_pages=args.max_pages, layouts=args.layouts, duplicates=args.duplicates)
+
+        cfg = Settings(input_dir=corpus, out_dir=tmp / "out")
+        cfg.llm_provider = "openai"
+        cfg.workers = args.workers
+        cfg.llm_async = args.async_llm
+        cfg.max_in_flight = args.max_in_flight
+        cfg.scan_policy = args.scan_policy
+        cfg.llm_batch_size = args.batch_size
+        cfg.llm_batch_window_ms = args.batch_window_ms
+        cfg.min_call_interval_s = 0.0
+        cfg.initial_backoff_s = 0.05
+        cfg.cache_enabled = args.cache
+        cfg.memo_enabled = args.cache
+        cfg.templates_enabled = not args.no_templates
+        cfg.page_dedup_enabled = not args.no_page_dedup
+        cfg.adaptive_rate = not args.no_adaptive_rate
+        cfg.rate_ledger = tmp / "rate_ledger.json"
+
+        server = MockLLMServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                               rate_429=args.rate_429, empty_rate=args.empty_rate, seed=args.seed,
+                               quota_rpm=args.quota_rpm, image_latency_ms=args.image_latency_ms)
+        with server:
+            result = run_benchmark(cfg, server)
+
+    print(json.dumps(result, indent=2))
+    if args.out:
+        args.out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    if args.baseline:
+        msg = compare(result, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+        if msg:
+            print(f"[REGRESIÓN] {msg}", file=sys.stderr)
+            sys.exit(1)
+        print("[OK] Sin regresión de throughput")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+
+# -*- coding: utf-8 -*-
+"""
+Benchmark del servicio HTTP (`pdf_fields serve`) contra el mock de chat
+completions.
+
+Levanta el mock y el servicio en este proceso y dispara `--requests` uploads
+desde `--clients` clientes concurrentes. Cada PDF del lote se envía
+`--copies` veces (en orden mezclado), así que las copias que coinciden en el
+tiempo se resuelven con un solo cálculo. Los 429/503 se reintentan respetando
+`Retry-After`. Informa req/s, p50/p95 por request, respuestas por origen
+(scan/coalesced/cache), rechazos y requests al mock.
+
+    PYTHONPATH=src python -m benchmarks.serve --docs 20 --copies 3 --clients 8 --threads 4
+    PYTHONPATH=src python -m benchmarks.serve --queue-size 2 --clients 16   # backpressure
+"""
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from pdf_fields.config import Settings
+
+from .mock_llm import MockLLMServer
+from .run import percentile
+from .synth import make_corpus
+
+
+def _upload(base_url: str, name: str, data: bytes, stats: Counter, lock: threading.Lock,
+            max_attempts: int = 20):
+    """POST con reintentos ante 429/503. Devuelve (segundos, cuerpo o None)."""
+    t0 = time.perf_counter()
+    for _ in range(max_attempts):
+        req = urllib.request.Request(f"{base_url}/extract?archivo={name}", data=data, method="POST")
+        try:
+            with urllib.request.urlopen(req, timeout=300) as resp:
+                return time.perf_counter() - t0, json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            e.read()
+            with lock:
+                stats[f"http_{e.code}"] += 1
+            if e.code not in (429, 503):
+                return time.perf_counter() - t0, None
+            time.sleep(float(e.headers.get("Retry-After", "1")))
+    return time.perf_counter() - t0, None
+
+
+def run_serve_benchmark(cfg: Settings, mock: MockLLMServer, corpus: Path, copies: int,
+                        clients: int, seed: int = 0) -> dict:
+    from pdf_fields.server import ExtractionServer, ExtractionService
+
+    os.environ["OPENAI_BASE_URL"] = mock.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    pdfs = sorted(corpus.glob("*.pdf"))
+    uploads = [(p.name, p.read_bytes()) for p in pdfs for _ in range(max(1, copies))]
+    random.Random(seed).shuffle(uploads)
+
+    stats: Counter = Counter()
+    lock = threading.Lock()
+    latencies: List[float] = []
+    sources: Counter = Counter()
+    with ExtractionServer(ExtractionService(cfg)) as server:
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, clients)) as pool:
+            futures = [pool.submit(_upload, server.base_url, name, data, stats, lock)
+                       for name, data in uploads]
+            for fut in futures:
+                seconds, body = fut.result()
+                if body is not None:
+                    latencies.append(seconds)
+                    sources[body["source"]] += 1
+        wall = time.perf_counter() - t0
+        health = server.service.health()
+
+    return {
+        "docs": len(pdfs),
+        "requests": len(uploads),
+        "ok": len(latencies),
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(len(uploads) / wall, 3) if wall else 0.0,
+        "latency_p50_s": round(percentile(latencies, 0.50), 4),
+        "latency_p95_s": round(percentile(latencies, 0.95), 4),
+        "sources": dict(sources),
+        "rejected": dict(stats),
+        "avg_scan_s": health["avg_seconds"],
+        "mock_requests": mock.requests,
+        "mock_requests_per_doc": round(mock.requests / len(pdfs), 3) if pdfs else 0.0,
+        "mock_429": mock.rate_limited,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> Optional[str]:
+    base = baseline.get("requests_per_s") or 0.0
+    if base and result["requests_per_s"] < base * (1.0 - tolerance):
+        return f"req/s {result['requests_per_s']} < {base} (-{tolerance:.0%})"
+    return None
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark offline del servicio HTTP de pdf_fields")
+    p.add_argument("--corpus", type=Path, default=None, help="Carpeta con PDFs (si no, se genera uno temporal)")
+    p.add_argument("--docs", type=int, default=20)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--kinds", type=str, default="text,scanned,mixed")
+    p.add_argument("--max-pages", type=int, default=3)
+    p.add_argument("--copies", type=int, default=2, help="Veces que se envía cada PDF")
+    p.add_argument("--clients", type=int, default=8, help="Clientes HTTP concurrentes")
+    p.add_argument("--threads", type=int, default=4, help="Hilos de extracción del servicio")
+    p.add_argument("--queue-size", type=int, default=32)
+    p.add_argument("--async-llm", action="store_true")
+    p.add_argument("--max-in-flight", type=int, default=8)
+    p.add_argument("--batch-size", type=int, default=1)
+    p.add_argument("--batch-window-ms", type=float, default=0.0)
+    p.add_argument("--latency-ms", type=float, default=50.0)
+    p.add_argument("--jitter-ms", type=float, default=10.0)
+    p.add_argument("--rate-429", type=float, default=0.0)
+    p.add_argument("--cache", action="store_true", help="Habilita cache de resultados y memo (por defecto no)")
+    p.add_argument("--out", type=Path, default=None, help="Guarda el resultado en JSON")
+    p.add_argument("--baseline", type=Path, default=None, help="JSON previo para comparar")
+    p.add_argument("--tolerance", type=float, default=0.15)
+    args = p.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+
+    with tempfile.TemporaryDirectory(prefix="pdf_fields_serve_bench_") as tmp:
+        tmp = Path(tmp)
+        corpus = args.corpus
+        if corpus is None:
+            corpus = tmp / "corpus"
+            make_corpus(corpus, args.docs, seed=args.seed, kinds=tuple(args.kinds.split(",")),
+                        max_pages=args.max_pages)
+
+        cfg = Settings(input_dir=corpus, out_dir=tmp / "out")
+        cfg.llm_provider = "openai"
+        cfg.serve_threads = args.threads
+        cfg.serve_queue_size = args.queue_size
+        cfg.llm_async = args.async_llm
+        cfg.max_in_flight = args.max_in_flight
+        cfg.llm_batch_size = args.batch_size
+        cfg.llm_batch_window_ms = args.batch_window_ms
+        cfg.min_call_interval_s = 0.0
+        cfg.initial_backoff_s = 0.05
+        cfg.cache_enabled = args.cache
+        cfg.memo_enabled = args.cache
+        cfg.rate_ledger = tmp / "rate_ledger.json"
+
+        mock = MockLLMServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                             rate_429=args.rate_429, seed=args.seed)
+        with mock:
+            result = run_serve_benchmark(cfg, mock, corpus, args.copies, args.clients, args.seed)
+
+    print(json.dumps(result, indent=2))
+    if args.out:
+        args.out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    if args.baseline:
+        msg = compare(result, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+        if msg:
+            print(f"[REGRESIÓN] {msg}", file=sys.stderr)
+            sys.exit(1)
+        print("[OK] Sin regresión de throughput")
+
+
+if __name__ == "__main__":
+    main()
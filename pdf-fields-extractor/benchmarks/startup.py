@@ -0,0 +1,102 @@
+
+# -*- coding: utf-8 -*-
+"""
+Tiempo de arranque: cuánto tarda cada punto de entrada en importar lo suyo y
+qué dependencias pesadas termina cargando.
+
+Cada escenario corre en un intérprete nuevo (mediana de `--repeat` corridas);
+se mide desde antes del primer import del paquete.
+
+    PYTHONPATH=src python -m benchmarks.startup --repeat 7
+    PYTHONPATH=src python -m benchmarks.startup --out startup.json
+    PYTHONPATH=src python -m benchmarks.startup --baseline startup.json --tolerance 0.5
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from statistics import median
+from typing import Dict, Optional
+
+from .synth import make_corpus
+
+HEAVY = ("openai", "pandas", "openpyxl", "numpy", "PIL", "fitz")
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+{code}
+dt = time.perf_counter() - t0
+print(json.dumps({{"seconds": dt, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def scenarios(corpus: Path, out_dir: Path) -> Dict[str, str]:
+    text_only = (
+        "from pdf_fields.cli import main\n"
+        f"sys.argv = ['pdf_fields', '--input-dir', {str(corpus)!r}, '--out-dir', {str(out_dir)!r},\n"
+        "            '--text-only', '--no-xlsx', '--no-cache']\n"
+        "import contextlib, io\n"
+        "with contextlib.redirect_stdout(io.StringIO()):\n"
+        "    main()"
+    )
+    return {
+        "cli_help": "from pdf_fields.cli import build_parser\nbuild_parser().format_help()",
+        "text_only_run": text_only,
+        "import_pipeline": "import pdf_fields.pipeline",
+        "import_llm_provider": "import pdf_fields.llm_provider",
+    }
+
+
+def probe(code: str) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(SRC), env.get("PYTHONPATH")]))
+    out = subprocess.run([sys.executable, "-c", _PROBE.format(code=code, heavy=HEAVY)],
+                         env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(repeat: int = 5, corpus: Optional[Path] = None) -> Dict[str, dict]:
+    """{escenario: {"seconds": mediana, "heavy": módulos pesados cargados}}."""
+    with tempfile.TemporaryDirectory(prefix="pdf_fields_startup_") as tmp:
+        tmp = Path(tmp)
+        if corpus is None:
+            corpus = tmp / "corpus"
+            make_corpus(corpus, 2, seed=0, kinds=("text",), max_pages=2)
+        result = {}
+        for name, code in scenarios(corpus, tmp / "out").items():
+            runs = [probe(code) for _ in range(max(1, repeat))]
+            result[name] = {"seconds": round(median(r["seconds"] for r in runs), 4),
+                            "heavy": runs[-1]["heavy"]}
+    return result
+
+
+def main():
+    p = argparse.ArgumentParser(description="Tiempo de arranque de pdf_fields")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--out", type=Path, default=None, help="Guarda el resultado en JSON")
+    p.add_argument("--baseline", type=Path, default=None, help="JSON previo para comparar")
+    p.add_argument("--tolerance", type=float, default=0.5)
+    args = p.parse_args()
+
+    result = measure(args.repeat)
+    print(json.dumps(result, indent=2))
+    if args.out:
+        args.out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    if args.baseline:
+        base = json.loads(args.baseline.read_text(encoding="utf-8"))
+        slower = [name for name, r in result.items()
+                  if name in base and r["seconds"] > base[name]["seconds"] * (1.0 + args.tolerance)]
+        if slower:
+            print(f"[REGRESIÓN] Arranque más lento: {', '.join(slower)}", file=sys.stderr)
+            sys.exit(1)
+        print("[OK] Sin regresión de arranque")
+
+
+if __name__ == "__main__":
+    main()
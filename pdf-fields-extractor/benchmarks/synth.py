@@ -0,0 +1,216 @@
+
+# -*- coding: utf-8 -*-
+"""
+Generador de lotes sintéticos de PDFs para benchmarks.
+
+Tipos de documento:
+- "text":    todas las páginas con capa de texto
+- "scanned": páginas sólo imagen (sin texto embebido)
+- "mixed":   mezcla de páginas de texto y escaneadas
+- "stamped": formulario con etiquetas en texto y valores sólo imagen (sellos,
+             manuscritos) repetidos en cada página: muchos recortes por PDF
+
+Las anclas (Fecha/CUIT) se ubican en posiciones variables: valor a la
+derecha, valor debajo, ancla sin valor legible (sólo se resuelve por LLM) y
+páginas de relleno con ruido (teléfonos, CUITs inválidos). Con `layouts=N`
+los documentos salen de N "emisores" de formato fijo (misma posición de
+anclas y mismo productor en los metadatos), como en los lotes reales. Con
+`duplicates` se agregan copias de documentos ya generados: reenviadas (mismo
+contenido, otros bytes) o re-escaneadas (cada página rasterizada con
+corrimiento, rotación leve, ruido y JPEG).
+
+    python -m benchmarks.synth --out ./bench_corpus --docs 200 --seed 7
+"""
+from __future__ import annotations
+import argparse
+import io
+import json
+import random
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import fitz
+import numpy as np
+from PIL import Image
+
+from pdf_fields.extractors import cuit_check_digit
+
+DOC_KINDS = ("text", "scanned", "mixed")
+KINDS = DOC_KINDS + ("stamped",)
+FILLER = (
+    "Detalle de la prestación realizada en el domicilio indicado.",
+    "Observaciones: sin novedades.",
+    "Firma y aclaración del responsable.",
+    "Tel: 11-4567-8901  Int. 23",
+    "Ref. interna 20-00000000-0",
+)
+
+
+def random_cuit(rng: random.Random) -> str:
+    base = f"{rng.choice((20, 23, 27, 30))}{rng.randint(10000000, 99999999)}"
+    dv = cuit_check_digit(base + "0")
+    return f"{base[:2]}-{base[2:]}-{dv}"
+
+
+def random_date(rng: random.Random) -> str:
+    return f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2015, 2024)}"
+
+
+def _write_fields(page, rng: random.Random, fecha: Optional[str], cuit: Optional[str],
+                 pos: Optional[random.Random] = None) -> None:
+    # `pos` fija la posición de las anclas (formato de un emisor)
+    pos = pos or rng
+    y = pos.uniform(60, 140)
+    x = pos.uniform(50, 120)
+    layout = pos.choice(("right", "below", "label_only"))
+    for label, value in (("Fecha de visita:", fecha), ("CUIT:", cuit)):
+        page.insert_text((x, y), label, fontsize=11)
+        if value and layout == "right":
+            page.insert_text((x + 110, y), value, fontsize=11)
+        elif value and layout == "below":
+            page.insert_text((x, y + 16), value, fontsize=11)
+        y += pos.uniform(40, 90)
+
+
+def _value_image(page, x: float, y: float, value: str) -> None:
+    tmp = fitz.open()
+    tmp.new_page(width=100, height=16).insert_text((2, 12), value, fontsize=11)
+    pix = tmp[0].get_pixmap(matrix=fitz.Matrix(2, 2), colorspace=fitz.csGRAY, alpha=False)
+    page.insert_image(fitz.Rect(x, y - 12, x + 100, y + 4), pixmap=pix)
+    tmp.close()
+
+
+def _stamped_page(doc, rng, fecha, cuit, pos=None):
+    page = doc.new_page()
+    pos = pos or rng
+    y, x = pos.uniform(60, 140), pos.uniform(50, 120)
+    for label, value in (("Fecha de visita:", fecha), ("CUIT:", cuit)):
+        page.insert_text((x, y), label, fontsize=11)
+        _value_image(page, x + 110, y, value)
+        y += pos.uniform(40, 90)
+    _write_filler(page, rng)
+    return page
+
+
+def _write_filler(page, rng: random.Random) -> None:
+    y = rng.uniform(300, 420)
+    for _ in range(rng.randint(3, 8)):
+        page.insert_text((60, y), rng.choice(FILLER), fontsize=10)
+        y += 18
+
+
+def _text_page(doc, rng, fecha, cuit, pos=None):
+    page = doc.new_page()
+    if fecha or cuit:
+        _write_fields(page, rng, fecha, cuit, pos)
+    _write_filler(page, rng)
+    return page
+
+
+def _scanned_page(doc, rng, fecha, cuit, pos=None, zoom=2.0):
+    # Se dibuja una página de texto aparte y se inserta sólo su imagen
+    tmp = fitz.open()
+    _text_page(tmp, rng, fecha, cuit, pos)
+    pix = tmp[0].get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    page = doc.new_page(width=tmp[0].rect.width, height=tmp[0].rect.height)
+    page.insert_image(page.rect, pixmap=pix)
+    tmp.close()
+    return page
+
+
+def make_document(path: Path, rng: random.Random, kind: str, pages: int,
+                  issuer: Optional[int] = None) -> Dict:
+    fecha, cuit = random_date(rng), random_cuit(rng)
+    field_page = rng.randrange(pages)
+    doc = fitz.open()
+    for i in range(pages):
+        pos = random.Random(issuer) if issuer is not None else None
+        if kind == "stamped":
+            _stamped_page(doc, rng, fecha, cuit, pos)
+            continue
+        scanned = kind == "scanned" or (kind == "mixed" and rng.random() < 0.5)
+        values = (fecha, cuit) if i == field_page else (None, None)
+        (_scanned_page if scanned else _text_page)(doc, rng, *values, pos)
+    if issuer is not None:
+        doc.set_metadata({"producer": f"Emisor {issuer}", "creator": "synth"})
+    doc.save(path.as_posix(), garbage=3, deflate=True)
+    doc.close()
+    return {"archivo": path.name, "kind": kind, "pages": pages, "field_page": field_page,
+            "issuer": issuer, "fecha": fecha, "cuit": cuit}
+
+
+def _rescanned_page(doc, src_page, rng: random.Random) -> None:
+    pix = src_page.get_pixmap(matrix=fitz.Matrix(2, 2), colorspace=fitz.csGRAY, alpha=False)
+    a = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    a = np.roll(a.astype(np.float32), (rng.randint(-3, 3), rng.randint(-3, 3)), axis=(0, 1))
+    noise = np.random.default_rng(rng.randrange(1 << 30)).normal(0, 8, a.shape)
+    a = a * rng.uniform(0.9, 1.0) + rng.uniform(0, 15) + noise
+    img = Image.fromarray(np.clip(a, 0, 255).astype(np.uint8))
+    img = img.rotate(rng.uniform(-0.4, 0.4), resample=Image.BILINEAR, fillcolor=255)
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=70)
+    page = doc.new_page(width=src_page.rect.width, height=src_page.rect.height)
+    page.insert_image(page.rect, stream=buf.getvalue())
+
+
+def make_copy(src: Path, dst: Path, rng: random.Random, rescan: bool) -> None:
+    """Copia de `src`: re-escaneada (sólo imagen) o reenviada (otros metadatos)."""
+    doc = fitz.open(src.as_posix())
+    if rescan:
+        out = fitz.open()
+        for page in doc:
+            _rescanned_page(out, page, rng)
+        out.save(dst.as_posix(), garbage=3, deflate=True)
+        out.close()
+    else:
+        doc.set_metadata({**(doc.metadata or {}), "title": f"Reenvío {rng.randrange(10**6)}"})
+        doc.save(dst.as_posix(), garbage=3, deflate=True)
+    doc.close()
+
+
+def make_corpus(out_dir: Path, docs: int, seed: int = 0, kinds=DOC_KINDS,
+                min_pages: int = 1, max_pages: int = 6, layouts: int = 0,
+                duplicates: float = 0.0) -> List[Dict]:
+    """Genera `docs` PDFs en `out_dir` y un manifest.json con los valores esperados.
+
+    `layouts` > 0 reparte los documentos entre esa cantidad de formatos fijos.
+    `duplicates` agrega `docs * duplicates` copias (mitad re-escaneadas) de
+    documentos al azar, con los mismos valores esperados.
+    """
+    rng = random.Random(seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = []
+    for i in range(docs):
+        kind = kinds[i % len(kinds)]
+        pages = rng.randint(min_pages, max_pages)
+        issuer = rng.randrange(layouts) if layouts > 0 else None
+        manifest.append(make_document(out_dir / f"bench_{i:05d}.pdf", rng, kind, pages, issuer))
+    for i in range(docs, docs + round(docs * duplicates)):
+        src = manifest[rng.randrange(docs)]
+        rescan = rng.random() < 0.5
+        dst = out_dir / f"bench_{i:05d}.pdf"
+        make_copy(out_dir / src["archivo"], dst, rng, rescan)
+        manifest.append({**src, "archivo": dst.name, "copy_of": src["archivo"],
+                         "copy": "rescan" if rescan else "resend"})
+    (out_dir / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
+
+
+def main():
+    p = argparse.ArgumentParser(description="Genera PDFs sintéticos para benchmarks")
+    p.add_argument("--out", type=Path, required=True)
+    p.add_argument("--docs", type=int, default=100)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--kinds", type=str, default=",".join(DOC_KINDS), help="Tipos separados por coma: " + ",".join(KINDS))
+    p.add_argument("--min-pages", type=int, default=1)
+    p.add_argument("--max-pages", type=int, default=6)
+    p.add_argument("--layouts", type=int, default=0, help="Cantidad de formatos fijos (0 = posiciones al azar)")
+    p.add_argument("--duplicates", type=float, default=0.0, help="Copias reenviadas/re-escaneadas (fracción de --docs)")
+    args = p.parse_args()
+    manifest = make_corpus(args.out, args.docs, args.seed, tuple(args.kinds.split(",")),
+                           args.min_pages, args.max_pages, args.layouts, args.duplicates)
+    print(f"[OK] {len(manifest)} PDFs en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
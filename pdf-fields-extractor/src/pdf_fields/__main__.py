@@ -0,0 +1,6 @@
+
+# -*- coding: utf-8 -*-
+# python -m pdf_fields [watch|serve|merge] ...
+from .cli import main
+
+main()
@@ -0,0 +1,89 @@
+
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from .encoding import ImageLike
+from .llm_provider import BaseLLMProvider
+from .metrics import METRICS
+
+
+class Ticket:
+    """Un recorte encolado; `value` queda disponible cuando `done`."""
+
+    __slots__ = ("img", "field", "submitted", "value", "done")
+
+    def __init__(self, img: ImageLike, field: str):
+        self.img = img
+        self.field = field
+        self.submitted = time.monotonic()
+        self.value: Optional[str] = None
+        self.done = False
+
+
+class ClipBatcher:
+    """Junta recortes (de varias páginas o PDFs) y los envía en lotes.
+
+    Se envía un lote cuando hay `max_size` recortes pendientes o cuando el
+    más viejo esperó `window_s`. No hay hilo propio: quien pide resultados
+    que aún no salieron espera la ventana (por si otros hilos suman
+    recortes) y después envía lo pendiente. Con `window_s` = 0 se envía
+    apenas alguien espera, que es lo esperable con un único hilo.
+    """
+
+    def __init__(self, llm: BaseLLMProvider, max_size: int, window_s: float = 0.0):
+        self.llm = llm
+        self.max_size = max(1, max_size)
+        self.window_s = max(0.0, window_s)
+        self._pending: List[Ticket] = []
+        self._cond = threading.Condition()
+
+    def submit(self, img: ImageLike, field: str) -> Ticket:
+        ticket = Ticket(img, field)
+        with self._cond:
+            self._pending.append(ticket)
+            full = len(self._pending) >= self.max_size
+            batch = self._take() if full else []
+        if batch:
+            self._send(batch)
+        return ticket
+
+    def collect(self, tickets: List[Ticket]) -> List[Optional[str]]:
+        """Espera (y si hace falta envía) los lotes de `tickets`."""
+        while True:
+            with self._cond:
+                if all(t.done for t in tickets):
+                    return [t.value for t in tickets]
+                mine = [t for t in tickets if not t.done and t in self._pending]
+                if not mine:
+                    # ya los está enviando otro hilo
+                    self._cond.wait()
+                    continue
+                wait = self.window_s - (time.monotonic() - min(t.submitted for t in mine))
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                batch = self._take()
+            self._send(batch)
+
+    def _take(self) -> List[Ticket]:
+        batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+        return batch
+
+    def _send(self, batch: List[Ticket]) -> None:
+        METRICS.inc("batch.flushes")
+        METRICS.inc("batch.crops", len(batch))
+        values: List[Optional[str]] = [None] * len(batch)
+        try:
+            values = self.llm.extract_batch([(t.img, t.field) for t in batch])
+        finally:
+            with self._cond:
+                for t, val in zip(batch, values):
+                    t.value, t.done = val, True
+                    t.img = None
+                self._cond.notify_all()
+
+    def extract(self, jobs: List[Tuple[ImageLike, str]]) -> List[Optional[str]]:
+        return self.collect([self.submit(img, field) for img, field in jobs])
@@ -0,0 +1,138 @@
+
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from .config import Settings
+from .extractors import SEARCH_TERMS_CUIT, SEARCH_TERMS_FECHA
+
+log = logging.getLogger(__name__)
+
+# Subir este número invalida todas las entradas previas del cache
+CACHE_SCHEMA = 2
+
+
+def open_sqlite(path: Path, check_same_thread: bool = True) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path.as_posix(), timeout=30, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def settings_fingerprint(cfg: Settings) -> str:
+    """Hash de los ajustes que cambian el resultado de un PDF."""
+    relevant = {
+        "schema": CACHE_SCHEMA,
+        "provider": cfg.llm_provider,
+        "model": cfg.model_vision,
+        "zoom_clip": cfg.render_zoom_clip,
+        "zoom_full": cfg.render_zoom_full,
+        "max_rects": cfg.max_rects_per_anchor,
+        "scan": [cfg.scan_policy, cfg.scan_max_pages, cfg.full_page_fallbacks],
+        "years": [cfg.min_year, cfg.max_year],
+        "image": [cfg.image_format, cfg.image_quality, cfg.image_grayscale,
+                  cfg.image_max_pixels, cfg.image_max_bytes],
+        "anchors": [list(SEARCH_TERMS_FECHA), list(SEARCH_TERMS_CUIT)],
+        # cambian qué recorte ve el LLM o si se lo llama
+        "templates": cfg.templates_enabled,
+        "batch": cfg.llm_batch_size,
+        "page_dedup": cfg.page_dedup_enabled,
+    }
+    if cfg.text_only:
+        relevant["text_only"] = True
+    if cfg.zoom_ladder_clip or cfg.zoom_ladder_full:
+        relevant["zoom_ladder"] = [list(cfg.clip_zooms()), list(cfg.full_zooms())]
+    raw = json.dumps(relevant, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+class ResultCache:
+    """Cache persistente (SQLite) de resultados por contenido de PDF.
+
+    La clave es el SHA-256 del archivo más el fingerprint de los ajustes, así
+    que renombrar un PDF no invalida su entrada y cambiar modelo/zoom/años sí.
+    Guarda los candidatos crudos (todas las fechas y CUITs), no la fecha
+    elegida: la elección depende de "hoy" y se recalcula en cada corrida.
+    Se puede compartir entre hilos (servicio HTTP).
+    """
+
+    def __init__(self, path: Path, fingerprint: str):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_settings(cls, cfg: Settings) -> "ResultCache":
+        return cls(cfg.cache_path(), settings_fingerprint(cfg))
+
+    def key(self, pdf_path: Path) -> str:
+        return self.key_for_digest(file_sha256(pdf_path))
+
+    def key_for_digest(self, sha256: str) -> str:
+        return f"{sha256}:{self.fingerprint}"
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, payload: dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, payload, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+            self._conn.commit()
+
+    def evict(self, max_entries: int = 0, max_age_days: float = 0) -> int:
+        """Borra entradas sin uso hace más de `max_age_days` y/o las menos
+        usadas por encima de `max_entries` (0 = sin límite). Devuelve cuántas."""
+        removed = 0
+        if max_age_days > 0:
+            cutoff = time.time() - max_age_days * 86400
+            removed += self._conn.execute("DELETE FROM results WHERE last_used < ?", (cutoff,)).rowcount
+        if max_entries > 0:
+            removed += self._conn.execute(
+                "DELETE FROM results WHERE key NOT IN ("
+                " SELECT key FROM results ORDER BY last_used DESC LIMIT ?)",
+                (max_entries,),
+            ).rowcount
+        self._conn.commit()
+        return removed
+
+    def close(self) -> None:
+        self._conn.close()
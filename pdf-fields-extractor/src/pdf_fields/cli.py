@@ -4,47 +4,250 @@ from __future__ import annotations
 import argparse
 import logging
 import os
+import signal
+import sys
+import threading
 from pathlib import Path
 
-from .config import Settings
-from .pipeline import process_folder
+from .config import Settings, parse_shard, parse_zooms
 
-def build_parser() -> argparse.ArgumentParser:
+def _shard_arg(raw: str):
+    try:
+        return parse_shard(raw)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+def build_parser(input_required: bool = True) -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(description="Extractor de Fecha/CUIT desde PDFs (LLM Vision + PyMuPDF)")
-    p.add_argument("--input-dir", type=Path, required=True, help="Carpeta con PDFs de entrada")
+    p.add_argument("--input-dir", type=Path, required=input_required, help="Carpeta con PDFs de entrada")
     p.add_argument("--out-dir",   type=Path, required=True, help="Carpeta de salida")
     p.add_argument("--max-files", type=int, default=None, help="Máximo de PDFs a procesar (ej. 20)")
     p.add_argument("--model",     type=str, default=os.getenv("MODEL_VISION", "gpt-4o-mini"), help="Modelo Vision (ej. gpt-4o-mini)")
     p.add_argument("--provider",  type=str, default=os.getenv("LLM_PROVIDER", "openai"), choices=["openai","azure"], help="Proveedor LLM (openai/azure)")
+    p.add_argument("--workers",   type=int, default=int(os.getenv("WORKERS", "1")), help="Procesos en paralelo (1 = secuencial)")
+    p.add_argument("--text-only", action="store_true", default=os.getenv("TEXT_ONLY", "0") == "1", help="Sólo capa de texto y plantillas: no usa ni importa el cliente LLM")
+    p.add_argument("--async-llm", action="store_true", default=os.getenv("LLM_ASYNC", "0") == "1", help="Provider async con varias requests en vuelo")
+    p.add_argument("--max-in-flight", type=int, default=int(os.getenv("MAX_IN_FLIGHT", "4")), help="Requests LLM simultáneas (modo async)")
+    p.add_argument("--batch-size", type=int, default=int(os.getenv("LLM_BATCH_SIZE", "1")), help="Recortes por request al LLM (1 = uno por request)")
+    p.add_argument("--batch-window-ms", type=float, default=float(os.getenv("LLM_BATCH_WINDOW_MS", "0")), help="Espera máxima para completar un lote de recortes")
+    p.add_argument("--rpm",       type=int, default=int(os.getenv("REQUESTS_PER_MIN", "0")), help="Límite requests/min (0 = sin límite o el que informe la API)")
+    p.add_argument("--tpm",       type=int, default=int(os.getenv("TOKENS_PER_MIN", "0")), help="Límite tokens/min (0 = sin límite o el que informe la API)")
+    p.add_argument("--no-adaptive-rate", action="store_true", default=os.getenv("ADAPTIVE_RATE", "1") == "0", help="Desactivar el control de ritmo adaptativo compartido")
+    p.add_argument("--rate-ledger", type=Path, default=os.getenv("RATE_LEDGER") or None, help="Archivo del cupo compartido entre procesos (por defecto en el tmp)")
+    p.add_argument("--scan-policy", type=str, default=os.getenv("SCAN_POLICY", "all"), choices=["all","first-hit","first-n-pages"], help="Páginas a recorrer por documento")
+    p.add_argument("--scan-max-pages", type=int, default=int(os.getenv("SCAN_MAX_PAGES", "3")), help="Páginas a recorrer con --scan-policy first-n-pages")
+    p.add_argument("--full-page-fallbacks", type=int, default=int(os.getenv("FULL_PAGE_FALLBACKS", "-1")), help="Llamadas de página completa por documento (-1 = sin límite)")
+    p.add_argument("--zoom-ladder-clip", type=str, default=os.getenv("ZOOM_LADDER_CLIP", ""), help="Zooms progresivos para recortes, ej. 2.5,3.5,5 (vacío = RENDER_ZOOM_CLIP)")
+    p.add_argument("--zoom-ladder-full", type=str, default=os.getenv("ZOOM_LADDER_FULL", ""), help="Zooms progresivos para página completa, ej. 1.5,2.5 (vacío = RENDER_ZOOM_FULL)")
+    p.add_argument("--image-format", type=str, default=os.getenv("IMAGE_FORMAT", "png"), choices=["png","jpeg","webp"], help="Formato de las imágenes enviadas al LLM")
+    p.add_argument("--image-quality", type=int, default=int(os.getenv("IMAGE_QUALITY", "85")), help="Calidad JPEG/WebP (1-100)")
+    p.add_argument("--grayscale", action="store_true", default=os.getenv("IMAGE_GRAYSCALE", "0") == "1", help="Renderizar y enviar en escala de grises")
+    p.add_argument("--image-max-pixels", type=int, default=int(os.getenv("IMAGE_MAX_PIXELS", "0")), help="Máximo de pixeles por imagen (0 = sin límite)")
+    p.add_argument("--image-max-bytes", type=int, default=int(os.getenv("IMAGE_MAX_BYTES", "0")), help="Presupuesto de bytes por imagen (0 = sin límite)")
+    p.add_argument("--resume",    action="store_true", help="Saltear los PDFs ya registrados en el journal de out-dir")
+    p.add_argument("--shard",     type=_shard_arg, default=os.getenv("SHARD") or None, help="Procesar sólo la parte i de N del lote (ej. 2/4); deja un parcial y un manifest para merge")
+    p.add_argument("--no-cache",  action="store_true", help="No usar el cache de resultados por contenido")
+    p.add_argument("--no-memo",   action="store_true", help="No memoizar respuestas LLM por recorte")
+    p.add_argument("--no-templates", action="store_true", help="No aprender ni usar plantillas de layout")
+    p.add_argument("--no-page-dedup", action="store_true", help="No reusar resultados de páginas casi duplicadas (copias reenviadas o re-escaneadas)")
     p.add_argument("--no-csv",    action="store_true", help="No exportar CSV")
     p.add_argument("--no-xlsx",   action="store_true", help="No exportar XLSX")
+    p.add_argument("--parquet",   action="store_true", default=os.getenv("WRITE_PARQUET", "0") == "1", help="Exportar además Parquet (requiere pyarrow)")
+    p.add_argument("--prom-file", type=Path, default=os.getenv("PROM_FILE") or None, help="Escribir métricas en formato textfile de Prometheus")
+    p.add_argument("--profile",   action="store_true", help="Incluir en el reporte los tiempos de los PDFs más lentos")
     p.add_argument("--verbose",   action="store_true", help="Verbose logging")
     return p
 
-def main():
-    parser = build_parser()
-    args = parser.parse_args()
+def build_watch_parser() -> argparse.ArgumentParser:
+    p = build_parser()
+    p.prog = "pdf_fields watch"
+    p.description = "Vigila --input-dir y procesa cada PDF nuevo o modificado"
+    p.add_argument("--poll-interval", type=float, default=float(os.getenv("WATCH_POLL_S", "1.0")), help="Segundos entre sondeos (sin inotify o con --polling)")
+    p.add_argument("--polling", action="store_true", default=os.getenv("WATCH_POLLING", "0") == "1", help="Usar sondeo aunque haya inotify (ej. carpetas de red)")
+    p.add_argument("--rebuild-every", type=float, default=float(os.getenv("WATCH_REBUILD_S", "30")), help="Segundos entre regeneraciones de XLSX/Parquet con novedades")
+    return p
+
+def build_serve_parser() -> argparse.ArgumentParser:
+    p = build_parser(input_required=False)
+    p.prog = "pdf_fields serve"
+    p.description = "Servicio HTTP local: POST /extract con el PDF en el cuerpo"
+    p.add_argument("--host", type=str, default=os.getenv("SERVE_HOST", "127.0.0.1"), help="Dirección donde escuchar")
+    p.add_argument("--port", type=int, default=int(os.getenv("SERVE_PORT", "8080")), help="Puerto HTTP")
+    p.add_argument("--threads", type=int, default=int(os.getenv("SERVE_THREADS", "4")), help="Hilos de extracción (comparten provider y throttle)")
+    p.add_argument("--queue-size", type=int, default=int(os.getenv("SERVE_QUEUE_SIZE", "32")), help="PDFs en espera antes de responder 429")
+    p.add_argument("--request-timeout", type=float, default=float(os.getenv("SERVE_TIMEOUT_S", "120")), help="Segundos máximos por request (504 al vencer, 503 si la espera estimada lo supera)")
+    p.add_argument("--max-upload-mb", type=float, default=float(os.getenv("SERVE_MAX_UPLOAD_MB", "50")), help="Tamaño máximo del PDF (413 si lo supera)")
+    return p
 
+def build_merge_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(prog="pdf_fields merge",
+                                description="Une los parciales de --shard y verifica la cobertura del lote")
+    p.add_argument("--out-dir",   type=Path, required=True, help="Carpeta de salida (y de parciales, por defecto)")
+    p.add_argument("--parts",     type=Path, nargs="+", default=None, help="Carpetas con parciales y manifests (por defecto --out-dir)")
+    p.add_argument("--input-dir", type=Path, default=None, help="Verificar además contra el contenido actual de la carpeta")
+    p.add_argument("--max-files", type=int, default=None, help="El mismo --max-files de las corridas (con --input-dir)")
+    p.add_argument("--no-csv",    action="store_true", help="No exportar CSV")
+    p.add_argument("--no-xlsx",   action="store_true", help="No exportar XLSX")
+    p.add_argument("--parquet",   action="store_true", default=os.getenv("WRITE_PARQUET", "0") == "1", help="Exportar además Parquet (requiere pyarrow)")
+    p.add_argument("--verbose",   action="store_true", help="Verbose logging")
+    return p
+
+def _setup_logging(verbose: bool) -> None:
     logging.basicConfig(
-        level=logging.DEBUG if args.verbose else logging.INFO,
+        level=logging.DEBUG if verbose else logging.INFO,
         format="[%(levelname)s] %(message)s",
     )
 
-    cfg = Settings(
+def settings_from_args(args: argparse.Namespace) -> Settings:
+    return Settings(
         input_dir=args.input_dir,
         out_dir=args.out_dir,
         model_vision=args.model,
         max_files=args.max_files,
         write_csv=not args.no_csv,
         write_xlsx=not args.no_xlsx,
+        write_parquet=args.parquet,
         llm_provider=args.provider.lower(),
+        workers=max(1, args.workers),
+        llm_async=args.async_llm,
+        max_in_flight=max(1, args.max_in_flight),
+        llm_batch_size=max(1, args.batch_size),
+        llm_batch_window_ms=max(0.0, args.batch_window_ms),
+        requests_per_min=args.rpm,
+        tokens_per_min=args.tpm,
+        adaptive_rate=not args.no_adaptive_rate,
+        rate_ledger=args.rate_ledger,
+        scan_policy=args.scan_policy,
+        scan_max_pages=args.scan_max_pages,
+        full_page_fallbacks=args.full_page_fallbacks,
+        zoom_ladder_clip=parse_zooms(args.zoom_ladder_clip),
+        zoom_ladder_full=parse_zooms(args.zoom_ladder_full),
+        image_format=args.image_format,
+        image_quality=args.image_quality,
+        image_grayscale=args.grayscale,
+        image_max_pixels=args.image_max_pixels,
+        image_max_bytes=args.image_max_bytes,
+        resume=args.resume,
+        prom_file=args.prom_file,
+        profile=args.profile,
+        cache_enabled=not args.no_cache,
+        memo_enabled=not args.no_memo,
+        templates_enabled=not args.no_templates,
+        page_dedup_enabled=not args.no_page_dedup,
+        text_only=args.text_only,
+        shard=args.shard,
+    )
+
+def _no_shard(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    if args.shard is not None:
+        parser.error("--shard sólo aplica a corridas por lote")
+
+def merge_main(argv) -> None:
+    args = build_merge_parser().parse_args(argv)
+    _setup_logging(args.verbose)
+    cfg = Settings(
+        input_dir=args.input_dir,
+        out_dir=args.out_dir,
+        max_files=args.max_files,
+        write_csv=not args.no_csv,
+        write_xlsx=not args.no_xlsx,
+        write_parquet=args.parquet,
+        shard=None,
     )
-    res = process_folder(cfg)
-    print(f"[OK] Procesados {len(res)} PDFs")
+    from .shard import CoverageError, merge_shards
+    try:
+        summary = merge_shards(cfg, args.parts)
+    except CoverageError as e:
+        for problem in e.problems:
+            print(f"[ERROR] {problem}", file=sys.stderr)
+        print("[ERROR] Merge cancelado: no se escribieron salidas finales", file=sys.stderr)
+        sys.exit(1)
+    print(f"[OK] {summary['shards']} shards, {summary['rows']} filas, {len(summary['failures'])} fallas")
+    if cfg.write_csv:
+        print(f"[OK] CSV:  {cfg.csv_path()}")
+    if cfg.write_xlsx:
+        print(f"[OK] XLSX: {cfg.xlsx_path()}")
+    if cfg.write_parquet:
+        print(f"[OK] Parquet: {cfg.parquet_path()}")
+    print(f"[OK] Manifest: {cfg.manifest_path()}")
+
+def watch_main(argv) -> None:
+    parser = build_watch_parser()
+    args = parser.parse_args(argv)
+    _no_shard(parser, args)
+    _setup_logging(args.verbose)
+    cfg = settings_from_args(args)
+    # el journal se conserva: el modo watch siempre continúa lo registrado
+    cfg.resume = True
+    cfg.watch_poll_s = max(0.01, args.poll_interval)
+    cfg.watch_polling = args.polling
+    cfg.watch_rebuild_s = max(0.0, args.rebuild_every)
+
+    from .watch import WatchService
+    service = WatchService(cfg)
+
+    def _stop(signum, frame):
+        # el segundo Ctrl-C corta sin esperar lo que está en curso
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        service.stop()
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+    total = service.run()
+    print(f"[OK] {service.processed} PDFs procesados en modo watch ({total} filas en el journal)")
+
+def serve_main(argv) -> None:
+    parser = build_serve_parser()
+    args = parser.parse_args(argv)
+    _no_shard(parser, args)
+    _setup_logging(args.verbose)
+    cfg = settings_from_args(args)
+    # un único proceso: los hilos comparten provider, throttle y cupo
+    cfg.workers = 1
+    cfg.serve_host = args.host
+    cfg.serve_port = args.port
+    cfg.serve_threads = max(1, args.threads)
+    cfg.serve_queue_size = max(1, args.queue_size)
+    cfg.serve_timeout_s = max(1.0, args.request_timeout)
+    cfg.serve_max_upload_mb = args.max_upload_mb
+
+    from .server import ExtractionServer, ExtractionService
+    server = ExtractionServer(ExtractionService(cfg), cfg.serve_host, cfg.serve_port)
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    server.start()
+    print(f"[OK] Escuchando en {server.base_url} (POST /extract, GET /health, GET /metrics)")
+    stop.wait()
+    server.stop()
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ["watch"]:
+        return watch_main(argv[1:])
+    if argv[:1] == ["serve"]:
+        return serve_main(argv[1:])
+    if argv[:1] == ["merge"]:
+        return merge_main(argv[1:])
+    args = build_parser().parse_args(argv)
+    _setup_logging(args.verbose)
+    cfg = settings_from_args(args)
+    # el pipeline (PyMuPDF y compañía) recién se importa para procesar
+    from .pipeline import process_folder
+    total = process_folder(cfg)
+    print(f"[OK] Procesados {total} PDFs")
+    if cfg.shard is not None:
+        print(f"[OK] Parcial:  {cfg.partial_path()}")
+        print(f"[OK] Manifest: {cfg.manifest_path()}")
+        print(f"[OK] Reporte: {cfg.report_path()}")
+        return
     if cfg.write_csv:
         print(f"[OK] CSV:  {cfg.csv_path()}")
     if cfg.write_xlsx:
         print(f"[OK] XLSX: {cfg.xlsx_path()}")
+    if cfg.write_parquet:
+        print(f"[OK] Parquet: {cfg.parquet_path()}")
+    print(f"[OK] Reporte: {cfg.report_path()}")
 
 if __name__ == "__main__":
     main()
@@ -4,17 +4,36 @@ from __future__ import annotations
 import os
 from pathlib import Path
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Tuple
 
 # Valores por defecto razonables
 DEFAULT_MODEL_VISION = os.getenv("MODEL_VISION", "gpt-4o-mini")
 
+def parse_zooms(raw: Optional[str]) -> Tuple[float, ...]:
+    """"2,3.5,5" -> (2.0, 3.5, 5.0), ordenado de menor a mayor ("" = sin escalera)."""
+    if not raw:
+        return ()
+    return tuple(sorted({float(z) for z in raw.split(",") if z.strip()}))
+
+def parse_shard(raw: Optional[str]) -> Optional[Tuple[int, int]]:
+    """"2/4" -> (2, 4): shard 2 de 4, base 1 ("" = sin particionar)."""
+    if not raw:
+        return None
+    try:
+        i, n = (int(x) for x in raw.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard inválido: {raw!r} (formato i/N, ej. 2/4)") from None
+    if not 1 <= i <= n:
+        raise ValueError(f"Shard inválido: {raw!r} (se espera 1 <= i <= N)")
+    return i, n
+
 @dataclass
 class Settings:
     input_dir: Path
     out_dir: Path
     csv_name: str = "lote_resultados.csv"
     xlsx_name: str = "lote_resultados.xlsx"
+    parquet_name: str = "lote_resultados.parquet"
     model_vision: str = DEFAULT_MODEL_VISION
     max_files: Optional[int] = None
 
@@ -27,23 +46,163 @@ class Settings:
     # render zooms
     render_zoom_clip: float = float(os.getenv("RENDER_ZOOM_CLIP", "5.0"))
     render_zoom_full: float = float(os.getenv("RENDER_ZOOM_FULL", "2.5"))
+    # escalera progresiva: se prueba el zoom más bajo y se sube sólo si el
+    # valor no valida (vacío = un único nivel, el render_zoom_* de arriba)
+    zoom_ladder_clip: Tuple[float, ...] = parse_zooms(os.getenv("ZOOM_LADDER_CLIP"))
+    zoom_ladder_full: Tuple[float, ...] = parse_zooms(os.getenv("ZOOM_LADDER_FULL"))
+
+    # codificación de imágenes para el LLM
+    image_format: str = os.getenv("IMAGE_FORMAT", "png").lower()
+    image_quality: int = int(os.getenv("IMAGE_QUALITY", "85"))
+    image_grayscale: bool = os.getenv("IMAGE_GRAYSCALE", "0") == "1"
+    image_max_pixels: int = int(os.getenv("IMAGE_MAX_PIXELS", "0"))
+    image_max_bytes: int = int(os.getenv("IMAGE_MAX_BYTES", "0"))
 
     # anchors
     max_rects_per_anchor: int = int(os.getenv("MAX_RECTS_PER_ANCHOR", "2"))
 
+    # política de recorrido: "all" | "first-hit" | "first-n-pages"
+    scan_policy: str = os.getenv("SCAN_POLICY", "all").lower()
+    scan_max_pages: int = int(os.getenv("SCAN_MAX_PAGES", "3"))
+    # llamadas de página completa por documento (-1 = sin límite)
+    full_page_fallbacks: int = int(os.getenv("FULL_PAGE_FALLBACKS", "-1"))
+
     # output toggles
     write_csv: bool = os.getenv("WRITE_CSV", "1") != "0"
     write_xlsx: bool = os.getenv("WRITE_XLSX", "1") != "0"
+    # Parquet para cargas posteriores (requiere pyarrow)
+    write_parquet: bool = os.getenv("WRITE_PARQUET", "0") == "1"
 
     # fecha plausible
     min_year: int = int(os.getenv("MIN_YEAR", "1990"))
     max_year: int = int(os.getenv("MAX_YEAR", "2100"))
 
+    # journal de resultados (checkpoint) y reanudación
+    journal_name: str = "lote_journal.sqlite"
+    resume: bool = False
+
+    # corrida repartida entre nodos: (i, N) procesa sólo su parte del lote y
+    # deja un parcial + manifest para `pdf_fields merge`
+    shard: Optional[Tuple[int, int]] = parse_shard(os.getenv("SHARD"))
+    manifest_name: str = "lote_manifest.json"
+
+    # cache de resultados por contenido (SQLite dentro de out_dir)
+    cache_enabled: bool = os.getenv("RESULT_CACHE", "1") != "0"
+    cache_name: str = ".pdf_fields_cache.sqlite"
+    cache_max_entries: int = int(os.getenv("CACHE_MAX_ENTRIES", "0"))
+    cache_max_age_days: float = float(os.getenv("CACHE_MAX_AGE_DAYS", "0"))
+
+    # memo de respuestas LLM por recorte (LRU en memoria + SQLite en out_dir)
+    memo_enabled: bool = os.getenv("LLM_MEMO", "1") != "0"
+    memo_name: str = ".pdf_fields_memo.sqlite"
+    memo_lru_size: int = int(os.getenv("MEMO_LRU_SIZE", "512"))
+
+    # plantillas de layout aprendidas (SQLite dentro de out_dir)
+    templates_enabled: bool = os.getenv("LAYOUT_TEMPLATES", "1") != "0"
+    templates_name: str = ".pdf_fields_templates.sqlite"
+
+    # páginas casi duplicadas (SQLite dentro de out_dir): distancia máxima del
+    # pHash para ser candidata (-1 = sólo copias exactas) y pixeles de tinta
+    # sin pareja tolerados por bloque al confirmarla
+    page_dedup_enabled: bool = os.getenv("PAGE_DEDUP", "1") != "0"
+    page_dedup_name: str = ".pdf_fields_pages.sqlite"
+    page_dedup_max_distance: int = int(os.getenv("PAGE_DEDUP_MAX_DISTANCE", "8"))
+    page_dedup_max_ink: int = int(os.getenv("PAGE_DEDUP_MAX_INK", "4"))
+
+    # métricas: reporte JSON, textfile Prometheus opcional y perfil por PDF
+    report_name: str = "run_report.json"
+    prom_file: Optional[Path] = Path(os.environ["PROM_FILE"]) if os.getenv("PROM_FILE") else None
+    profile: bool = False
+    profile_top: int = int(os.getenv("PROFILE_TOP", "20"))
+
     # LLM provider: "openai" o "azure"
     llm_provider: str = os.getenv("LLM_PROVIDER", "openai").lower()
+    # sólo capa de texto: sin recortes ni página completa (no se crea el cliente)
+    text_only: bool = os.getenv("TEXT_ONLY", "0") == "1"
+
+    # paralelismo: cantidad de procesos (1 = secuencial)
+    workers: int = int(os.getenv("WORKERS", "1"))
+
+    # provider async: requests en vuelo y límites por minuto (0 = sin límite)
+    llm_async: bool = os.getenv("LLM_ASYNC", "0") == "1"
+    max_in_flight: int = int(os.getenv("MAX_IN_FLIGHT", "4"))
+    requests_per_min: int = int(os.getenv("REQUESTS_PER_MIN", "0"))
+    tokens_per_min: int = int(os.getenv("TOKENS_PER_MIN", "0"))
+    est_tokens_per_call: int = int(os.getenv("EST_TOKENS_PER_CALL", "1200"))
+
+    # lotes de recortes: varios por request (1 = uno por request) y ventana
+    # máxima de espera para juntar un lote entre páginas/PDFs
+    llm_batch_size: int = int(os.getenv("LLM_BATCH_SIZE", "1"))
+    llm_batch_window_ms: float = float(os.getenv("LLM_BATCH_WINDOW_MS", "0"))
+
+    # control adaptativo: headers x-ratelimit-*, ventana AIMD y cupo compartido
+    # por los procesos del host (ledger con lock; por defecto en el tmp del sistema)
+    adaptive_rate: bool = os.getenv("ADAPTIVE_RATE", "1") != "0"
+    rate_ledger: Optional[Path] = Path(os.environ["RATE_LEDGER"]) if os.getenv("RATE_LEDGER") else None
+
+    # modo watch: intervalo del sondeo (si no hay inotify o se fuerza), cada
+    # cuánto se regeneran XLSX/Parquet con novedades y forzar sondeo
+    watch_poll_s: float = float(os.getenv("WATCH_POLL_S", "1.0"))
+    watch_rebuild_s: float = float(os.getenv("WATCH_REBUILD_S", "30"))
+    watch_polling: bool = os.getenv("WATCH_POLLING", "0") == "1"
+
+    # servicio HTTP local (pdf_fields serve): hilos que comparten el provider,
+    # cola acotada de PDFs pendientes, espera máxima por request y tamaño
+    # máximo de un upload
+    serve_host: str = os.getenv("SERVE_HOST", "127.0.0.1")
+    serve_port: int = int(os.getenv("SERVE_PORT", "8080"))
+    serve_threads: int = int(os.getenv("SERVE_THREADS", "4"))
+    serve_queue_size: int = int(os.getenv("SERVE_QUEUE_SIZE", "32"))
+    serve_timeout_s: float = float(os.getenv("SERVE_TIMEOUT_S", "120"))
+    serve_max_upload_mb: float = float(os.getenv("SERVE_MAX_UPLOAD_MB", "50"))
+
+    def clip_zooms(self) -> Tuple[float, ...]:
+        return self.zoom_ladder_clip or (self.render_zoom_clip,)
+
+    def full_zooms(self) -> Tuple[float, ...]:
+        return self.zoom_ladder_full or (self.render_zoom_full,)
 
     def csv_path(self) -> Path:
         return self.out_dir / self.csv_name
 
     def xlsx_path(self) -> Path:
         return self.out_dir / self.xlsx_name
+
+    def parquet_path(self) -> Path:
+        return self.out_dir / self.parquet_name
+
+    def shard_suffix(self) -> str:
+        if self.shard is None:
+            return ""
+        i, n = self.shard
+        width = len(str(n))
+        return f".shard-{i:0{width}d}-of-{n}"
+
+    def _sharded(self, name: str) -> Path:
+        # lote_resultados.csv -> lote_resultados.shard-2-of-4.csv
+        p = Path(name)
+        return self.out_dir / f"{p.stem}{self.shard_suffix()}{p.suffix}"
+
+    def partial_path(self) -> Path:
+        return self._sharded(self.csv_name)
+
+    def manifest_path(self) -> Path:
+        return self._sharded(self.manifest_name)
+
+    def report_path(self) -> Path:
+        return self._sharded(self.report_name)
+
+    def journal_path(self) -> Path:
+        return self._sharded(self.journal_name)
+
+    def cache_path(self) -> Path:
+        return self.out_dir / self.cache_name
+
+    def memo_path(self) -> Path:
+        return self.out_dir / self.memo_name
+
+    def templates_path(self) -> Path:
+        return self.out_dir / self.templates_name
+
+    def page_index_path(self) -> Path:
+        return self.out_dir / self.page_dedup_name
@@ -0,0 +1,323 @@
+
+# -*- coding: utf-8 -*-
+"""
+Páginas casi duplicadas: reusar lo extraído entre documentos.
+
+Los lotes traen copias reenviadas o re-escaneadas del mismo documento. Si
+plantillas y capa de texto le dejan campos al LLM, antes de los recortes la
+página deja una huella:
+
+- Copia exacta: SHA-256 del texto normalizado (minúsculas, espacios
+  colapsados) y de los streams decodificados de sus imágenes, que es donde
+  quedan los valores sellados, manuscritos o escaneados. Una copia reenviada
+  (otros metadatos, otra compresión) coincide por igualdad.
+- Página escaneada (sin capa de texto): además, pHash de 64 bits de un render
+  a zoom bajo. El pHash sólo elige candidatos: dos formularios del mismo
+  emisor que difieren en un dígito quedan tan cerca como un re-escaneo. El
+  candidato se confirma con los mapas de tinta (render binarizado, alineado
+  por bloques con tolerancia de un pixel), con un límite estricto: ante la
+  duda se prefiere pagar la llamada a copiar un valor ajeno. Con
+  `max_distance` < 0 sólo se reusan copias exactas.
+
+Una página confirmada reusa las fechas/CUITs que la primera le pidió al LLM
+(la búsqueda es por los campos que aún faltan) y no pasa por recortes ni
+página completa. El índice vive en SQLite dentro de out_dir (lo comparten los
+workers) y sus entradas llevan el fingerprint de los ajustes: con otro modelo
+o zoom no se reusan.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import time
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+import fitz
+import numpy as np
+from PIL import Image
+
+from .cache import open_sqlite
+from .metrics import METRICS
+
+# Menos caracteres que esto = página escaneada (sin capa de texto útil)
+MIN_TEXT_CHARS = 16
+# pHash: render chico en gris, DCT de 32x32 y las 8x8 frecuencias más bajas
+PHASH_ZOOM = 0.25
+PHASH_SIZE = 8
+PHASH_FACTOR = 4
+# mapa de tinta para confirmar: zoom, umbral de gris y bloques
+INK_ZOOM = 2.0
+INK_THRESHOLD = 128
+INK_TILE = 48
+INK_SEARCH = 3       # corrimiento local por bloque (pixeles)
+INK_ALIGN = 12       # corrimiento global de la página (pixeles)
+# candidatos del pHash que se confirman como máximo por página
+MAX_CANDIDATES = 3
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def content_digest(page, text: str) -> str:
+    """Tamaño, texto normalizado e imágenes decodificadas de la página."""
+    h = hashlib.sha256()
+    h.update(f"{round(page.rect.width)}x{round(page.rect.height)}\n".encode("ascii"))
+    h.update(text.encode("utf-8"))
+    doc = page.parent
+    for xref, *_ in page.get_images(full=True):
+        h.update(b"\0" + hashlib.sha256(doc.xref_stream(xref) or b"").digest())
+    return h.hexdigest()
+
+
+def _gray(page, zoom: float) -> np.ndarray:
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    return np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    m[0] /= np.sqrt(2)
+    return m
+
+_DCT = _dct_matrix(PHASH_SIZE * PHASH_FACTOR)
+
+
+def perceptual_hash(page) -> str:
+    """pHash de 64 bits (hex) de un render a zoom bajo."""
+    n = PHASH_SIZE * PHASH_FACTOR
+    img = Image.fromarray(_gray(page, PHASH_ZOOM)).resize((n, n), Image.LANCZOS)
+    coeffs = (_DCT @ np.asarray(img, dtype=np.float64) @ _DCT.T)[:PHASH_SIZE, :PHASH_SIZE].ravel()
+    # sin el término de continua (brillo medio) en la mediana
+    bits = coeffs > np.median(coeffs[1:])
+    return np.packbits(bits).tobytes().hex()
+
+
+def ink_map(page) -> np.ndarray:
+    return _gray(page, INK_ZOOM) < INK_THRESHOLD
+
+
+def pack_ink(ink: np.ndarray) -> bytes:
+    h, w = ink.shape
+    return h.to_bytes(4, "big") + w.to_bytes(4, "big") + zlib.compress(np.packbits(ink).tobytes())
+
+
+def unpack_ink(blob: bytes) -> np.ndarray:
+    h, w = int.from_bytes(blob[:4], "big"), int.from_bytes(blob[4:8], "big")
+    bits = np.unpackbits(np.frombuffer(zlib.decompress(blob[8:]), np.uint8), count=h * w)
+    return bits.reshape(h, w).astype(bool)
+
+
+def _dilate(m: np.ndarray) -> np.ndarray:
+    out = m.copy()
+    out[1:] |= m[:-1]
+    out[:-1] |= m[1:]
+    wide = out.copy()
+    wide[:, 1:] |= out[:, :-1]
+    wide[:, :-1] |= out[:, 1:]
+    return wide
+
+
+def _best_offset(a: np.ndarray, b: np.ndarray, radius: int) -> int:
+    # corrimiento de `b` que mejor superpone dos perfiles de tinta
+    n = len(a)
+    best, best_s = -1.0, 0
+    for s in range(-radius, radius + 1):
+        v = float(np.dot(a[max(0, s):n + min(0, s)], b[max(0, -s):n + min(0, -s)]))
+        if v > best:
+            best, best_s = v, s
+    return best_s
+
+
+# corrimientos locales, del centro hacia afuera: casi siempre alcanza el (0, 0)
+_SHIFTS = sorted(((sy, sx) for sy in range(-INK_SEARCH, INK_SEARCH + 1)
+                  for sx in range(-INK_SEARCH, INK_SEARCH + 1)), key=lambda d: abs(d[0]) + abs(d[1]))
+
+
+def ink_mismatch(a: np.ndarray, b: np.ndarray, limit: Optional[int] = None) -> int:
+    """Peor bloque: pixeles de tinta de una página sin pareja (a un pixel) en
+    la otra, con el mejor corrimiento local de cada bloque.
+
+    Corta apenas un bloque supera `limit`.
+    """
+    if abs(a.shape[0] - b.shape[0]) > INK_ALIGN or abs(a.shape[1] - b.shape[1]) > INK_ALIGN:
+        return a.size
+    h, w = min(a.shape[0], b.shape[0]), min(a.shape[1], b.shape[1])
+    a, b = a[:h, :w], b[:h, :w]
+    dy = _best_offset(a.sum(1).astype(np.float64), b.sum(1).astype(np.float64), INK_ALIGN)
+    dx = _best_offset(a.sum(0).astype(np.float64), b.sum(0).astype(np.float64), INK_ALIGN)
+    b = np.roll(b, (dy, dx), axis=(0, 1))
+    a_wide, b_wide = _dilate(a), _dilate(b)
+    P = INK_SEARCH
+    bp, bp_wide = np.pad(b, P), np.pad(b_wide, P)
+    worst = 0
+    for y in range(0, h, INK_TILE):
+        for x in range(0, w, INK_TILE):
+            ta, ta_wide = a[y:y + INK_TILE, x:x + INK_TILE], a_wide[y:y + INK_TILE, x:x + INK_TILE]
+            if not ta.any() and not b[y:y + INK_TILE, x:x + INK_TILE].any():
+                continue
+            th, tw = ta.shape
+            best = None
+            for sy, sx in _SHIFTS:
+                tb = bp[y + P + sy:y + P + sy + th, x + P + sx:x + P + sx + tw]
+                tb_wide = bp_wide[y + P + sy:y + P + sy + th, x + P + sx:x + P + sx + tw]
+                m = int(np.count_nonzero(ta & ~tb_wide)) + int(np.count_nonzero(tb & ~ta_wide))
+                if best is None or m < best:
+                    best = m
+                if not best:
+                    break
+            worst = max(worst, best)
+            if limit is not None and worst > limit:
+                return worst
+    return worst
+
+
+@dataclass
+class PageFingerprint:
+    """Huella de una página: "text" (con capa de texto) o "image" (escaneada,
+    con pHash en hex).
+
+    El mapa de tinta de una página escaneada se calcula recién al confirmar un
+    candidato o al guardarla.
+    """
+    kind: str
+    digest: str
+    page: fitz.Page = field(repr=False)
+    phash: Optional[str] = None
+    _ink: Optional[np.ndarray] = field(default=None, repr=False)
+
+    def ink(self) -> np.ndarray:
+        if self._ink is None:
+            self._ink = ink_map(self.page)
+        return self._ink
+
+
+@dataclass
+class PageEntry:
+    """Lo que dio una página ya procesada (y cuántas imágenes fueron al LLM)."""
+    fields: List[str]
+    fechas: List[str]
+    cuits: List[str]
+    calls: int
+
+
+def _hamming(a: np.ndarray, b: int) -> np.ndarray:
+    x = a ^ np.uint64(b)
+    if hasattr(np, "bitwise_count"):    # numpy >= 2.0
+        return np.bitwise_count(x)
+    return np.unpackbits(x.view(np.uint8)).reshape(-1, 64).sum(1)
+
+
+class PageIndex:
+    """Huellas de páginas resueltas con LLM (SQLite en out_dir).
+
+    Los pHash se leen a memoria (los que agregan otros workers se levantan
+    en cada búsqueda por rowid) y se comparan todos contra todos en numpy;
+    los mapas de tinta quedan en disco hasta que hacen falta.
+    """
+
+    def __init__(self, path: Path, settings_fp: str, max_distance: int = 8, max_ink: int = 4):
+        self.path = path
+        self.settings_fp = settings_fp
+        self.max_distance = max_distance
+        self.max_ink = max_ink
+        self._conn = open_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " id INTEGER PRIMARY KEY,"
+            " fp TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " phash TEXT,"
+            " ink BLOB,"
+            " payload TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_digest ON pages (fp, digest)")
+        self._conn.commit()
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._last_id = 0
+
+    def fingerprint(self, page) -> PageFingerprint:
+        with METRICS.timer("stage.page_fingerprint"):
+            text = normalize_text(page.get_text("text") or "")
+            digest = content_digest(page, text)
+            if len(text) >= MIN_TEXT_CHARS:
+                fp = PageFingerprint("text", digest, page)
+            else:
+                phash = perceptual_hash(page) if self.max_distance >= 0 else None
+                fp = PageFingerprint("image", digest, page, phash)
+        METRICS.inc(f"dedup.fingerprints.{fp.kind}")
+        return fp
+
+    def lookup(self, fp: PageFingerprint, fields: List[str]) -> Optional[PageEntry]:
+        """Entrada de una página igual (o casi) que buscó al menos `fields`."""
+        rows = self._conn.execute("SELECT payload FROM pages WHERE fp = ? AND digest = ? ORDER BY id DESC",
+                                  (self.settings_fp, fp.digest)).fetchall()
+        entry = next((e for e in (self._entry(p) for p, in rows) if set(fields) <= set(e.fields)), None)
+        match = "exact"
+        if entry is None and fp.phash is not None:
+            entry, match = self._near_image(fp, fields), "near"
+        if entry is not None:
+            METRICS.inc(f"dedup.matches.{match}")
+            METRICS.inc("dedup.pages_reused")
+            METRICS.inc("dedup.llm_calls_avoided", entry.calls)
+        return entry
+
+    def _near_image(self, fp: PageFingerprint, fields: List[str]) -> Optional[PageEntry]:
+        self._refresh()
+        if not len(self._ids):
+            return None
+        dist = _hamming(self._hashes, int(fp.phash, 16))
+        close = np.flatnonzero(dist <= self.max_distance)
+        checked = 0
+        for i in close[np.argsort(dist[close], kind="stable")]:
+            payload, blob = self._conn.execute("SELECT payload, ink FROM pages WHERE id = ?",
+                                               (int(self._ids[i]),)).fetchone()
+            entry = self._entry(payload)
+            if not set(fields) <= set(entry.fields):
+                continue
+            METRICS.inc("dedup.ink_checks")
+            with METRICS.timer("stage.page_verify"):
+                mismatch = ink_mismatch(fp.ink(), unpack_ink(blob), limit=self.max_ink)
+            if mismatch <= self.max_ink:
+                return entry
+            METRICS.inc("dedup.ink_rejected")
+            checked += 1
+            if checked >= MAX_CANDIDATES:
+                break
+        return None
+
+    def _refresh(self) -> None:
+        rows = self._conn.execute(
+            "SELECT id, phash FROM pages WHERE id > ? AND fp = ? AND phash IS NOT NULL ORDER BY id",
+            (self._last_id, self.settings_fp)).fetchall()
+        if rows:
+            self._ids = np.concatenate([self._ids, np.array([r[0] for r in rows], dtype=np.int64)])
+            self._hashes = np.concatenate([self._hashes,
+                                           np.array([int(r[1], 16) for r in rows], dtype=np.uint64)])
+            self._last_id = rows[-1][0]
+
+    @staticmethod
+    def _entry(payload: str) -> PageEntry:
+        return PageEntry(**json.loads(payload))
+
+    def remember(self, fp: PageFingerprint, fields: List[str], fechas: List[str],
+                 cuits: List[str], calls: int) -> None:
+        entry = PageEntry(list(fields), fechas if "fecha" in fields else [],
+                          cuits if "cuit" in fields else [], calls)
+        ink = pack_ink(fp.ink()) if fp.phash is not None else None
+        self._conn.execute(
+            "INSERT INTO pages (fp, kind, digest, phash, ink, payload, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.settings_fp, fp.kind, fp.digest, fp.phash, ink, json.dumps(entry.__dict__), time.time()),
+        )
+        self._conn.commit()
+        METRICS.inc("dedup.pages_learned")
+
+    def close(self) -> None:
+        self._conn.close()
+
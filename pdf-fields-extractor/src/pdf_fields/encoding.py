@@ -0,0 +1,114 @@
+
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import base64
+import io
+import math
+from dataclasses import dataclass
+from typing import Tuple, Union
+
+import fitz                       # PyMuPDF
+from PIL import Image
+
+from .metrics import METRICS
+
+# PIL o pixmap de PyMuPDF (los recortes de PageRaster)
+ImageLike = Union[Image.Image, fitz.Pixmap]
+
+_MIME = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+_PIL_FORMAT = {"png": "PNG", "jpeg": "JPEG", "webp": "WEBP"}
+
+
+def pixmap_to_pil(pix: fitz.Pixmap) -> Image.Image:
+    mode = "L" if pix.n == 1 else "RGB"
+    return Image.frombytes(mode, [pix.width, pix.height], pix.samples)
+
+
+def image_size(img: ImageLike) -> Tuple[int, int]:
+    if isinstance(img, fitz.Pixmap):
+        return img.width, img.height
+    return img.size
+
+
+@dataclass
+class ImageEncoder:
+    """Codifica recortes para la API de visión.
+
+    - `fmt`: "png" (sin pérdida), "jpeg" o "webp" (con `quality`)
+    - `grayscale`: manda un solo canal (fecha/CUIT no necesitan color)
+    - `max_pixels`: reduce la imagen hasta ese total de pixeles (0 = sin límite)
+    - `max_bytes`: baja calidad y luego resolución hasta entrar en el
+      presupuesto (0 = sin límite; es un objetivo, no una garantía)
+
+    Acepta `PIL.Image` o directamente el `fitz.Pixmap` renderizado (los
+    recortes de `PageRaster`); en ese caso, si no hace falta redimensionar,
+    PNG/JPEG salen del propio pixmap sin pasar por una copia PIL.
+    """
+    fmt: str = "png"
+    quality: int = 85
+    grayscale: bool = False
+    max_pixels: int = 0
+    max_bytes: int = 0
+
+    def __post_init__(self):
+        self.fmt = self.fmt.lower().replace("jpg", "jpeg")
+        if self.fmt not in _MIME:
+            raise ValueError(f"Formato de imagen no soportado: {self.fmt}")
+
+    def signature(self) -> str:
+        """Identifica los ajustes que cambian lo que ve el modelo."""
+        return f"{self.fmt}:{self.quality}:{int(self.grayscale)}:{self.max_pixels}:{self.max_bytes}"
+
+    def encode(self, img: ImageLike) -> Tuple[str, int]:
+        """Devuelve (data URL, bytes de la imagen codificada)."""
+        with METRICS.timer("stage.encode"):
+            raw = self._encode_bytes(img)
+        b64 = base64.b64encode(raw).decode("ascii")
+        return f"data:{_MIME[self.fmt]};base64,{b64}", len(raw)
+
+    def _encode_bytes(self, img: ImageLike) -> bytes:
+        if isinstance(img, fitz.Pixmap):
+            if self.grayscale and img.n != 1:
+                img = fitz.Pixmap(fitz.csGRAY, img)
+            if not self._too_many_pixels(img.width, img.height) and self.fmt in ("png", "jpeg"):
+                raw = img.tobytes("png") if self.fmt == "png" else img.tobytes("jpg", jpg_quality=self.quality)
+                if not self.max_bytes or len(raw) <= self.max_bytes:
+                    return raw
+            img = pixmap_to_pil(img)
+
+        if self.grayscale and img.mode != "L":
+            img = img.convert("L")
+        elif img.mode not in ("L", "RGB"):
+            img = img.convert("RGB")
+        if self._too_many_pixels(*img.size):
+            scale = math.sqrt(self.max_pixels / float(img.size[0] * img.size[1]))
+            img = self._resize(img, scale)
+
+        quality = self.quality
+        raw = self._save(img, quality)
+        # Presupuesto de bytes: primero calidad (formatos con pérdida), luego tamaño
+        for _ in range(8):
+            if not self.max_bytes or len(raw) <= self.max_bytes:
+                break
+            if self.fmt != "png" and quality > 40:
+                quality = max(40, quality - 15)
+            else:
+                img = self._resize(img, 0.75)
+            raw = self._save(img, quality)
+        return raw
+
+    def _too_many_pixels(self, w: int, h: int) -> bool:
+        return bool(self.max_pixels) and w * h > self.max_pixels
+
+    @staticmethod
+    def _resize(img: Image.Image, scale: float) -> Image.Image:
+        size = (max(1, int(img.size[0] * scale)), max(1, int(img.size[1] * scale)))
+        return img.resize(size, Image.LANCZOS)
+
+    def _save(self, img: Image.Image, quality: int) -> bytes:
+        buf = io.BytesIO()
+        if self.fmt == "png":
+            img.save(buf, format="PNG")
+        else:
+            img.save(buf, format=_PIL_FORMAT[self.fmt], quality=quality)
+        return buf.getvalue()
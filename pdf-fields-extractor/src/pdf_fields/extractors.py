@@ -2,12 +2,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 import re
+from bisect import bisect_right
 from datetime import datetime, date
-from typing import List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 import fitz                       # PyMuPDF
-from PIL import Image
 from pathlib import Path
 
+from .metrics import METRICS
+
 DATE_STRICT = re.compile(r"\b(\d{2})\D?(\d{2})\D?(\d{2}|\d{4})\b")
 CUIT_RE     = re.compile(r"\b(\d{2})\D?(\d{8})\D?(\d)\b")
 
@@ -22,6 +24,22 @@ SEARCH_TERMS_CUIT = (
     "CUIL", "C.U.I.L", "C.U.I.L.", "C.U.I.L:", "CUIL:",
 )
 
+ANCHOR_TERMS = {
+    "fecha": SEARCH_TERMS_FECHA,
+    "cuit":  SEARCH_TERMS_CUIT,
+}
+
+def _anchor_regex(terms_by_field: Dict[str, Tuple[str, ...]]) -> re.Pattern:
+    # Un solo patrón con un grupo por campo; las variantes de mayúsculas se
+    # resuelven con IGNORECASE y, dentro de cada campo, gana el término más largo.
+    parts = []
+    for field, terms in terms_by_field.items():
+        uniq = sorted({t.lower() for t in terms}, key=len, reverse=True)
+        parts.append(f"(?P<{field}>" + "|".join(re.escape(t) for t in uniq) + ")")
+    return re.compile("|".join(parts), re.IGNORECASE)
+
+ANCHOR_RE = _anchor_regex(ANCHOR_TERMS)
+
 def normalize_date(dd: str, mm: str, yy: str, min_year: int, max_year: int) -> Optional[str]:
     try:
         d, m, y = int(dd), int(mm), int(yy)
@@ -62,6 +80,32 @@ def normalize_cuit_textlike(text: str) -> Optional[str]:
         return None
     return f"{p1}-{p2}-{p3}"
 
+def iter_date_candidates(text: str, min_year: int, max_year: int) -> Iterator[Tuple[str, int, int]]:
+    """Todas las fechas válidas del texto: (DD/MM/YYYY, inicio, fin)."""
+    for m in DATE_STRICT.finditer(text or ""):
+        val = normalize_date(m.group(1), m.group(2), m.group(3), min_year, max_year)
+        if val:
+            yield val, m.start(), m.end()
+
+def iter_cuit_candidates(text: str) -> Iterator[Tuple[str, int, int]]:
+    """Todos los CUIT/CUIL con dígito verificador correcto: (NN-NNNNNNNN-N, inicio, fin)."""
+    for m in CUIT_RE.finditer(text or ""):
+        p1, p2, p3 = m.groups()
+        dv = cuit_check_digit(f"{p1}{p2}{p3}")
+        if dv is not None and dv == int(p3):
+            yield f"{p1}-{p2}-{p3}", m.start(), m.end()
+
+def _anchor_distance(anchor: fitz.Rect, cand: fitz.Rect) -> float:
+    # Los valores suelen estar a la derecha o debajo de la etiqueta:
+    # distancia del borde derecho del ancla al inicio del candidato,
+    # penalizando lo que queda arriba o a la izquierda.
+    dx = cand.x0 - anchor.x1
+    dy = (cand.y0 + cand.y1) / 2 - (anchor.y0 + anchor.y1) / 2
+    dist = (max(dx, 0.0) ** 2 + dy ** 2) ** 0.5
+    if cand.y1 < anchor.y0 or cand.x1 < anchor.x0:
+        dist += 1000.0
+    return dist
+
 def clip_right_rect(page, rect: fitz.Rect) -> fitz.Rect:
     RIGHT_WIDTH_FACTOR   = 6.0
     EXTRA_TOP_FACTOR     = 0.5
@@ -76,24 +120,194 @@ def clip_right_rect(page, rect: fitz.Rect) -> fitz.Rect:
         min(page.rect.y1, rect.y1 + extra_bottom),
     )
 
-def render(page, clip_rect=None, zoom=2.5) -> Image.Image:
-    mat = fitz.Matrix(zoom, zoom)
-    pix = page.get_pixmap(matrix=mat, clip=clip_rect, alpha=False) if clip_rect else page.get_pixmap(matrix=mat, alpha=False)
-    return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+class PageRaster:
+    """Rasterizaciones de una página reutilizadas entre recortes.
+
+    La página se interpreta una sola vez (display list) y, por cada zoom, se
+    rasteriza como mucho una región que cubre todos los recortes planificados
+    con `plan()`; cada recorte se devuelve como `fitz.Pixmap` copiado de ese
+    buffer, pixel a pixel igual a renderizar el recorte por separado (y el
+    encoder lo pasa a PNG/JPEG sin pasar por PIL). Si los
+    recortes están muy dispersos, la unión desperdiciaría pixeles: entonces
+    se rasteriza sólo cada recorte pedido. `close()` libera los buffers.
+    """
+
+    # unión de recortes aceptable frente a la suma de sus áreas
+    MAX_UNION_OVERHEAD = 2.0
+
+    def __init__(self, page, gray: bool = False):
+        self.page = page
+        self.gray = gray
+        self._dl = None
+        self._planned: Dict[float, List[fitz.Rect]] = {}
+        self._regions: Dict[float, List[Tuple[fitz.IRect, fitz.Pixmap]]] = {}
+
+    def plan(self, zoom: float, rects: List[fitz.Rect]) -> None:
+        """Anota los recortes que se van a pedir a este zoom (se rasteriza al primer crop)."""
+        self._planned.setdefault(zoom, []).extend(rects)
+
+    def _render(self, zoom: float, clip: Optional[fitz.Rect]):
+        if self._dl is None:
+            self._dl = self.page.get_displaylist()
+        cs = fitz.csGRAY if self.gray else fitz.csRGB
+        with METRICS.timer("stage.render"):
+            pix = self._dl.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=cs, alpha=False, clip=clip)
+        region = (fitz.IRect(pix.irect), pix)
+        self._regions.setdefault(zoom, []).append(region)
+        return region
+
+    def _planned_union(self, zoom: float, clip: fitz.Rect) -> fitz.Rect:
+        planned = self._planned.pop(zoom, [])
+        if not planned:
+            return clip
+        union = fitz.Rect(clip)
+        for r in planned:
+            union |= r
+        area = sum(abs(r) for r in planned) or 1.0
+        return union if abs(union) <= area * self.MAX_UNION_OVERHEAD else clip
+
+    def crop(self, clip: Optional[fitz.Rect], zoom: float) -> fitz.Pixmap:
+        """Recorte (o página completa si `clip` es None) como pixmap."""
+        if clip is None:
+            target = fitz.IRect((self.page.rect * fitz.Matrix(zoom, zoom)).irect)
+        else:
+            clip = fitz.Rect(clip) & self.page.rect
+            target = (clip * fitz.Matrix(zoom, zoom)).irect
+        for irect, pix in self._regions.get(zoom, []):
+            if target in irect:
+                break
+        else:
+            irect, pix = self._render(zoom, None if clip is None else self._planned_union(zoom, clip))
+        METRICS.inc("raster.crops")
+        if irect == target:
+            return pix
+        # copia sólo la región del recorte (mismas coordenadas de pixel)
+        out = fitz.Pixmap(pix.colorspace, target, False)
+        out.copy(pix, target)
+        return out
+
+    def close(self) -> None:
+        self._regions.clear()
+        self._planned.clear()
+        self._dl = None
 
 def dedup_rects(rects, tol=1.0):
+    # Agrupa por celdas de tamaño `tol` (lineal, en lugar de comparar de a pares)
+    seen = set()
     uniq = []
     for r in rects:
-        is_dup = False
-        for u in uniq:
-            if (abs(r.x0 - u.x0) < tol and abs(r.y0 - u.y0) < tol and
-                abs(r.x1 - u.x1) < tol and abs(r.y1 - u.y1) < tol):
-                is_dup = True
-                break
-        if not is_dup:
+        key = (round(r.x0 / tol), round(r.y0 / tol), round(r.x1 / tol), round(r.y1 / tol))
+        if key not in seen:
+            seen.add(key)
             uniq.append(r)
     return uniq
 
+class AnchorIndex:
+    """Anclas de una página a partir de una sola extracción de palabras.
+
+    Arma el texto de la página con `get_text("words")` (palabras separadas por
+    espacio, líneas por salto de línea) y busca todas las anclas de todos los
+    campos en una única pasada de regex. Cada coincidencia se traduce al
+    rectángulo de las palabras que cubre, recortado a los caracteres del
+    término (como `page.search_for`).
+    """
+
+    def __init__(self, words):
+        self.words = words
+        self.text, self._starts, self._ends = self._layout(words)
+        self._rects: Dict[str, List[fitz.Rect]] = {field: [] for field in ANCHOR_TERMS}
+        self._labels: Dict[Tuple[float, ...], str] = {}
+        for m in ANCHOR_RE.finditer(self.text):
+            rect = self._span_rect(m.start(), m.end())
+            self._rects[m.lastgroup].append(rect)
+            self._labels.setdefault(tuple(rect), m.group(0))
+        for field, rects in self._rects.items():
+            rects = dedup_rects(rects)
+            rects.sort(key=lambda r: (r.y0, r.x0))
+            self._rects[field] = rects
+
+    @classmethod
+    def from_page(cls, page) -> "AnchorIndex":
+        with METRICS.timer("stage.text_extract"):
+            words = page.get_text("words") or []
+        with METRICS.timer("stage.anchor_index"):
+            return cls(words)
+
+    @staticmethod
+    def _layout(words):
+        chunks, starts, ends = [], [], []
+        pos, prev_line = 0, None
+        for w in words:
+            line = (w[5], w[6])
+            if prev_line is not None:
+                chunks.append(" " if line == prev_line else "\n")
+                pos += 1
+            prev_line = line
+            starts.append(pos)
+            chunks.append(w[4])
+            pos += len(w[4])
+            ends.append(pos)
+        return "".join(chunks), starts, ends
+
+    def _span_rect(self, start: int, end: int) -> fitz.Rect:
+        first = bisect_right(self._starts, start) - 1
+        last = bisect_right(self._starts, end - 1) - 1
+        rect = fitz.Rect()
+        for i in range(first, last + 1):
+            x0, y0, x1, y1 = self.words[i][:4]
+            ws, we = self._starts[i], self._ends[i]
+            n = max(1, we - ws)
+            # posición aproximada de los caracteres dentro de la palabra
+            cx0 = x0 + (x1 - x0) * max(0, start - ws) / n
+            cx1 = x0 + (x1 - x0) * (min(we, end) - ws) / n
+            rect |= fitz.Rect(cx0, y0, cx1, y1)
+        return rect
+
+    def rects(self, field: str) -> List[fitz.Rect]:
+        return self._rects.get(field, [])
+
+    def text_candidates(self, field: str, min_year: int, max_year: int) -> List[str]:
+        """Valores válidos de la capa de texto, del más cercano a un ancla al más lejano.
+
+        Recorre todas las coincidencias (no sólo la primera), descarta fechas
+        fuera de rango y CUITs con dígito verificador incorrecto. Sin anclas en
+        la página se conserva el orden de aparición.
+        """
+        return [val for val, _, _ in self._ranked(field, min_year, max_year)]
+
+    def _ranked(self, field: str, min_year: int, max_year: int) -> List[Tuple[str, int, int]]:
+        if field == "fecha":
+            found = list(iter_date_candidates(self.text, min_year, max_year))
+        else:
+            found = list(iter_cuit_candidates(self.text))
+        anchors = self._rects.get(field, [])
+        if anchors and len(found) > 1:
+            found.sort(key=lambda c: min(_anchor_distance(a, self._span_rect(c[1], c[2])) for a in anchors))
+        return found
+
+    def best_text_value(self, field: str, min_year: int, max_year: int) -> Optional[str]:
+        cands = self.text_candidates(field, min_year, max_year)
+        return cands[0] if cands else None
+
+    def best_text_match(self, field: str, min_year: int, max_year: int) -> Optional[Tuple[str, fitz.Rect]]:
+        """Como `best_text_value`, pero también con el rect del valor en la página."""
+        ranked = self._ranked(field, min_year, max_year)
+        if not ranked:
+            return None
+        val, start, end = ranked[0]
+        return val, self._span_rect(start, end)
+
+    def nearest_anchor(self, field: str, rect: fitz.Rect) -> Optional[Tuple[fitz.Rect, str]]:
+        """Ancla del campo más cercana a `rect` y su texto tal como aparece."""
+        anchors = self._rects.get(field, [])
+        if not anchors:
+            return None
+        best = min(anchors, key=lambda a: _anchor_distance(a, rect))
+        return best, self.label(best)
+
+    def label(self, anchor: fitz.Rect) -> str:
+        return self._labels.get(tuple(anchor), "")
+
 def pick_closest_past_date(fechas_str: List[str], hoy: Optional[date] = None) -> Optional[str]:
     if hoy is None:
         hoy = date.today()
@@ -0,0 +1,99 @@
+
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+
+from .cache import open_sqlite
+from .writers import ColumnWidths
+
+COLUMNS = ["archivo", "fecha_ddmmyyyy", "cuit"]
+
+
+class Journal:
+    """Registro persistente de resultados por archivo (SQLite en out_dir).
+
+    Cada fila se confirma apenas se obtiene, así que si la corrida se corta
+    sólo se pierde el PDF en curso. Con `--resume` se saltean los archivos ya
+    registrados y las salidas CSV/XLSX se arman leyendo el journal en orden de
+    nombre, sin acumular resultados en memoria. `widths` lleva el ancho de
+    cada columna para el XLSX (las filas previas se miden con SQL al abrir).
+    Las filas de un PDF que no se pudo abrir o cuyas llamadas al LLM fallaron
+    se guardan con `ok = 0`: salen vacías en las salidas, pero `--resume` las
+    vuelve a procesar.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn = open_sqlite(path)
+        # cada fila cuenta: que sobreviva también a un corte de energía
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            " archivo TEXT PRIMARY KEY,"
+            " fecha_ddmmyyyy TEXT NOT NULL,"
+            " cuit TEXT NOT NULL,"
+            " ts REAL NOT NULL,"
+            " ok INTEGER NOT NULL DEFAULT 1)"
+        )
+        # journals de versiones anteriores (sin la marca de fallo)
+        cols = [r[1] for r in self._conn.execute("PRAGMA table_info(rows)")]
+        if "ok" not in cols:
+            self._conn.execute("ALTER TABLE rows ADD COLUMN ok INTEGER NOT NULL DEFAULT 1")
+        self._conn.commit()
+        self.widths = ColumnWidths(COLUMNS)
+        self.widths.seed(self.max_lengths())
+
+    def reset(self) -> None:
+        self._conn.execute("DELETE FROM rows")
+        self._conn.commit()
+        self.widths = ColumnWidths(COLUMNS)
+
+    def has(self, archivo: str) -> bool:
+        """True si el archivo ya tiene un resultado válido (no un fallo)."""
+        sql = "SELECT 1 FROM rows WHERE archivo = ? AND ok"
+        return self._conn.execute(sql, (archivo,)).fetchone() is not None
+
+    def append(self, row: dict, ok: bool = True) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO rows (archivo, fecha_ddmmyyyy, cuit, ts, ok) VALUES (?, ?, ?, ?, ?)",
+            (row["archivo"], row["fecha_ddmmyyyy"], row["cuit"], time.time(), int(ok)),
+        )
+        self._conn.commit()
+        self.widths.observe(row)
+
+    def extend(self, rows: Iterable[dict]) -> int:
+        """Carga masiva en una sola transacción (p.ej. al unir parciales)."""
+        n = 0
+
+        def _values():
+            nonlocal n
+            now = time.time()
+            for row in rows:
+                self.widths.observe(row)
+                n += 1
+                yield row["archivo"], row["fecha_ddmmyyyy"], row["cuit"], now
+
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO rows (archivo, fecha_ddmmyyyy, cuit, ts) VALUES (?, ?, ?, ?)",
+            _values(),
+        )
+        self._conn.commit()
+        return n
+
+    def max_lengths(self) -> Dict[str, int]:
+        sql = "SELECT " + ", ".join(f"max(length({c}))" for c in COLUMNS) + " FROM rows"
+        return {c: n or 0 for c, n in zip(COLUMNS, self._conn.execute(sql).fetchone())}
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def rows(self) -> Iterator[dict]:
+        """Filas ordenadas por nombre de archivo (mismo orden que el glob)."""
+        cur = self._conn.execute("SELECT archivo, fecha_ddmmyyyy, cuit FROM rows ORDER BY archivo")
+        for archivo, fecha, cuit in cur:
+            yield {"archivo": archivo, "fecha_ddmmyyyy": fecha, "cuit": cuit}
+
+    def close(self) -> None:
+        self._conn.close()
@@ -1,25 +1,39 @@
 
 # -*- coding: utf-8 -*-
 from __future__ import annotations
+import asyncio
 import json
+import logging
 import random
+import re
+import threading
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, Dict, List, Optional, Tuple
 
-from PIL import Image
-import io, base64
-
 # OpenAI oficial (funciona para Vision con chat.completions)
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import openai
 
+from .encoding import ImageEncoder, ImageLike, image_size
+from .metrics import METRICS
+from .ratelimit import RateController, RateLimitInfo
+
+log = logging.getLogger(__name__)
+
 
-def pil_to_data_url(pil_img: Image.Image) -> str:
-    buf = io.BytesIO()
-    pil_img.save(buf, format="PNG")
-    b64 = base64.b64encode(buf.getvalue()).decode("ascii")
-    return f"data:image/png;base64,{b64}"
+def _retry_after_s(exc: Exception) -> Optional[float]:
+    # Primero los headers (retry-after-ms / retry-after); si no, el mensaje
+    # de la API: "try again in 350ms"
+    response = getattr(exc, "response", None)
+    if response is not None:
+        retry = RateLimitInfo.from_headers(response.headers).retry_after_s
+        if retry is not None:
+            return retry
+    m = re.search(r"try again in (\d+)ms", str(exc))
+    if m:
+        return int(m.group(1)) / 1000.0
+    return None
 
 
 @dataclass
@@ -29,115 +43,463 @@ class Throttle:
     initial_backoff_s: float
     max_backoff_s: float
 
+    # control adaptativo compartido entre procesos (ver ratelimit.py)
+    controller: Optional[RateController] = None
+
     _last_call_ts: float = 0.0
+    # varios hilos pueden compartir el throttle (servicio HTTP, batcher)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
 
     def _pause(self) -> None:
-        now = time.monotonic()
-        delta = now - self._last_call_ts
-        if delta < self.min_call_interval_s:
-            time.sleep(self.min_call_interval_s - delta)
-        self._last_call_ts = time.monotonic()
+        with self._lock:
+            now = time.monotonic()
+            delta = now - self._last_call_ts
+            if delta < self.min_call_interval_s:
+                wait_s = self.min_call_interval_s - delta
+                time.sleep(wait_s)
+                METRICS.observe("throttle.pause", wait_s)
+            self._last_call_ts = time.monotonic()
 
     def call_with_backoff(self, fn, *args, **kwargs):
         backoff = self.initial_backoff_s
         for attempt in range(1, self.max_retries + 1):
+            if attempt > 1:
+                METRICS.inc("llm.retries")
             try:
-                self._pause()
+                # con el control adaptativo el ritmo lo fija el ledger: el
+                # intervalo fijo sólo se sumaría a su espera
+                if self.controller is not None:
+                    self.controller.wait()
+                else:
+                    self._pause()
                 return fn(*args, **kwargs)
             except openai.RateLimitError as e:
-                msg = str(e)
-                sleep_ms = None
-                try:
-                    import re as _re
-                    m = _re.search(r"try again in (\d+)ms", msg)
-                    if m:
-                        sleep_ms = int(m.group(1))
-                except Exception:
-                    pass
-                wait_s = (sleep_ms / 1000.0) if sleep_ms else backoff
-                time.sleep(wait_s + random.uniform(0.0, 0.25))
+                wait_s = (_retry_after_s(e) or backoff) + random.uniform(0.0, 0.25)
+                if self.controller is not None:
+                    self.controller.on_rate_limited(wait_s)
+                METRICS.observe("llm.rate_limit_sleep", wait_s)
+                time.sleep(wait_s)
+                backoff = min(backoff * 2, self.max_backoff_s)
+            except Exception:
+                METRICS.inc("llm.errors")
+                if attempt >= self.max_retries:
+                    return None
+                wait_s = backoff + random.uniform(0.0, 0.25)
+                METRICS.observe("llm.backoff_sleep", wait_s)
+                time.sleep(wait_s)
+                backoff = min(backoff * 2, self.max_backoff_s)
+        return None
+
+    async def acall_with_backoff(self, fn, acquire=None):
+        """Versión async de call_with_backoff.
+
+        `fn` es una corrutina sin argumentos. En lugar del intervalo fijo
+        (`_pause`) se espera a `acquire()` si se indica (p.ej. un rate limiter).
+        """
+        backoff = self.initial_backoff_s
+        for attempt in range(1, self.max_retries + 1):
+            if attempt > 1:
+                METRICS.inc("llm.retries")
+            try:
+                if acquire is not None:
+                    await acquire()
+                return await fn()
+            except openai.RateLimitError as e:
+                wait_s = (_retry_after_s(e) or backoff) + random.uniform(0.0, 0.25)
+                if self.controller is not None:
+                    self.controller.on_rate_limited(wait_s)
+                METRICS.observe("llm.rate_limit_sleep", wait_s)
+                await asyncio.sleep(wait_s)
                 backoff = min(backoff * 2, self.max_backoff_s)
             except Exception:
+                METRICS.inc("llm.errors")
                 if attempt >= self.max_retries:
                     return None
-                time.sleep(backoff + random.uniform(0.0, 0.25))
+                wait_s = backoff + random.uniform(0.0, 0.25)
+                METRICS.observe("llm.backoff_sleep", wait_s)
+                await asyncio.sleep(wait_s)
                 backoff = min(backoff * 2, self.max_backoff_s)
         return None
 
 
+class TokenBucket:
+    """Bucket con reposición continua de `rate_per_min` unidades por minuto."""
+
+    def __init__(self, rate_per_min: float):
+        self.capacity = float(rate_per_min)
+        self.rate_per_s = float(rate_per_min) / 60.0
+        self._level = self.capacity
+        self._ts = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._ts) * self.rate_per_s)
+        self._ts = now
+
+    def wait_time(self, n: float) -> float:
+        self._refill()
+        n = min(n, self.capacity)
+        if self._level >= n:
+            return 0.0
+        return (n - self._level) / self.rate_per_s
+
+    def take(self, n: float) -> None:
+        self._refill()
+        self._level -= min(n, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        # delta > 0: se consumió más de lo estimado; delta < 0: devolver sobrante
+        self._refill()
+        self._level = min(self.capacity, self._level - delta)
+
+
+class AsyncRateLimiter:
+    """Limita requests/min y tokens/min (0 = sin límite) para el provider async."""
+
+    def __init__(self, requests_per_min: int = 0, tokens_per_min: int = 0):
+        self.requests = TokenBucket(requests_per_min) if requests_per_min > 0 else None
+        self.tokens = TokenBucket(tokens_per_min) if tokens_per_min > 0 else None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, est_tokens: int) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                wait = 0.0
+                if self.requests:
+                    wait = max(wait, self.requests.wait_time(1))
+                if self.tokens:
+                    wait = max(wait, self.tokens.wait_time(est_tokens))
+                if wait <= 0:
+                    break
+                METRICS.observe("throttle.pause", wait)
+                await asyncio.sleep(wait)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(est_tokens)
+
+    def settle(self, est_tokens: int, used_tokens: Optional[int]) -> None:
+        if self.tokens and used_tokens is not None:
+            self.tokens.adjust(used_tokens - est_tokens)
+
+
+# --- Prompts y parseo compartidos por los providers sync/async ---
+def _field_messages(data_url: str, field: str) -> List[Dict[str, Any]]:
+    system = "Devolvé SOLO JSON válido. Si no está el dato, devolvé {}."
+    user_prompt = (
+        f'Extraé "{field}" si aparece en el recorte. '
+        'Formato fecha: "DD/MM/YYYY" (años de 2 dígitos => 2000+YY). '
+        'Para CUIT/CUIL: "NN-NNNNNNNN-N".'
+    )
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": [
+            {"type": "text", "text": user_prompt},
+            {"type": "image_url", "image_url": {"url": data_url}},
+        ]},
+    ]
+
+def _all_messages(data_url: str) -> List[Dict[str, Any]]:
+    system = 'Devolvé SOLO JSON válido: {"fechas":[], "cuits":[]}. No inventes.'
+    user_prompt = (
+        "Detectá TODAS las fechas (DD/MM/YYYY; años 2 dígitos => 2000+YY) "
+        "y TODOS los CUIT/CUIL (NN-NNNNNNNN-N) visibles en la página."
+    )
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": [
+            {"type": "text", "text": user_prompt},
+            {"type": "image_url", "image_url": {"url": data_url}},
+        ]},
+    ]
+
+def _batch_messages(data_urls: List[str], fields: List[str]) -> List[Dict[str, Any]]:
+    system = 'Devolvé SOLO JSON válido: {"1": valor o null, "2": ...}. No inventes.'
+    user_prompt = (
+        "Cada imagen es un recorte numerado; para cada uno devolvé el dato pedido. "
+        'Formato fecha: "DD/MM/YYYY" (años de 2 dígitos => 2000+YY). '
+        'Para CUIT/CUIL: "NN-NNNNNNNN-N".'
+    )
+    content: List[Dict[str, Any]] = [{"type": "text", "text": user_prompt}]
+    for i, (url, field) in enumerate(zip(data_urls, fields), start=1):
+        content.append({"type": "text", "text": f'Recorte {i}: "{field}"'})
+        content.append({"type": "image_url", "image_url": {"url": url}})
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": content},
+    ]
+
+def _record_usage(resp) -> Optional[int]:
+    """Suma los tokens informados por la API; devuelve el total (o None)."""
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return None
+    METRICS.inc("llm.tokens.prompt", getattr(usage, "prompt_tokens", 0) or 0)
+    METRICS.inc("llm.tokens.completion", getattr(usage, "completion_tokens", 0) or 0)
+    return getattr(usage, "total_tokens", None)
+
+def _parse_field(resp, field: str) -> Optional[str]:
+    if not resp:
+        return None
+    try:
+        obj = json.loads(resp.choices[0].message.content or "{}")
+        val = obj.get(field)
+        return val or None
+    except Exception:
+        return None
+
+def _parse_batch(resp, fields: List[str]) -> List[Optional[str]]:
+    if not resp:
+        return [None] * len(fields)
+    try:
+        obj = json.loads(resp.choices[0].message.content or "{}")
+    except Exception:
+        return [None] * len(fields)
+    out: List[Optional[str]] = []
+    for i, field in enumerate(fields, start=1):
+        val = obj.get(str(i))
+        if isinstance(val, dict):     # {"1": {"fecha": "..."}}
+            val = val.get(field)
+        out.append(val if isinstance(val, str) and val else None)
+    return out
+
+def _parse_all(resp) -> Tuple[List[str], List[str]]:
+    if not resp:
+        return [], []
+    try:
+        obj = json.loads(resp.choices[0].message.content or "{}")
+        return obj.get("fechas", []) or [], obj.get("cuits", []) or []
+    except Exception:
+        return [], []
+
+
+def _size_str(img: ImageLike) -> str:
+    w, h = image_size(img)
+    return f"{w}x{h}"
+
+
+# Contadores de los providers: los actualizan los hilos del pipeline y el
+# event loop del provider async a la vez
+_counters_lock = threading.Lock()
+
+
 class BaseLLMProvider:
-    def extract_field(self, img: Image.Image, field: str) -> Optional[str]:
+    # Cantidad de requests que el provider puede tener en vuelo a la vez
+    max_in_flight: int = 1
+    # Recortes por request en extract_batch (1 = una request por recorte)
+    batch_size: int = 1
+    # Llamadas que agotaron los reintentos (la respuesta no es confiable)
+    failed_calls: int = 0
+    # Codificación de las imágenes y bytes enviados (imagen codificada)
+    encoder: ImageEncoder = ImageEncoder()
+    images_sent: int = 0
+    bytes_sent: int = 0
+
+    def _count(self, **deltas: int) -> None:
+        with _counters_lock:
+            for name, n in deltas.items():
+                setattr(self, name, getattr(self, name) + n)
+
+    def _data_url(self, img: ImageLike) -> str:
+        url, nbytes = self.encoder.encode(img)
+        self._count(images_sent=1, bytes_sent=nbytes)
+        METRICS.inc("llm.image_bytes", nbytes)
+        METRICS.inc("llm.payload_bytes", len(url))
+        log.debug("Imagen %s -> %s bytes (%s)", _size_str(img), nbytes, self.encoder.fmt)
+        return url
+
+    def extract_field(self, img: ImageLike, field: str) -> Optional[str]:
         raise NotImplementedError
 
-    def extract_all(self, img: Image.Image) -> Tuple[List[str], List[str]]:
+    def extract_all(self, img: ImageLike) -> Tuple[List[str], List[str]]:
         raise NotImplementedError
 
+    def extract_fields(self, jobs: List[Tuple[ImageLike, str]]) -> List[Optional[str]]:
+        """Extrae varios recortes `(img, field)`; devuelve un valor por recorte."""
+        return [self.extract_field(img, field) for img, field in jobs]
+
+    def extract_batch(self, jobs: List[Tuple[ImageLike, str]]) -> List[Optional[str]]:
+        """Como extract_fields, pero hasta `batch_size` recortes por request."""
+        return self.extract_fields(jobs)
+
+
+def _chunks(jobs: list, size: int) -> List[list]:
+    return [jobs[i:i + size] for i in range(0, len(jobs), max(1, size))]
+
 
 class OpenAIProvider(BaseLLMProvider):
-    def __init__(self, model_name: str, throttle: Throttle):
+    def __init__(self, model_name: str, throttle: Throttle, encoder: Optional[ImageEncoder] = None,
+                 batch_size: int = 1):
         self.model = model_name
-        self.client = OpenAI()  # requiere OPENAI_API_KEY en el entorno
+        # Los reintentos los maneja Throttle (coordinado con el ledger)
+        self.client = OpenAI(max_retries=0)  # requiere OPENAI_API_KEY en el entorno
         self.throttle = throttle
+        if encoder is not None:
+            self.encoder = encoder
+        self.batch_size = max(1, batch_size)
 
-    def _chat(self, messages, response_format=None):
+    def _chat(self, messages, response_format=None, tier="clip"):
         def _do():
-            return self.client.chat.completions.create(
-                model=self.model,
-                temperature=0,
-                response_format=response_format or {"type": "json_object"},
-                messages=messages,
-            )
-        return self.throttle.call_with_backoff(_do)
-
-    def extract_field(self, img: Image.Image, field: str) -> Optional[str]:
-        data_url = pil_to_data_url(img)
-        system = "Devolvé SOLO JSON válido. Si no está el dato, devolvé {}."
-        user_prompt = (
-            f'Extraé "{field}" si aparece en el recorte. '
-            'Formato fecha: "DD/MM/YYYY" (años de 2 dígitos => 2000+YY). '
-            'Para CUIT/CUIL: "NN-NNNNNNNN-N".'
-        )
-        resp = self._chat(
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": [
-                    {"type": "text", "text": user_prompt},
-                    {"type": "image_url", "image_url": {"url": data_url}},
-                ]},
-            ]
-        )
-        if not resp:
-            return None
-        try:
-            obj = json.loads(resp.choices[0].message.content or "{}")
-            val = obj.get(field)
-            return val or None
-        except Exception:
-            return None
-
-    def extract_all(self, img: Image.Image):
-        data_url = pil_to_data_url(img)
-        system = 'Devolvé SOLO JSON válido: {"fechas":[], "cuits":[]}. No inventes.'
-        user_prompt = (
-            "Detectá TODAS las fechas (DD/MM/YYYY; años 2 dígitos => 2000+YY) "
-            "y TODOS los CUIT/CUIL (NN-NNNNNNNN-N) visibles en la página."
-        )
-        resp = self._chat(
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": [
-                    {"type": "text", "text": user_prompt},
-                    {"type": "image_url", "image_url": {"url": data_url}},
-                ]},
-            ]
-        )
-        if not resp:
-            return [], []
-        try:
-            obj = json.loads(resp.choices[0].message.content or "{}")
-            return obj.get("fechas", []) or [], obj.get("cuits", []) or []
-        except Exception:
-            return [], []
+            with METRICS.timer(f"llm.call.{tier}"):
+                raw = self.client.chat.completions.with_raw_response.create(
+                    model=self.model,
+                    temperature=0,
+                    response_format=response_format or {"type": "json_object"},
+                    messages=messages,
+                )
+            resp = raw.parse()
+            used = _record_usage(resp)
+            if self.throttle.controller is not None:
+                self.throttle.controller.on_response(raw.headers, used)
+            return resp
+        METRICS.inc(f"llm.calls.{tier}")
+        resp = self.throttle.call_with_backoff(_do)
+        if resp is None:
+            self._count(failed_calls=1)
+            METRICS.inc("llm.failed")
+        return resp
+
+    def extract_field(self, img: ImageLike, field: str) -> Optional[str]:
+        resp = self._chat(messages=_field_messages(self._data_url(img), field), tier="clip")
+        return _parse_field(resp, field)
+
+    def extract_all(self, img: ImageLike):
+        resp = self._chat(messages=_all_messages(self._data_url(img)), tier="full_page")
+        return _parse_all(resp)
+
+    def _batch(self, jobs: List[Tuple[ImageLike, str]]) -> List[Optional[str]]:
+        if len(jobs) == 1:
+            return [self.extract_field(*jobs[0])]
+        fields = [field for _, field in jobs]
+        METRICS.inc("llm.batch.crops", len(jobs))
+        resp = self._chat(messages=_batch_messages([self._data_url(img) for img, _ in jobs], fields), tier="batch")
+        return _parse_batch(resp, fields)
+
+    def extract_batch(self, jobs: List[Tuple[ImageLike, str]]) -> List[Optional[str]]:
+        return [val for chunk in _chunks(jobs, self.batch_size) for val in self._batch(chunk)]
+
+
+class AsyncOpenAIProvider(BaseLLMProvider):
+    """Provider basado en AsyncOpenAI con varias requests en vuelo.
+
+    La concurrencia se acota con un semáforo (`max_in_flight`) y el ritmo con
+    un token bucket de requests/min y tokens/min en lugar del intervalo fijo
+    de `Throttle`. Si el throttle trae un `RateController`, la concurrencia la
+    fija su ventana AIMD (hasta `max_in_flight`) y el cupo su ledger
+    compartido. Los reintentos siguen usando el backoff de `Throttle`.
+    Mantiene la interfaz sincrónica: cada llamada corre en un event loop
+    propio del provider, en un hilo de fondo (el pool HTTP se reutiliza entre
+    llamadas y varios hilos pueden compartir el provider, el semáforo y los
+    límites).
+    """
+
+    def __init__(self, model_name: str, throttle: Throttle, max_in_flight: int = 4,
+                 requests_per_min: int = 0, tokens_per_min: int = 0,
+                 est_tokens_per_call: int = 1200, encoder: Optional[ImageEncoder] = None,
+                 batch_size: int = 1):
+        self.model = model_name
+        self.throttle = throttle
+        if encoder is not None:
+            self.encoder = encoder
+        self.max_in_flight = max(1, max_in_flight)
+        self.batch_size = max(1, batch_size)
+        self.est_tokens_per_call = est_tokens_per_call
+        self.limiter = AsyncRateLimiter(requests_per_min, tokens_per_min)
+        self.client = AsyncOpenAI(max_retries=0)  # requiere OPENAI_API_KEY en el entorno
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    def _run(self, coro):
+        with self._loop_lock:
+            if self._loop_thread is None:
+                self._loop_thread = threading.Thread(target=self._loop.run_forever,
+                                                     name="llm-loop", daemon=True)
+                self._loop_thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _slot(self):
+        controller = self.throttle.controller
+        if controller is not None:
+            return controller.slot()
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_in_flight)
+        return self._sem
+
+    async def _chat(self, messages, response_format=None, tier="clip"):
+        controller = self.throttle.controller
+
+        async def _acquire():
+            if controller is not None:
+                await controller.await_budget()
+            else:
+                await self.limiter.acquire(self.est_tokens_per_call)
+
+        async def _do():
+            async with self._slot():
+                with METRICS.timer(f"llm.call.{tier}"):
+                    raw = await self.client.chat.completions.with_raw_response.create(
+                        model=self.model,
+                        temperature=0,
+                        response_format=response_format or {"type": "json_object"},
+                        messages=messages,
+                    )
+                resp = raw.parse()
+                used = _record_usage(resp)
+                if controller is not None:
+                    controller.on_response(raw.headers, used)
+                else:
+                    self.limiter.settle(self.est_tokens_per_call, used)
+            return resp
+        METRICS.inc(f"llm.calls.{tier}")
+        resp = await self.throttle.acall_with_backoff(_do, acquire=_acquire)
+        if resp is None:
+            self._count(failed_calls=1)
+            METRICS.inc("llm.failed")
+        return resp
+
+    async def aextract_field(self, img: ImageLike, field: str) -> Optional[str]:
+        resp = await self._chat(messages=_field_messages(self._data_url(img), field))
+        return _parse_field(resp, field)
+
+    async def aextract_all(self, img: ImageLike) -> Tuple[List[str], List[str]]:
+        resp = await self._chat(messages=_all_messages(self._data_url(img)), tier="full_page")
+        return _parse_all(resp)
+
+    async def _abatch(self, jobs: List[Tuple[ImageLike, str]]) -> List[Optional[str]]:
+        if len(jobs) == 1:
+            return [await self.aextract_field(*jobs[0])]
+        fields = [field for _, field in jobs]
+        METRICS.inc("llm.batch.crops", len(jobs))
+        messages = _batch_messages([self._data_url(img) for img, _ in jobs], fields)
+        return _parse_batch(await self._chat(messages=messages, tier="batch"), fields)
+
+    async def _gather_fields(self, jobs):
+        return await asyncio.gather(*(self.aextract_field(img, field) for img, field in jobs))
+
+    async def _gather_batches(self, jobs):
+        # cada lote es una request; los lotes van en paralelo (hasta max_in_flight)
+        chunks = await asyncio.gather(*(self._abatch(c) for c in _chunks(jobs, self.batch_size)))
+        return [val for chunk in chunks for val in chunk]
+
+    def extract_field(self, img: ImageLike, field: str) -> Optional[str]:
+        return self._run(self.aextract_field(img, field))
+
+    def extract_all(self, img: ImageLike):
+        return self._run(self.aextract_all(img))
+
+    def extract_fields(self, jobs: List[Tuple[ImageLike, str]]) -> List[Optional[str]]:
+        if not jobs:
+            return []
+        return list(self._run(self._gather_fields(jobs)))
+
+    def extract_batch(self, jobs: List[Tuple[ImageLike, str]]) -> List[Optional[str]]:
+        if not jobs:
+            return []
+        return self._run(self._gather_batches(jobs))
 
 
 # Habilitar Azure OpenAI es opcional: setear LLM_PROVIDER=azure y las envs adecuadas.
@@ -147,4 +509,8 @@ class AzureOpenAIProvider(OpenAIProvider):
     # Si tu entorno ya está configurado con variables de Azure, el cliente OpenAI las toma.
     # Reutilizamos la lógica de OpenAIProvider.
     pass
-``
+
+
+class AsyncAzureOpenAIProvider(AsyncOpenAIProvider):
+    # Igual que AzureOpenAIProvider, pero sobre el provider async.
+    pass
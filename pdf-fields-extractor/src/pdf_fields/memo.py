@@ -0,0 +1,185 @@
+
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+import fitz
+
+from .cache import open_sqlite
+from .encoding import ImageLike
+from .llm_provider import BaseLLMProvider, _all_messages, _batch_messages, _field_messages
+from .metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def image_digest(img: ImageLike) -> str:
+    """Hash del buffer de pixeles (incluye modo y tamaño)."""
+    h = hashlib.sha256()
+    if isinstance(img, fitz.Pixmap):
+        mode = "L" if img.n == 1 else "RGB"
+        h.update(f"{mode}:{img.width}x{img.height}:".encode("ascii"))
+        h.update(img.samples_mv)
+    else:
+        h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode("ascii"))
+        h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def _prompt_digest(messages) -> str:
+    return hashlib.sha256(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+# Prompts sin imagen: si cambia el texto del prompt, cambian las claves
+_FIELD_PROMPTS = {f: _prompt_digest(_field_messages("", f)) for f in ("fecha", "cuit")}
+_ALL_PROMPT = _prompt_digest(_all_messages(""))
+# en lote el modelo ve otro prompt (y otros recortes): claves aparte
+_BATCH_PROMPT = _prompt_digest(_batch_messages([""], [""]))
+
+def _field_prompt(field: str) -> str:
+    return _FIELD_PROMPTS.get(field) or _prompt_digest(_field_messages("", field))
+
+
+class ResponseMemo:
+    """LRU en memoria delante de una tabla SQLite persistente (compartible
+    entre hilos)."""
+
+    def __init__(self, path: Path, lru_size: int = 512):
+        self.lru_size = lru_size
+        self._lru: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn = open_sqlite(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def _remember(self, key: str, value: Any) -> None:
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get(self, key: str) -> Any:
+        """Devuelve el valor guardado o `_MISSING` (None es un valor válido)."""
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits_mem += 1
+                METRICS.inc("memo.hits")
+                return self._lru[key]
+            row = self._conn.execute("SELECT payload FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                METRICS.inc("memo.misses")
+                return _MISSING
+            self.hits_disk += 1
+            METRICS.inc("memo.hits")
+            value = json.loads(row[0])
+            self._remember(key, value)
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._remember(key, value)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, created) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class MemoizedProvider(BaseLLMProvider):
+    """Envuelve un provider y memoiza sus respuestas por (imagen, prompt, modelo).
+
+    Un mismo recorte (membrete, caja de fecha de una plantilla) se paga una
+    sola vez, dentro de la corrida y entre corridas. Las llamadas que fallaron
+    (reintentos agotados) no se memorizan.
+    """
+
+    def __init__(self, inner: BaseLLMProvider, memo: ResponseMemo, model: str):
+        self.inner = inner
+        self.memo = memo
+        self.model = model
+        self.max_in_flight = inner.max_in_flight
+        self.batch_size = inner.batch_size
+
+    def _key(self, prompt: str, img: ImageLike) -> str:
+        # la codificación (formato/calidad/escala) también cambia lo que ve el modelo
+        return f"{self.model}:{prompt}:{self.inner.encoder.signature()}:{image_digest(img)}"
+
+    @property
+    def failed_calls(self) -> int:
+        return getattr(self.inner, "failed_calls", 0)
+
+    def _failures(self) -> int:
+        return self.failed_calls
+
+    def extract_field(self, img: ImageLike, field: str) -> Optional[str]:
+        key = self._key(_field_prompt(field), img)
+        val = self.memo.get(key)
+        if val is not _MISSING:
+            return val
+        before = self._failures()
+        val = self.inner.extract_field(img, field)
+        if self._failures() == before:
+            self.memo.put(key, val)
+        return val
+
+    def extract_all(self, img: ImageLike) -> Tuple[List[str], List[str]]:
+        key = self._key(_ALL_PROMPT, img)
+        val = self.memo.get(key)
+        if val is not _MISSING:
+            return list(val[0]), list(val[1])
+        before = self._failures()
+        fechas, cuits = self.inner.extract_all(img)
+        if self._failures() == before:
+            self.memo.put(key, [fechas, cuits])
+        return fechas, cuits
+
+    def extract_fields(self, jobs: List[Tuple[ImageLike, str]]) -> List[Optional[str]]:
+        return self._memoized(jobs, self.inner.extract_fields, _field_prompt)
+
+    def extract_batch(self, jobs: List[Tuple[ImageLike, str]]) -> List[Optional[str]]:
+        # sólo los recortes no memorizados viajan en el lote
+        return self._memoized(jobs, self.inner.extract_batch, lambda f: f"{_BATCH_PROMPT}:{f}")
+
+    def _memoized(self, jobs: List[Tuple[ImageLike, str]], call, prompt) -> List[Optional[str]]:
+        out: List[Any] = []
+        pending, pending_idx, pending_keys = [], [], []
+        for img, field in jobs:
+            key = self._key(prompt(field), img)
+            val = self.memo.get(key)
+            out.append(val)
+            if val is _MISSING:
+                pending.append((img, field))
+                pending_idx.append(len(out) - 1)
+                pending_keys.append(key)
+        if pending:
+            before = self._failures()
+            vals = call(pending)
+            clean = self._failures() == before
+            for idx, key, val in zip(pending_idx, pending_keys, vals):
+                out[idx] = val
+                # si hubo fallas en el lote, sólo guardamos los valores obtenidos
+                if clean or val is not None:
+                    self.memo.put(key, val)
+        return out
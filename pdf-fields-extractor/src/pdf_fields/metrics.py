@@ -0,0 +1,157 @@
+
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class Metrics:
+    """Contadores y timers acumulados (por proceso).
+
+    Cada worker mide sus PDFs en el registro global `METRICS`; el proceso
+    principal junta las instantáneas con `merge()`. Los timers guardan
+    [cantidad, segundos totales, máximo]. Las actualizaciones van bajo un
+    lock: en el modo `serve` escriben varios hilos y el event loop del
+    provider a la vez.
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.timers: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            t = self.timers.get(name)
+            if t is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                t[0] += 1
+                t[1] += seconds
+                t[2] = max(t[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "timers": {k: list(v) for k, v in self.timers.items()},
+            }
+
+    def merge(self, snap: dict) -> None:
+        with self._lock:
+            for k, v in snap.get("counters", {}).items():
+                self.counters[k] += v
+            for k, (count, total, mx) in snap.get("timers", {}).items():
+                t = self.timers.get(k)
+                if t is None:
+                    self.timers[k] = [count, total, mx]
+                else:
+                    t[0] += count
+                    t[1] += total
+                    t[2] = max(t[2], mx)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+
+# Registro del proceso actual (extractors, encoding y llm_provider miden acá)
+METRICS = Metrics()
+
+
+def timers_summary(timers: Dict[str, List[float]]) -> Dict[str, dict]:
+    return {
+        name: {"count": int(c), "total_s": round(tot, 6), "avg_s": round(tot / c, 6) if c else 0.0, "max_s": round(mx, 6)}
+        for name, (c, tot, mx) in sorted(timers.items())
+    }
+
+
+_ZOOM_RE = re.compile(r"^zoom\.(\w+)\.([0-9.]+)x\.(tries|ok)$")
+
+
+def zoom_ladder_summary(counters: Dict[str, float]) -> Dict[str, dict]:
+    """Por tier ("clip"/"full") y zoom: intentos, aciertos y tasa de acierto."""
+    out: Dict[str, dict] = {}
+    for name, value in counters.items():
+        m = _ZOOM_RE.match(name)
+        if m:
+            tier, zoom, kind = m.groups()
+            out.setdefault(tier, {}).setdefault(zoom + "x", {"tries": 0, "ok": 0})[kind] = int(value)
+    for levels in out.values():
+        for lv in levels.values():
+            lv["ok_rate"] = round(lv["ok"] / lv["tries"], 4) if lv["tries"] else 0.0
+    return {tier: dict(sorted(levels.items(), key=lambda kv: float(kv[0][:-1])))
+            for tier, levels in sorted(out.items())}
+
+
+def page_dedup_summary(counters: Dict[str, float]) -> Optional[dict]:
+    """Páginas con huella, reusadas y llamadas al LLM evitadas (None si no hubo huellas)."""
+    by_kind = {name.rsplit(".", 1)[1]: int(v) for name, v in counters.items()
+               if name.startswith("dedup.fingerprints.")}
+    if not by_kind:
+        return None
+    return {
+        "pages_fingerprinted": sum(by_kind.values()),
+        "by_kind": dict(sorted(by_kind.items())),
+        "pages_reused": int(counters.get("dedup.pages_reused", 0)),
+        "exact_matches": int(counters.get("dedup.matches.exact", 0)),
+        "near_matches": int(counters.get("dedup.matches.near", 0)),
+        "llm_calls_avoided": int(counters.get("dedup.llm_calls_avoided", 0)),
+        "pages_learned": int(counters.get("dedup.pages_learned", 0)),
+        "near_duplicates_rejected": int(counters.get("dedup.ink_rejected", 0)),
+    }
+
+def _write_atomic(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def write_json_report(path: Path, report: dict) -> None:
+    _write_atomic(path, json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def _prom_name(name: str) -> str:
+    return "pdf_fields_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def prometheus_text(metrics: Metrics) -> str:
+    """Formato de exposición de Prometheus (textfile y `/metrics`)."""
+    snap = metrics.snapshot()
+    lines = []
+    for name, value in sorted(snap["counters"].items()):
+        prom = _prom_name(name) + "_total"
+        lines.append(f"# TYPE {prom} counter")
+        lines.append(f"{prom} {value:g}")
+    for name, (count, total, _) in sorted(snap["timers"].items()):
+        prom = _prom_name(name) + "_seconds"
+        lines.append(f"# TYPE {prom} summary")
+        lines.append(f"{prom}_sum {total:.6f}")
+        lines.append(f"{prom}_count {int(count)}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: Path, metrics: Metrics) -> None:
+    """Formato textfile de node_exporter (se escribe de forma atómica)."""
+    _write_atomic(path, prometheus_text(metrics))
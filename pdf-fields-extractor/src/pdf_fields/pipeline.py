@@ -1,196 +1,879 @@
 
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import csv
+import heapq
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import date, datetime
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
 
 import fitz
-import pandas as pd
-from openpyxl.styles import Font, Alignment
 
+from .cache import ResultCache
 from .config import Settings
-from .llm_provider import BaseLLMProvider, OpenAIProvider, AzureOpenAIProvider, Throttle
+from .journal import COLUMNS, Journal
+from .metrics import (METRICS, Metrics, page_dedup_summary, timers_summary, write_json_report,
+                      write_prometheus, zoom_ladder_summary)
+from .ratelimit import RateController, SharedLedger, default_ledger_path
+from .shard import select_shard, write_manifest
+from .templates import TemplateStore, layout_key, pad_rect, union_box, words_in_rect
+from .writers import CsvSink, ParquetSink, XlsxSink, write_rows
 from .extractors import (
     normalize_date_textlike, 
     normalize_cuit_textlike, 
-    SEARCH_TERMS_CUIT, SEARCH_TERMS_FECHA,
-    dedup_rects, clip_right_rect, render, pick_closest_past_date
+    iter_date_candidates, iter_cuit_candidates,
+    AnchorIndex, PageRaster, clip_right_rect, pick_closest_past_date
 )
 
+# Provider, memo, lotes y codificación (openai, PIL, numpy) se importan al
+# construirlos: `--help`, `--text-only` y las corridas sin LLM no los cargan.
+if TYPE_CHECKING:
+    from .batching import ClipBatcher
+    from .dedup import PageFingerprint, PageIndex
+    from .encoding import ImageEncoder
+    from .llm_provider import BaseLLMProvider
+
 log = logging.getLogger(__name__)
 
 def ensure_out_dir(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
 
-def build_provider(cfg: Settings) -> BaseLLMProvider:
+def build_encoder(cfg: Settings) -> ImageEncoder:
+    from .encoding import ImageEncoder
+    return ImageEncoder(
+        fmt=cfg.image_format,
+        quality=cfg.image_quality,
+        grayscale=cfg.image_grayscale,
+        max_pixels=cfg.image_max_pixels,
+        max_bytes=cfg.image_max_bytes,
+    )
+
+def build_rate_controller(cfg: Settings) -> Optional[RateController]:
+    """Ledger compartido por todos los procesos que usan el mismo endpoint y modelo."""
+    if not cfg.adaptive_rate:
+        return None
+    endpoint = os.getenv("OPENAI_BASE_URL") or os.getenv("AZURE_OPENAI_ENDPOINT") or ""
+    path = cfg.rate_ledger or default_ledger_path(cfg.llm_provider, endpoint, cfg.model_vision)
+    ledger = SharedLedger(path, cfg.requests_per_min, cfg.tokens_per_min)
+    return RateController(
+        ledger,
+        max_in_flight=cfg.max_in_flight if cfg.llm_async else 1,
+        est_tokens_per_call=cfg.est_tokens_per_call,
+    )
+
+def _build_base_provider(cfg: Settings) -> BaseLLMProvider:
+    from .llm_provider import (
+        AsyncAzureOpenAIProvider, AsyncOpenAIProvider, AzureOpenAIProvider, OpenAIProvider, Throttle,
+    )
     throttle = Throttle(
         min_call_interval_s=cfg.min_call_interval_s,
         max_retries=cfg.max_retries,
         initial_backoff_s=cfg.initial_backoff_s,
         max_backoff_s=cfg.max_backoff_s,
+        controller=build_rate_controller(cfg),
     )
+    encoder = build_encoder(cfg)
+    if cfg.llm_async:
+        # Sin ledger compartido, cada worker recibe una parte proporcional del cupo
+        share = max(1, cfg.workers)
+        cls = AsyncAzureOpenAIProvider if cfg.llm_provider == "azure" else AsyncOpenAIProvider
+        log.info("Usando %s (max_in_flight=%s)", cls.__name__, cfg.max_in_flight)
+        return cls(
+            model_name=cfg.model_vision,
+            throttle=throttle,
+            max_in_flight=cfg.max_in_flight,
+            requests_per_min=cfg.requests_per_min // share,
+            tokens_per_min=cfg.tokens_per_min // share,
+            est_tokens_per_call=cfg.est_tokens_per_call,
+            encoder=encoder,
+            batch_size=cfg.llm_batch_size,
+        )
     if cfg.llm_provider == "azure":
         log.info("Usando Azure OpenAI provider")
-        return AzureOpenAIProvider(model_name=cfg.model_vision, throttle=throttle)
+        return AzureOpenAIProvider(model_name=cfg.model_vision, throttle=throttle, encoder=encoder,
+                                   batch_size=cfg.llm_batch_size)
     log.info("Usando OpenAI provider")
-    return OpenAIProvider(model_name=cfg.model_vision, throttle=throttle)
+    return OpenAIProvider(model_name=cfg.model_vision, throttle=throttle, encoder=encoder,
+                          batch_size=cfg.llm_batch_size)
 
-def llm_extract_field_from_image(llm: BaseLLMProvider, pil_img, field: str, cfg: Settings) -> Optional[str]:
-    val = llm.extract_field(pil_img, field)
+def build_provider(cfg: Settings) -> Optional[BaseLLMProvider]:
+    """Provider configurado (None con `text_only`: ni se importa el cliente)."""
+    if cfg.text_only:
+        return None
+    llm = _build_base_provider(cfg)
+    if cfg.memo_enabled:
+        from .memo import MemoizedProvider, ResponseMemo
+        memo = ResponseMemo(cfg.memo_path(), lru_size=cfg.memo_lru_size)
+        llm = MemoizedProvider(llm, memo, model=cfg.model_vision)
+    return llm
+
+def _normalize_field(val: Optional[str], field: str, cfg: Settings) -> Optional[str]:
     if not val:
         return None
     if field == "fecha":
         return normalize_date_textlike(val, cfg.min_year, cfg.max_year)
     return normalize_cuit_textlike(val)
 
-def llm_extract_all_from_page(llm: BaseLLMProvider, pil_img, cfg: Settings) -> Tuple[List[str], List[str]]:
+def llm_extract_field_from_image(llm: BaseLLMProvider, pil_img, field: str, cfg: Settings) -> Optional[str]:
+    return _normalize_field(llm.extract_field(pil_img, field), field, cfg)
+
+# Imágenes enviadas al LLM por este hilo: cada página cuenta las suyas, que
+# son las llamadas que evita una copia que la reusa (ver dedup.PageIndex)
+_llm_images = threading.local()
+
+def _images_sent() -> int:
+    return getattr(_llm_images, "n", 0)
+
+def _failed_calls(llm: Optional[BaseLLMProvider]) -> int:
+    return getattr(llm, "failed_calls", 0)
+
+def _zoom_outcome(tier: str, zoom: float, ok: bool) -> None:
+    # Intentos y aciertos por nivel de la escalera (ver zoom_ladder_summary)
+    METRICS.inc(f"zoom.{tier}.{zoom:g}x.tries")
+    if ok:
+        METRICS.inc(f"zoom.{tier}.{zoom:g}x.ok")
+    _llm_images.n = _images_sent() + 1
+
+def llm_extract_clip_ladder(llm: BaseLLMProvider, raster: PageRaster, clip: fitz.Rect,
+                            field: str, cfg: Settings) -> Optional[str]:
+    """Un recorte subiendo de zoom mientras la respuesta no valide."""
+    for zoom in cfg.clip_zooms():
+        val = llm_extract_field_from_image(llm, raster.crop(clip, zoom), field, cfg)
+        _zoom_outcome("clip", zoom, bool(val))
+        if val:
+            return val
+    return None
+
+def _clips_by_field(page, rects_by_field: dict, cfg: Settings) -> dict:
+    return {
+        field: [(rect, clip_right_rect(page, rect)) for rect in rects[:cfg.max_rects_per_anchor]]
+        for field, rects in rects_by_field.items()
+    }
+
+def llm_extract_clips(llm: BaseLLMProvider, raster: PageRaster, rects_by_field: dict, cfg: Settings,
+                      where: Optional[dict] = None) -> dict:
+    """Resuelve los recortes a la derecha de cada ancla; devuelve {field: valor}.
+
+    Con un provider secuencial se prueba rect por rect y se corta en el primer
+    valor válido. Si el provider admite varias requests en vuelo, se envían
+    todos los recortes (fecha y cuit) juntos y se toma el primer válido de
+    cada campo en el mismo orden de rects. Si se pasa `where`, se completa con
+    {field: (ancla, recorte)} de cada valor encontrado.
+
+    Con una escalera de zooms (`cfg.clip_zooms()`), cada recorte se envía
+    primero al zoom más bajo y sólo se re-renderiza más grande si la
+    respuesta no valida (vacía o con formato/dígito verificador inválido):
+    junto a un ancla se espera un valor.
+    """
+    clips_by_field = _clips_by_field(raster.page, rects_by_field, cfg)
+    zooms = cfg.clip_zooms()
+    raster.plan(zooms[0], [c for clips in clips_by_field.values() for _, c in clips])
+    where = {} if where is None else where
+
+    found = {}
+    if llm.max_in_flight <= 1:
+        for field, clips in clips_by_field.items():
+            for anchor, clip in clips:
+                val = llm_extract_clip_ladder(llm, raster, clip, field, cfg)
+                if val:
+                    found[field] = val
+                    where[field] = (anchor, clip)
+                    break
+        return found
+
+    # Concurrente: un nivel por vez con todos los recortes de los campos que faltan
+    pending = [(field, anchor, clip) for field, clips in clips_by_field.items() for anchor, clip in clips]
+    for level, zoom in enumerate(zooms):
+        if level:
+            raster.plan(zoom, [clip for _, _, clip in pending])
+        jobs = [(raster.crop(clip, zoom), field) for field, _, clip in pending]
+        for (field, anchor, clip), val in zip(pending, llm.extract_fields(jobs)):
+            val = _normalize_field(val, field, cfg)
+            _zoom_outcome("clip", zoom, bool(val))
+            if val and field not in found:
+                found[field] = val
+                where[field] = (anchor, clip)
+        pending = [p for p in pending if p[0] not in found]
+        if not pending:
+            break
+    return found
+
+def _first_valid(field: str, text: str, cfg: Settings) -> Optional[str]:
+    if field == "fecha":
+        cands = iter_date_candidates(text, cfg.min_year, cfg.max_year)
+    else:
+        cands = iter_cuit_candidates(text)
+    return next((val for val, _, _ in cands), None)
+
+def template_tier(page, raster: PageRaster, llm: Optional[BaseLLMProvider], store: TemplateStore,
+                  layout: str, fields: List[str], cfg: Settings) -> Tuple[dict, bool]:
+    """Valores desde plantillas del layout: ({field: valor}, si se usó el LLM).
+
+    Una sola extracción de texto limitada a los rects de las plantillas
+    verifica la etiqueta de cada una (texto estático) y lee el valor dentro de
+    su rect. Si el rect no tiene texto (valor escaneado o manuscrito) o la
+    plantilla vino de un recorte del LLM, se envía sólo ese recorte ajustado.
+    """
+    candidates = {f: store.lookup(layout, f) for f in fields}
+    candidates = {f: ts for f, ts in candidates.items() if ts}
+    if not candidates:
+        return {}, False
+    size = (page.rect.width, page.rect.height)
+    with METRICS.timer("stage.template"):
+        area = union_box([b for ts in candidates.values() for t in ts for b in (t.label(size), t.value(size))])
+        words = page.get_text("words", clip=fitz.Rect(area)) or []
+
+    found, used_llm = {}, False
+    for field, ts in candidates.items():
+        val, field_llm = None, False
+        for t in ts:
+            if not t.label_matches(words, size):
+                continue
+            value_box = t.value(size)
+            text = words_in_rect(words, value_box)
+            val = _first_valid(field, text, cfg)
+            if val is None and llm is not None and (t.source == "clip" or not text.strip()):
+                field_llm = True
+                val = llm_extract_clip_ladder(llm, raster, fitz.Rect(value_box), field, cfg)
+            store.record(t, val is not None)
+            if val or field_llm:
+                # a lo sumo un recorte LLM por campo; si falla, sigue el camino normal
+                break
+        used_llm = used_llm or field_llm
+        if val:
+            found[field] = val
+    return found, used_llm
+
+def _learn_templates(store: TemplateStore, layout: str, page, anchors: AnchorIndex,
+                     text_hits: dict, clip_hits: dict) -> None:
+    for field, value_rect in text_hits.items():
+        near = anchors.nearest_anchor(field, value_rect)
+        if near and near[1]:
+            # margen para valores de otro largo o corridos unos puntos
+            pad = value_rect.height
+            store.learn(layout, field, page, near[1], pad_rect(near[0], 2, 2),
+                        pad_rect(value_rect, pad * 1.5, pad * 0.5), "text")
+    for field, (anchor, clip) in clip_hits.items():
+        label = anchors.label(anchor)
+        if label:
+            store.learn(layout, field, page, label, pad_rect(anchor, 2, 2), clip, "clip")
+
+def llm_extract_all_from_page(llm: BaseLLMProvider, pil_img, cfg: Settings,
+                              raw_counts: Optional[list] = None) -> Tuple[List[str], List[str]]:
     fechas_raw, cuits_raw = llm.extract_all(pil_img)
     fechas = [f for f in (normalize_date_textlike(fr, cfg.min_year, cfg.max_year) for fr in fechas_raw) if f]
     cuits  = [c for c in (normalize_cuit_textlike(cr) for cr in cuits_raw) if c]
+    if raw_counts is not None:
+        raw_counts[:] = [len(fechas_raw), len(cuits_raw)]
     return fechas, cuits
 
-def process_one_pdf(pdf_path: Path, cfg: Settings, llm: BaseLLMProvider, hoy=None) -> Tuple[Optional[str], Optional[str]]:
-    fechas: List[str] = []
-    cuits:  List[str] = []
+@dataclass
+class ScanResult:
+    """Candidatos crudos de un PDF (en orden de aparición, por página)."""
+    fechas: List[str] = field(default_factory=list)
+    cuits:  List[str] = field(default_factory=list)
+    # True si ningún recorte llegó al LLM (ni se reusó lo que dio para una copia)
+    text_only: bool = True
+    # True si alguna llamada al LLM agotó los reintentos: lo extraído puede
+    # estar incompleto y no se guarda en el cache
+    failed: bool = False
+
+    @property
+    def resolved_by_text(self) -> bool:
+        """Dio fecha o CUIT sin pasar por el LLM (capa de texto o plantillas)."""
+        return self.text_only and bool(self.fechas or self.cuits)
+
+    def to_dict(self) -> dict:
+        return {"fechas": self.fechas, "cuits": self.cuits, "text_only": self.text_only}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ScanResult":
+        return cls(fechas=list(d.get("fechas", [])), cuits=list(d.get("cuits", [])),
+                   text_only=bool(d.get("text_only", True)))
+
+def pick_result(scan: Optional[ScanResult], hoy=None) -> Tuple[Optional[str], Optional[str]]:
+    if scan is None:
+        return None, None
+    fecha_obj = pick_closest_past_date(scan.fechas, hoy=hoy)
+    cuit_unico = None
+    if scan.cuits:
+        seen, dedup = set(), []
+        for c in scan.cuits:
+            if c not in seen:
+                seen.add(c); dedup.append(c)
+        cuit_unico = dedup[0] if dedup else None
+    return fecha_obj, cuit_unico
+
+def _pages_to_scan(doc, cfg: Settings) -> int:
+    if cfg.scan_policy == "first-n-pages":
+        return min(doc.page_count, max(1, cfg.scan_max_pages))
+    return doc.page_count
+
+@dataclass
+class _PageState:
+    """Lo resuelto de una página antes del fallback de página completa."""
+    index: int
+    page: fitz.Page
+    raster: PageRaster
+    layout: Optional[str] = None
+    anchors: Optional[AnchorIndex] = None
+    dates: List[str] = field(default_factory=list)
+    cuits: List[str] = field(default_factory=list)
+    text_hits: dict = field(default_factory=dict)
+    clip_hits: dict = field(default_factory=dict)
+    # recortes pendientes para el LLM: {field: [rects de ancla]}
+    rects_by_field: dict = field(default_factory=dict)
+    used_llm: bool = False
+    # huella de la página, campos que plantillas y texto dejaron al LLM e
+    # imágenes que mandó después; con `reused` salieron de una copia ya procesada
+    fingerprint: Optional[PageFingerprint] = None
+    fields: List[str] = field(default_factory=list)
+    calls: int = 0
+    failed_before: int = 0
+    reused: bool = False
+
+    def add(self, found: dict) -> None:
+        if "fecha" in found:
+            self.dates.append(found["fecha"])
+        if "cuit" in found:
+            self.cuits.append(found["cuit"])
+
+def _prepare_page(doc, i: int, cfg: Settings, llm: Optional[BaseLLMProvider], cuits: List[str],
+                  templates: Optional[TemplateStore], pages: Optional[PageIndex] = None) -> _PageState:
+    """Plantillas, capa de texto, huella y anclas de la página `i` (pasos 0 a 2)."""
+    page = doc.load_page(i)
+    st = _PageState(i, page, PageRaster(page, gray=cfg.image_grayscale))
+    wanted = ["fecha"] if cuits else ["fecha", "cuit"]
+    if llm is not None:
+        st.failed_before = _failed_calls(llm)
+
+    # 0) Layout conocido: rects aprendidos de documentos anteriores
+    if templates is not None:
+        st.layout = layout_key(doc, page)
+        tpl, st.used_llm = template_tier(page, st.raster, llm, templates, st.layout, wanted, cfg)
+        st.add(tpl)
+
+    # el CUIT elegido es el primero del documento: no hace falta buscar más
+    need_fecha = not st.dates
+    need_cuit  = not st.cuits and not cuits
+    if not (need_fecha or need_cuit):
+        return st
+
+    # 1) Texto embebido (barato): todos los candidatos válidos,
+    #    el más cercano a su ancla primero
+    st.anchors = anchors = AnchorIndex.from_page(page)
+    with METRICS.timer("stage.text_tier"):
+        for fld, page_found in (("fecha", st.dates), ("cuit", st.cuits)):
+            if page_found:
+                continue
+            match = anchors.best_text_match(fld, cfg.min_year, cfg.max_year)
+            if match:
+                page_found.append(match[0])
+                st.text_hits[fld] = match[1]
+    if llm is None:
+        return st
+
+    # Copia de una página ya resuelta: la huella se calcula sólo si plantillas
+    # y texto dejaron trabajo para el LLM, y se busca por lo que falta
+    st.fields = [f for f in wanted if not (st.dates if f == "fecha" else st.cuits)]
+    if not st.fields:
+        return st
+    if pages is not None:
+        st.fingerprint = pages.fingerprint(page)
+        hit = pages.lookup(st.fingerprint, st.fields)
+        if hit is not None:
+            # los valores son del LLM aunque esta vez no se lo llame
+            st.reused = st.used_llm = True
+            if "fecha" in st.fields:
+                st.dates.extend(hit.fechas)
+            if "cuit" in st.fields:
+                st.cuits.extend(hit.cuits)
+            return st
+
+    # 2) Anclas -> recortes a la derecha (si falta)
+    if not st.dates:
+        rects = anchors.rects("fecha")
+        if rects:
+            st.rects_by_field["fecha"] = rects
+    if not st.cuits and not cuits:
+        rects = anchors.rects("cuit")
+        if rects:
+            st.rects_by_field["cuit"] = rects
+    return st
+
+def _finish_page(st: _PageState, cfg: Settings, llm: Optional[BaseLLMProvider], fechas: List[str],
+                 cuits: List[str], fallbacks: int, templates: Optional[TemplateStore],
+                 pages: Optional[PageIndex] = None) -> int:
+    """Aprende plantillas, hace el fallback de página completa (paso 3),
+    guarda la huella de la página y acumula lo de la página en
+    `fechas`/`cuits`. Devuelve los fallbacks usados."""
+    if st.reused:
+        fechas.extend(dict.fromkeys(st.dates))
+        cuits.extend(dict.fromkeys(st.cuits))
+        return fallbacks
+    if templates is not None and st.anchors is not None:
+        _learn_templates(templates, st.layout, st.page, st.anchors, st.text_hits, st.clip_hits)
+
+    # 3) Fallback full-page (si aún falta y queda cupo en el documento)
+    need_fecha = not st.dates
+    need_cuit  = not st.cuits and not cuits
+    can_fallback = llm is not None and (cfg.full_page_fallbacks < 0 or fallbacks < cfg.full_page_fallbacks)
+    # Con escalera de zooms se sube sólo si el modelo devolvió algo que no
+    # valida: una página sin los datos no justifica otro render.
+    sent, looked = _images_sent(), False
+    for zoom in cfg.full_zooms():
+        if not ((need_fecha or need_cuit) and can_fallback):
+            break
+        fallbacks += 1
+        looked = True
+        st.used_llm = True
+        full_img = st.raster.crop(None, zoom)
+        raw_counts = [0, 0]
+        f_all, c_all = llm_extract_all_from_page(llm, full_img, cfg, raw_counts)
+        if need_fecha and f_all:
+            st.dates.extend(f_all)
+        if need_cuit and c_all:
+            st.cuits.extend(c_all)
+        misread = (need_fecha and raw_counts[0] and not f_all) or (need_cuit and raw_counts[1] and not c_all)
+        _zoom_outcome("full", zoom, not misread)
+        if not misread:
+            break
+        need_fecha = not st.dates
+        need_cuit  = not st.cuits and not cuits
+        can_fallback = cfg.full_page_fallbacks < 0 or fallbacks < cfg.full_page_fallbacks
+    st.calls += _images_sent() - sent
+
+    # 4) Huella de una página que costó LLM: sólo si quedó resuelta o el modelo
+    #    la vio entera, y sin llamadas fallidas (un vacío por error no se copia)
+    if pages is not None and st.fingerprint is not None and st.calls:
+        complete = looked or not (need_fecha or need_cuit)
+        if complete and _failed_calls(llm) == st.failed_before:
+            pages.remember(st.fingerprint, st.fields, list(dict.fromkeys(st.dates)),
+                           list(dict.fromkeys(st.cuits)), st.calls)
+
+    # 5) Acumular deduplicado
+    fechas.extend(dict.fromkeys(st.dates))
+    cuits.extend(dict.fromkeys(st.cuits))
+    return fallbacks
+
+def _batched_clips(batcher: ClipBatcher, states: List[_PageState], cfg: Settings) -> None:
+    """Recortes de todas las páginas por el batcher, un nivel de zoom por vez.
+
+    Como en `llm_extract_clips`, gana el primer recorte válido de cada campo
+    por página (en orden de rects) y sólo se escala lo que no validó.
+    """
+    pending = []
+    for st in states:
+        st.used_llm = True
+        for fld, clips in _clips_by_field(st.page, st.rects_by_field, cfg).items():
+            pending.extend((st, fld, anchor, clip) for anchor, clip in clips)
+    found = {}
+    for zoom in cfg.clip_zooms():
+        by_page = {}
+        for st, _, _, clip in pending:
+            by_page.setdefault(id(st), (st, []))[1].append(clip)
+        for st, clips in by_page.values():
+            st.raster.plan(zoom, clips)
+        tickets = [batcher.submit(st.raster.crop(clip, zoom), fld) for st, fld, _, clip in pending]
+        for (st, fld, anchor, clip), val in zip(pending, batcher.collect(tickets)):
+            val = _normalize_field(val, fld, cfg)
+            _zoom_outcome("clip", zoom, bool(val))
+            st.calls += 1
+            if val and (id(st), fld) not in found:
+                found[(id(st), fld)] = val
+                st.clip_hits[fld] = (anchor, clip)
+                st.add({fld: val})
+        pending = [p for p in pending if (id(p[0]), p[1]) not in found]
+        if not pending:
+            break
+
+def scan_pdf(pdf_path: Path, cfg: Settings, llm: Optional[BaseLLMProvider], hoy=None,
+             templates: Optional[TemplateStore] = None,
+             batcher: Optional[ClipBatcher] = None,
+             pages: Optional[PageIndex] = None) -> Optional[ScanResult]:
+    """Recorre el PDF y junta fechas/CUITs. None si no se pudo abrir.
+
+    Según `cfg.scan_policy`:
+    - "all": todas las páginas
+    - "first-n-pages": sólo las primeras `cfg.scan_max_pages`
+    - "first-hit": corta en cuanto hay CUIT y una fecha pasada
+    En todos los casos, una vez encontrado un CUIT no se lo vuelve a buscar
+    (gana el primero), y el fallback de página completa se limita a
+    `cfg.full_page_fallbacks` llamadas por documento (-1 = sin límite).
+    Con `templates`, las páginas de un layout conocido prueban primero los
+    rects aprendidos y sólo si falta algo se buscan anclas.
+    Con `batcher` (y una política distinta de "first-hit"), los recortes de
+    todas las páginas se envían juntos en lotes antes de los fallbacks.
+    Con `pages`, una página casi idéntica a otra ya resuelta con LLM (en este
+    u otro documento) reusa sus valores sin pasar por ningún nivel con LLM.
+    Sin `llm` (modo `text_only`) sólo se usan plantillas y capa de texto.
+    `failed` queda en True si alguna llamada al LLM falló durante el escaneo.
+    """
     try:
         doc = fitz.open(pdf_path.as_posix())
     except Exception as e:
         log.warning("No se pudo abrir %s: %s", pdf_path, e)
-        return None, None
+        return None
+    failed_before = _failed_calls(llm)
+    try:
+        if batcher is not None and cfg.scan_policy != "first-hit":
+            scan = _scan_doc_batched(doc, pdf_path, cfg, llm, templates, batcher, pages)
+        else:
+            scan = _scan_doc(doc, pdf_path, cfg, llm, hoy, templates, pages)
+    finally:
+        doc.close()
+    # con un provider compartido entre hilos cuenta también lo que fallaron
+    # los demás: ante la duda, el resultado no se cachea
+    scan.failed = _failed_calls(llm) > failed_before
+    return scan
 
-    for i in range(doc.page_count):
+def _scan_doc(doc, pdf_path: Path, cfg: Settings, llm: BaseLLMProvider, hoy,
+              templates: Optional[TemplateStore], pages: Optional[PageIndex] = None) -> ScanResult:
+    fechas: List[str] = []
+    cuits:  List[str] = []
+    fallbacks = 0
+    text_only = True
+    for i in range(_pages_to_scan(doc, cfg)):
+        if cfg.scan_policy == "first-hit" and cuits and pick_closest_past_date(fechas, hoy=hoy):
+            log.debug("%s: fecha y CUIT resueltos en la página %s", pdf_path.name, i)
+            break
+        st = None
         try:
-            page = doc.load_page(i)
-            page_found_dates: List[str] = []
-            page_found_cuits: List[str] = []
-
-            # 1) Texto embebido (barato)
-            txt = page.get_text("text") or ""
-            tf = normalize_date_textlike(txt, cfg.min_year, cfg.max_year)
-            tc = normalize_cuit_textlike(txt)
-            if tf: page_found_dates.append(tf)
-            if tc: page_found_cuits.append(tc)
-
-            need_fecha = not page_found_dates
-            need_cuit  = not page_found_cuits
-
-            # 2) Anclas -> recortes a la derecha (si falta)
-            rects_fecha, rects_cuit = [], []
-            if need_fecha:
-                for term in SEARCH_TERMS_FECHA:
-                    rects_fecha.extend(page.search_for(term) or [])
-                rects_fecha = dedup_rects(rects_fecha)
-                rects_fecha.sort(key=lambda r: (r.y0, r.x0))
-            if need_cuit:
-                for term in SEARCH_TERMS_CUIT:
-                    rects_cuit.extend(page.search_for(term) or [])
-                rects_cuit = dedup_rects(rects_cuit)
-                rects_cuit.sort(key=lambda r: (r.y0, r.x0))
-
-            if need_fecha and rects_fecha:
-                for rect in rects_fecha[:cfg.max_rects_per_anchor]:
-                    clip = clip_right_rect(page, rect)
-                    img  = render(page, clip_rect=clip, zoom=cfg.render_zoom_clip)
-                    fval = llm_extract_field_from_image(llm, img, "fecha", cfg)
-                    if fval:
-                        page_found_dates.append(fval)
-                        break
-
-            if need_cuit and rects_cuit:
-                for rect in rects_cuit[:cfg.max_rects_per_anchor]:
-                    clip = clip_right_rect(page, rect)
-                    img  = render(page, clip_rect=clip, zoom=cfg.render_zoom_clip)
-                    cval = llm_extract_field_from_image(llm, img, "cuit", cfg)
-                    if cval:
-                        page_found_cuits.append(cval)
-                        break
-
-            # 3) Fallback full-page (si aún falta)
-            need_fecha = not page_found_dates
-            need_cuit  = not page_found_cuits
-            if need_fecha or need_cuit:
-                full_img = render(page, clip_rect=None, zoom=cfg.render_zoom_full)
-                f_all, c_all = llm_extract_all_from_page(llm, full_img, cfg)
-                if need_fecha and f_all:
-                    page_found_dates.extend(f_all)
-                if need_cuit and c_all:
-                    page_found_cuits.extend(c_all)
-
-            # 4) Acumular deduplicado
-            if page_found_dates:
-                seen = set(); ordered = []
-                for f in page_found_dates:
-                    if f not in seen:
-                        seen.add(f); ordered.append(f)
-                fechas.extend(ordered)
-            if page_found_cuits:
-                seen = set(); ordered = []
-                for c in page_found_cuits:
-                    if c not in seen:
-                        seen.add(c); ordered.append(c)
-                cuits.extend(ordered)
+            st = _prepare_page(doc, i, cfg, llm, cuits, templates, pages)
+            if st.rects_by_field:
+                st.used_llm = True
+                sent = _images_sent()
+                st.add(llm_extract_clips(llm, st.raster, st.rects_by_field, cfg, where=st.clip_hits))
+                st.calls += _images_sent() - sent
+            fallbacks = _finish_page(st, cfg, llm, fechas, cuits, fallbacks, templates, pages)
+        except Exception as e:
+            log.debug("Página %s de %s falló: %s", i, pdf_path.name, e)
+            continue
+        finally:
+            # liberar los rasters de la página antes de pasar a la siguiente
+            if st is not None:
+                text_only = text_only and not st.used_llm
+                st.raster.close()
+    return ScanResult(fechas=fechas, cuits=cuits, text_only=text_only)
 
+def _scan_doc_batched(doc, pdf_path: Path, cfg: Settings, llm: BaseLLMProvider,
+                      templates: Optional[TemplateStore], batcher: ClipBatcher,
+                      pages: Optional[PageIndex] = None) -> ScanResult:
+    # 1ra pasada: texto/anclas de todas las páginas; los CUIT ya leídos del
+    # texto evitan pedir recortes de CUIT en las páginas siguientes. Como gana
+    # el primer CUIT, sólo va al lote el de la primera página con ancla; las
+    # demás quedan en reserva por si ese recorte no da un valor válido.
+    states: List[_PageState] = []
+    known_cuits: List[str] = []
+    reserve: List[Tuple[_PageState, list]] = []
+    for i in range(_pages_to_scan(doc, cfg)):
+        try:
+            st = _prepare_page(doc, i, cfg, llm, known_cuits, templates, pages)
         except Exception as e:
             log.debug("Página %s de %s falló: %s", i, pdf_path.name, e)
             continue
+        known_cuits.extend(st.cuits)
+        if "cuit" in st.rects_by_field:
+            if any("cuit" in prev.rects_by_field for prev in states):
+                reserve.append((st, st.rects_by_field.pop("cuit")))
+        states.append(st)
 
-    fecha_obj = pick_closest_past_date(fechas, hoy=hoy)
-    cuit_unico = None
-    if cuits:
-        seen, dedup = set(), []
-        for c in cuits:
-            if c not in seen:
-                seen.add(c); dedup.append(c)
-        cuit_unico = dedup[0] if dedup else None
+    fechas: List[str] = []
+    cuits:  List[str] = []
+    fallbacks = 0
+    try:
+        _batched_clips(batcher, [st for st in states if st.rects_by_field], cfg)
+        for st, rects in reserve:
+            if any(prev.cuits for prev in states if prev.index < st.index):
+                break
+            st.rects_by_field = {"cuit": rects}
+            _batched_clips(batcher, [st], cfg)
+        # 2da pasada en orden de página: fallbacks con lo ya resuelto
+        for st in states:
+            try:
+                fallbacks = _finish_page(st, cfg, llm, fechas, cuits, fallbacks, templates, pages)
+            except Exception as e:
+                log.debug("Página %s de %s falló: %s", st.index, pdf_path.name, e)
+            finally:
+                st.raster.close()
+    finally:
+        for st in states:
+            st.raster.close()
+    return ScanResult(fechas=fechas, cuits=cuits, text_only=not any(st.used_llm for st in states))
 
-    return fecha_obj, cuit_unico
+def process_one_pdf(pdf_path: Path, cfg: Settings, llm: BaseLLMProvider, hoy=None,
+                    templates: Optional[TemplateStore] = None) -> Tuple[Optional[str], Optional[str]]:
+    return pick_result(scan_pdf(pdf_path, cfg, llm, hoy=hoy, templates=templates), hoy=hoy)
+
+def build_templates(cfg: Settings) -> Optional[TemplateStore]:
+    return TemplateStore(cfg.templates_path()) if cfg.templates_enabled else None
+
+def build_page_index(cfg: Settings, llm: Optional[BaseLLMProvider]) -> Optional[PageIndex]:
+    # sin LLM no hay llamadas que evitar: ni se toman huellas
+    if llm is None or not cfg.page_dedup_enabled:
+        return None
+    from .cache import settings_fingerprint
+    from .dedup import PageIndex
+    return PageIndex(cfg.page_index_path(), settings_fingerprint(cfg),
+                     max_distance=cfg.page_dedup_max_distance, max_ink=cfg.page_dedup_max_ink)
+
+def build_batcher(cfg: Settings, llm: Optional[BaseLLMProvider]) -> Optional[ClipBatcher]:
+    if llm is None or cfg.llm_batch_size <= 1:
+        return None
+    from .batching import ClipBatcher
+    # un lote por request en vuelo: el provider async los envía en paralelo
+    return ClipBatcher(llm, max_size=cfg.llm_batch_size * llm.max_in_flight,
+                       window_s=cfg.llm_batch_window_ms / 1000.0)
+
+# --- Ejecución en paralelo ---
+# Cada proceso del pool arma su propio provider (cliente HTTP + throttle);
+# los documentos fitz ya se abren y cierran dentro de scan_pdf.
+_worker_cfg: Optional[Settings] = None
+_worker_llm: Optional[BaseLLMProvider] = None
+_worker_hoy: Optional[date] = None
+_worker_templates: Optional[TemplateStore] = None
+_worker_batcher: Optional[ClipBatcher] = None
+_worker_pages: Optional[PageIndex] = None
+
+def _init_worker(cfg: Settings, hoy: date) -> None:
+    global _worker_cfg, _worker_llm, _worker_hoy, _worker_templates, _worker_batcher, _worker_pages
+    _worker_cfg = cfg
+    _worker_llm = build_provider(cfg)
+    _worker_hoy = hoy
+    _worker_templates = build_templates(cfg)
+    _worker_batcher = build_batcher(cfg, _worker_llm)
+    _worker_pages = build_page_index(cfg, _worker_llm)
 
-def process_folder(cfg: Settings, hoy=None) -> List[dict]:
+def _close_worker() -> None:
+    # en procesos del pool no hace falta (se pierde lo no volcado); el modo
+    # watch lo llama en su hilo al terminar
+    global _worker_templates, _worker_pages
+    if _worker_templates is not None:
+        _worker_templates.close()
+        _worker_templates = None
+    if _worker_pages is not None:
+        _worker_pages.close()
+        _worker_pages = None
+
+# Resultado de un PDF: (ruta, candidatos, métricas del PDF)
+ScanItem = Tuple[Path, Optional[ScanResult], dict]
+
+def _scan_measured(pdf_path: Path, cfg: Settings, llm: BaseLLMProvider, hoy,
+                   templates: Optional[TemplateStore] = None,
+                   batcher: Optional[ClipBatcher] = None,
+                   pages: Optional[PageIndex] = None) -> ScanItem:
+    # Las métricas del proceso se reinician por PDF y viajan con el resultado
+    METRICS.reset()
+    t0 = time.perf_counter()
+    scan = scan_pdf(pdf_path, cfg, llm, hoy=hoy, templates=templates, batcher=batcher, pages=pages)
+    snap = METRICS.snapshot()
+    snap["seconds"] = time.perf_counter() - t0
+    return pdf_path, scan, snap
+
+def _scan_in_worker(pdf_path: Path) -> ScanItem:
+    return _scan_measured(pdf_path, _worker_cfg, _worker_llm, _worker_hoy, _worker_templates,
+                          _worker_batcher, _worker_pages)
+
+def _scan_serial(pdf_files: List[Path], cfg: Settings, hoy: date) -> Iterable[ScanItem]:
+    if not pdf_files:
+        return
+    llm = build_provider(cfg)
+    templates = build_templates(cfg)
+    batcher = build_batcher(cfg, llm)
+    pages = build_page_index(cfg, llm)
+    try:
+        for path in pdf_files:
+            yield _scan_measured(path, cfg, llm, hoy, templates, batcher, pages)
+    finally:
+        if templates is not None:
+            templates.close()
+        if pages is not None:
+            pages.close()
+
+def _scan_parallel(pdf_files: List[Path], cfg: Settings, hoy: date) -> Iterable[ScanItem]:
+    workers = min(cfg.workers, len(pdf_files))
+    log.info("Procesando %s PDFs con %s workers", len(pdf_files), workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cfg, hoy)) as ex:
+        # Se devuelven en orden de finalización para registrarlos en el journal
+        # cuanto antes; la salida final se ordena por nombre desde el journal.
+        futures = [ex.submit(_scan_in_worker, path) for path in pdf_files]
+        for fut in as_completed(futures):
+            yield fut.result()
+
+def _result_row(path: Path, scan: Optional[ScanResult], hoy) -> dict:
+    fecha, cuit = pick_result(scan, hoy=hoy)
+    return {
+        "archivo": path.name,
+        "fecha_ddmmyyyy": fecha or "",
+        "cuit": cuit or ""
+    }
+
+def _track_slowest(slowest: list, path: Path, snap: dict, top: int) -> None:
+    heapq.heappush(slowest, (snap["seconds"], path.name, _slowest_entry(path, snap)))
+    if len(slowest) > top:
+        heapq.heappop(slowest)
+
+def write_outputs(cfg: Settings, journal: Journal) -> None:
+    """CSV/XLSX/Parquet en una sola pasada por el journal (memoria constante).
+
+    Con `cfg.shard` sólo se escribe el parcial CSV (las salidas finales las
+    arma `pdf_fields merge`).
+    """
+    if cfg.shard is not None:
+        write_rows(journal.rows(), [CsvSink(cfg.partial_path(), COLUMNS)])
+        return
+    sinks = []
+    try:
+        if cfg.write_csv:
+            sinks.append(CsvSink(cfg.csv_path(), COLUMNS))
+        if cfg.write_xlsx:
+            sinks.append(XlsxSink(cfg.xlsx_path(), COLUMNS, journal.widths.widths()))
+        if cfg.write_parquet:
+            sinks.append(ParquetSink(cfg.parquet_path(), COLUMNS))
+    except Exception:
+        for sink in sinks:
+            sink.close()
+        raise
+    write_rows(journal.rows(), sinks)
+
+def _slowest_entry(path: Path, snap: dict) -> dict:
+    stages = {name: round(total, 4) for name, (_, total, _) in snap.get("timers", {}).items()}
+    return {"archivo": path.name, "seconds": round(snap["seconds"], 4), "stages": stages}
+
+def write_run_report(cfg: Settings, run: Metrics, summary: dict, slowest: list) -> None:
+    report = dict(summary)
+    report["counters"] = dict(sorted(run.counters.items()))
+    report["timers"] = timers_summary(run.timers)
+    ladder = zoom_ladder_summary(run.counters)
+    if ladder:
+        report["zoom_ladder"] = ladder
+    dedup = page_dedup_summary(run.counters)
+    if dedup:
+        report["page_dedup"] = dedup
+        log.info("Páginas duplicadas: %s de %s reusadas, %s llamadas al LLM evitadas",
+                 dedup["pages_reused"], dedup["pages_fingerprinted"], dedup["llm_calls_avoided"])
+    if cfg.profile:
+        report["slowest"] = [entry for _, _, entry in sorted(slowest, reverse=True)]
+        for entry in report["slowest"]:
+            log.info("Perfil: %-40s %7.2fs", entry["archivo"], entry["seconds"])
+    write_json_report(cfg.report_path(), report)
+    if cfg.prom_file:
+        write_prometheus(Path(cfg.prom_file), run)
+
+def process_folder(cfg: Settings, hoy=None) -> int:
+    """Procesa la carpeta y escribe las salidas. Devuelve la cantidad de filas."""
+    t_start = time.perf_counter()
+    started = datetime.now()
     ensure_out_dir(cfg.out_dir)
     pdf_files = sorted(Path(cfg.input_dir).glob("*.pdf"))
     if cfg.max_files is not None:
         pdf_files = pdf_files[:cfg.max_files]
     if not pdf_files:
         log.warning("No hay PDFs en: %s", cfg.input_dir)
-        return []
+        return 0
+    # Con --shard i/N se procesa sólo la parte del lote que toca a este nodo
+    # (aunque quede vacía: el manifest igual tiene que existir para el merge)
+    universe = pdf_files
+    if cfg.shard is not None:
+        pdf_files = select_shard(universe, cfg.shard)
+        log.info("Shard %s/%s: %s de %s PDFs", *cfg.shard, len(pdf_files), len(universe))
 
-    llm = build_provider(cfg)
-    resultados = []
+    # Fijamos "hoy" una sola vez: la elección de fecha se hace en este proceso
+    if hoy is None:
+        hoy = date.today()
+
+    # Journal: cada resultado se persiste apenas se obtiene
+    journal = Journal(cfg.journal_path())
+    if not cfg.resume:
+        journal.reset()
+
+    # Cache por contenido: los aciertos no abren el PDF ni llaman al LLM
+    cache = ResultCache.from_settings(cfg) if cfg.cache_enabled else None
+    pending, keys = [], {}
+    skipped = 0
     for path in pdf_files:
-        fecha, cuit = process_one_pdf(path, cfg, llm, hoy=hoy)
-        resultados.append({
-            "archivo": path.name,
-            "fecha_ddmmyyyy": fecha or "",
-            "cuit": cuit or ""
-        })
+        if cfg.resume and journal.has(path.name):
+            skipped += 1
+            continue
+        if cache is not None:
+            key = cache.key(path)
+            payload = cache.get(key)
+            if payload is not None:
+                journal.append(_result_row(path, ScanResult.from_dict(payload), hoy))
+                continue
+            keys[path] = key
+        pending.append(path)
+    if cfg.resume:
+        log.info("Resume: %s PDFs ya registrados en el journal", skipped)
+    if cache is not None:
+        log.info("Cache de resultados: %s hits / %s misses", cache.hits, cache.misses)
+
+    if cfg.workers > 1 and len(pending) > 1:
+        scans = _scan_parallel(pending, cfg, hoy)
+    else:
+        scans = _scan_serial(pending, cfg, hoy)
+
+    run = Metrics()
+    slowest: list = []   # heap acotado de los PDFs más lentos (para --profile)
+    scanned = by_text = 0
+    failures: List[str] = []
+    for path, scan, snap in scans:
+        run.merge(snap)
+        run.observe("pdf.total", snap["seconds"])
+        if cfg.profile:
+            _track_slowest(slowest, path, snap, cfg.profile_top)
+        if scan is not None:
+            scanned += 1
+            by_text += scan.resolved_by_text
+        # sin abrir o con llamadas fallidas: el manifest lo lista para reintentar
+        if scan is None or scan.failed:
+            failures.append(path.name)
+        # un vacío por un corte o por cupo agotado no es "sin datos"
+        if cache is not None and scan is not None and not scan.failed:
+            cache.put(keys[path], scan.to_dict())
+        # sin abrir o con llamadas fallidas: `--resume` lo vuelve a intentar
+        journal.append(_result_row(path, scan, hoy), ok=scan is not None and not scan.failed)
         # Pausa corta adicional por archivo
         # (el throttling fino está dentro del provider)
         # time.sleep(0.25)  -> no necesario si tu tasa ya está ok
 
-    if cfg.write_csv:
-        with cfg.csv_path().open("w", encoding="utf-8", newline="") as fh:
-            wr = csv.writer(fh, delimiter=';')
-            wr.writerow(["archivo", "fecha_ddmmyyyy", "cuit"])
-            for row in resultados:
-                wr.writerow([row["archivo"], row["fecha_ddmmyyyy"], row["cuit"]])
-
-    if cfg.write_xlsx:
-        df = pd.DataFrame(resultados, columns=["archivo", "fecha_ddmmyyyy", "cuit"])
-        with pd.ExcelWriter(cfg.xlsx_path(), engine="openpyxl") as writer:
-            df.to_excel(writer, index=False, sheet_name="Resumen Lote")
-            ws = writer.sheets["Resumen Lote"]
-            for cell in ws[1]:
-                cell.font = Font(bold=True)
-                cell.alignment = Alignment(horizontal="center")
-            # auto width
-            for col in ws.columns:
-                max_len = 0
-                col_letter = col[0].column_letter
-                for cell in col:
-                    val = "" if cell.value is None else str(cell.value)
-                    max_len = max(max_len, len(val))
-                ws.column_dimensions[col_letter].width = min(max_len + 2, 60)
-
-    return resultados
+    if scanned:
+        log.info("Capa de texto: %s/%s documentos resueltos sin LLM (%.1f%%)",
+                 by_text, scanned, 100.0 * by_text / scanned)
+
+    with run.timer("stage.write_outputs"):
+        write_outputs(cfg, journal)
+    total = journal.count()
+    journal.close()
+
+    if cache is not None:
+        run.inc("cache.hits", cache.hits)
+        run.inc("cache.misses", cache.misses)
+    run.inc("docs.scanned", scanned)
+    run.inc("docs.text_only", by_text)
+    summary = {
+        "files": len(pdf_files),
+        "rows": total,
+        "scanned": scanned,
+        "resumed_skipped": skipped,
+        "failed": len(failures),
+        "text_only_share": round(by_text / scanned, 4) if scanned else None,
+        "wall_seconds": round(time.perf_counter() - t_start, 3),
+    }
+
+    if cache is not None:
+        removed = cache.evict(cfg.cache_max_entries, cfg.cache_max_age_days)
+        if removed:
+            log.info("Cache de resultados: %s entradas eliminadas", removed)
+        cache.close()
+
+    write_run_report(cfg, run, summary, slowest)
+    if cfg.shard is not None:
+        write_manifest(cfg, universe, pdf_files, summary, failures, started)
+
+    return total
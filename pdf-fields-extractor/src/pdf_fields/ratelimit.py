@@ -0,0 +1,326 @@
+
+# -*- coding: utf-8 -*-
+"""
+Control de ritmo adaptativo para las llamadas al LLM.
+
+- `RateLimitInfo`: lee los headers `x-ratelimit-*` y `retry-after(-ms)`.
+- `SharedLedger`: presupuesto de requests/tokens por minuto en un archivo con
+  lock exclusivo, compartido por todos los procesos del host (workers y
+  corridas simultáneas del CLI). Se corrige con lo que informa la API y, ante
+  un 429, pausa a todos los procesos juntos en lugar de que cada uno reintente
+  por su cuenta.
+- `AIMDWindow`: cantidad de requests en vuelo por proceso; suma 1 por
+  "ventana" de respuestas OK y se divide a la mitad ante 429 o cuando el cupo
+  restante informado baja del umbral.
+- `RateController`: junta ambos para los providers sync y async.
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import re
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Mapping, Optional
+
+from .metrics import METRICS
+
+try:                                    # POSIX
+    import fcntl
+except ImportError:                     # pragma: no cover - Windows
+    fcntl = None
+    import msvcrt
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNIT_S = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """"6m0s", "1.5s", "20ms" o segundos pelados -> segundos."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _UNIT_S[unit] for n, unit in parts)
+
+
+def _int_header(headers: Mapping[str, str], name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+@dataclass
+class RateLimitInfo:
+    limit_requests: Optional[int] = None
+    limit_tokens: Optional[int] = None
+    remaining_requests: Optional[int] = None
+    remaining_tokens: Optional[int] = None
+    reset_requests_s: Optional[float] = None
+    reset_tokens_s: Optional[float] = None
+    retry_after_s: Optional[float] = None
+
+    @classmethod
+    def from_headers(cls, headers: Optional[Mapping[str, str]]) -> "RateLimitInfo":
+        if not headers:
+            return cls()
+        retry = None
+        if headers.get("retry-after-ms"):
+            retry = (parse_duration(headers["retry-after-ms"]) or 0.0) / 1000.0
+        elif headers.get("retry-after"):
+            retry = parse_duration(headers["retry-after"])
+        return cls(
+            limit_requests=_int_header(headers, "x-ratelimit-limit-requests"),
+            limit_tokens=_int_header(headers, "x-ratelimit-limit-tokens"),
+            remaining_requests=_int_header(headers, "x-ratelimit-remaining-requests"),
+            remaining_tokens=_int_header(headers, "x-ratelimit-remaining-tokens"),
+            reset_requests_s=parse_duration(headers.get("x-ratelimit-reset-requests")),
+            reset_tokens_s=parse_duration(headers.get("x-ratelimit-reset-tokens")),
+            retry_after_s=retry,
+        )
+
+    def remaining_fraction(self) -> Optional[float]:
+        """Menor fracción de cupo restante (requests o tokens) informada."""
+        fracs = [
+            rem / lim for rem, lim in (
+                (self.remaining_requests, self.limit_requests),
+                (self.remaining_tokens, self.limit_tokens),
+            ) if rem is not None and lim
+        ]
+        return min(fracs) if fracs else None
+
+
+def _lock(fh) -> None:
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+    else:                               # pragma: no cover - Windows
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock(fh) -> None:
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    else:                               # pragma: no cover - Windows
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def default_ledger_path(*scope: str) -> Path:
+    """Un ledger por (proveedor, endpoint, modelo) en el directorio temporal."""
+    key = hashlib.sha256("|".join(scope).encode("utf-8")).hexdigest()[:12]
+    return Path(tempfile.gettempdir()) / f"pdf_fields_rate_{key}.json"
+
+
+class SharedLedger:
+    """Token buckets de requests/min y tokens/min guardados en un archivo.
+
+    Cada operación toma un lock exclusivo, lee el estado, lo actualiza y lo
+    vuelve a escribir, así que todos los procesos que usan la misma ruta
+    descuentan del mismo cupo. Los límites salen de la configuración o, si
+    son 0, de los headers `x-ratelimit-limit-*`; sin ninguno de los dos el
+    ledger sólo coordina las pausas por 429.
+    """
+
+    def __init__(self, path: Path, requests_per_min: int = 0, tokens_per_min: int = 0):
+        self.path = path
+        self.requests_per_min = requests_per_min
+        self.tokens_per_min = tokens_per_min
+        self._thread_lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def _state(self):
+        with self._thread_lock, open(self.path, "a+", encoding="utf-8") as fh:
+            _lock(fh)
+            try:
+                fh.seek(0)
+                raw = fh.read()
+                try:
+                    state = json.loads(raw) if raw else {}
+                except ValueError:
+                    state = {}
+                self._refill(state, time.time())
+                yield state
+                fh.seek(0)
+                fh.truncate()
+                fh.write(json.dumps(state))
+                fh.flush()
+            finally:
+                _unlock(fh)
+
+    def _refill(self, state: dict, now: float) -> None:
+        # Los límites configurados mandan; si no hay, se usan los aprendidos
+        if self.requests_per_min:
+            state["rpm"] = self.requests_per_min
+        if self.tokens_per_min:
+            state["tpm"] = self.tokens_per_min
+        elapsed = max(0.0, now - state.get("ts", now))
+        for level, cap in (("req", "rpm"), ("tok", "tpm")):
+            capacity = state.get(cap, 0)
+            if capacity:
+                current = state.get(level, capacity)
+                state[level] = min(capacity, current + elapsed * capacity / 60.0)
+                # la API informó cuándo vuelve el cupo completo
+                if now >= state.get(level + "_reset_at", float("inf")):
+                    state[level] = float(capacity)
+                    del state[level + "_reset_at"]
+        state["ts"] = now
+
+    def reserve(self, est_tokens: int) -> float:
+        """Descuenta una request (y `est_tokens`) si hay cupo; si no, devuelve
+        cuántos segundos esperar antes de volver a intentar (sin descontar)."""
+        with self._state() as st:
+            now = st["ts"]
+            wait = max(0.0, st.get("blocked_until", 0.0) - now)
+            if st.get("rpm") and st["req"] < 1:
+                wait = max(wait, (1 - st["req"]) * 60.0 / st["rpm"])
+            if st.get("tpm"):
+                need = min(est_tokens, st["tpm"])
+                if st["tok"] < need:
+                    wait = max(wait, (need - st["tok"]) * 60.0 / st["tpm"])
+            if wait > 0:
+                return wait
+            if st.get("rpm"):
+                st["req"] -= 1
+            if st.get("tpm"):
+                st["tok"] -= min(est_tokens, st["tpm"])
+            return 0.0
+
+    def observe(self, info: RateLimitInfo, est_tokens: int, used_tokens: Optional[int]) -> None:
+        """Ajusta el cupo con la respuesta: tokens reales y headers de la API."""
+        with self._state() as st:
+            if info.limit_requests and not self.requests_per_min:
+                st["rpm"] = info.limit_requests
+                st.setdefault("req", float(info.limit_requests))
+            if info.limit_tokens and not self.tokens_per_min:
+                st["tpm"] = info.limit_tokens
+                st.setdefault("tok", float(info.limit_tokens))
+            if st.get("tpm") and used_tokens is not None:
+                st["tok"] = min(st["tpm"], st["tok"] - (used_tokens - est_tokens))
+            # El servidor ve a todos los clientes: su "remaining" es la verdad
+            if info.remaining_requests is not None and "req" in st:
+                st["req"] = min(st["req"], float(info.remaining_requests))
+            if info.remaining_tokens is not None and "tok" in st:
+                st["tok"] = min(st["tok"], float(info.remaining_tokens))
+            for level, remaining, reset in (("req", info.remaining_requests, info.reset_requests_s),
+                                            ("tok", info.remaining_tokens, info.reset_tokens_s)):
+                if remaining is None or reset is None:
+                    continue
+                st[level + "_reset_at"] = st["ts"] + reset
+                if remaining == 0:
+                    st["blocked_until"] = max(st.get("blocked_until", 0.0), st["ts"] + reset)
+
+    def block(self, seconds: float) -> None:
+        """Pausa a todos los procesos (tras un 429)."""
+        with self._state() as st:
+            st["blocked_until"] = max(st.get("blocked_until", 0.0), st["ts"] + seconds)
+
+
+class AIMDWindow:
+    """Ventana de concurrencia AIMD (como el control de congestión de TCP)."""
+
+    def __init__(self, max_limit: int, start: Optional[int] = None, decrease: float = 0.5,
+                 low_water: float = 0.1, cooldown_s: float = 1.0):
+        self.max_limit = max(1, max_limit)
+        self.limit = float(start if start is not None else max(1, self.max_limit // 2))
+        self.decrease = decrease
+        self.low_water = low_water
+        self.cooldown_s = cooldown_s
+        self._last_cut = 0.0
+
+    @property
+    def size(self) -> int:
+        return max(1, int(self.limit))
+
+    def on_success(self, info: RateLimitInfo) -> None:
+        frac = info.remaining_fraction()
+        if frac is not None and frac < self.low_water:
+            self.on_throttled()
+            return
+        # +1 por ventana completa de respuestas OK
+        self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    def on_throttled(self) -> None:
+        # Una ráfaga de 429 de la misma ventana cuenta como una sola señal
+        now = time.monotonic()
+        if now - self._last_cut < self.cooldown_s:
+            return
+        self._last_cut = now
+        self.limit = max(1.0, self.limit * self.decrease)
+        METRICS.inc("rate.window_cuts")
+
+
+class RateController:
+    """Presupuesto compartido (ledger) + ventana AIMD de requests en vuelo."""
+
+    def __init__(self, ledger: Optional[SharedLedger], max_in_flight: int = 1,
+                 est_tokens_per_call: int = 1200):
+        self.ledger = ledger
+        self.window = AIMDWindow(max_in_flight)
+        self.est_tokens_per_call = est_tokens_per_call
+        self._in_flight = 0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _reserve(self) -> float:
+        if self.ledger is None:
+            return 0.0
+        return self.ledger.reserve(self.est_tokens_per_call)
+
+    def wait(self) -> None:
+        """Bloquea hasta que el ledger conceda una request."""
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            METRICS.observe("rate.ledger_wait", wait)
+            time.sleep(wait)
+
+    async def await_budget(self) -> None:
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            METRICS.observe("rate.ledger_wait", wait)
+            await asyncio.sleep(wait)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Lugar en la ventana AIMD (reemplaza al semáforo fijo)."""
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self.window.size)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def on_response(self, headers: Optional[Mapping[str, str]], used_tokens: Optional[int]) -> None:
+        # Se llama antes de liberar el slot: al liberarlo, las tareas en espera
+        # ya ven la ventana actualizada.
+        info = RateLimitInfo.from_headers(headers)
+        self.window.on_success(info)
+        if self.ledger is not None:
+            self.ledger.observe(info, self.est_tokens_per_call, used_tokens)
+
+    def on_rate_limited(self, wait_s: float) -> None:
+        self.window.on_throttled()
+        if self.ledger is not None:
+            self.ledger.block(wait_s)
+        METRICS.inc("rate.limited")
@@ -0,0 +1,374 @@
+
+# -*- coding: utf-8 -*-
+"""
+Servicio HTTP local: `POST /extract` con el PDF en el cuerpo devuelve la
+Fecha/CUIT en JSON, para sistemas que necesitan un documento a la vez en
+lugar de lotes por carpeta.
+
+    python -m pdf_fields serve --out-dir ./out --threads 4 --queue-size 32
+    curl --data-binary @factura.pdf "http://127.0.0.1:8080/extract?archivo=factura.pdf"
+
+- Un solo provider (cliente, pool HTTP, throttle/ledger, memo) y un solo
+  batcher compartidos por `--threads` hilos de extracción.
+- Cola acotada: con la cola llena se responde 429; si la espera estimada
+  supera `--request-timeout` o el servicio se está deteniendo, 503. Ambos
+  con `Retry-After`. También 503 (con `"failed": true`) si alguna llamada al
+  LLM falló durante el cálculo: un vacío por error no es "sin datos".
+- Uploads idénticos (mismo SHA-256) que llegan mientras uno está en cola o en
+  proceso comparten ese cálculo; los que llegan después salen del cache de
+  resultados.
+- `GET /health` (estado y colas) y `GET /metrics` (Prometheus).
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import math
+import os
+import queue
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .cache import ResultCache
+from .config import Settings
+from .metrics import METRICS, prometheus_text
+from .pipeline import (ScanResult, build_batcher, build_page_index, build_provider, build_templates,
+                       ensure_out_dir, pick_result, scan_pdf)
+
+if TYPE_CHECKING:
+    from .llm_provider import BaseLLMProvider
+
+log = logging.getLogger(__name__)
+
+# Retry-After sugerido cuando fallaron llamadas al LLM (429 sostenido, cupo)
+LLM_RETRY_AFTER_S = 10
+
+
+class Rejected(Exception):
+    """La request no se acepta ahora: 429 (cola llena) o 503 (no disponible)."""
+
+    def __init__(self, status: int, reason: str, retry_after_s: float):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+class Job:
+    """Un PDF en cola o en proceso; lo comparten las requests con el mismo hash."""
+
+    __slots__ = ("sha256", "data", "queued_at", "done", "scan", "error", "seconds")
+
+    def __init__(self, sha256: str, data: Optional[bytes]):
+        self.sha256 = sha256
+        self.data = data
+        self.queued_at = time.monotonic()
+        self.done = threading.Event()
+        self.scan: Optional[ScanResult] = None
+        self.error: Optional[str] = None
+        self.seconds = 0.0
+
+    @classmethod
+    def finished(cls, sha256: str, scan: ScanResult) -> "Job":
+        job = cls(sha256, None)
+        job.scan = scan
+        job.done.set()
+        return job
+
+
+class ExtractionService:
+    """Cola acotada + hilos de extracción con provider compartido.
+
+    `llm` permite inyectar un provider ya armado; por defecto se usa
+    `build_provider(cfg)` (None con `text_only`).
+    """
+
+    def __init__(self, cfg: Settings, llm: Optional["BaseLLMProvider"] = None):
+        self.cfg = cfg
+        self.threads = max(1, cfg.serve_threads)
+        self._llm = llm
+        self.llm: Optional["BaseLLMProvider"] = None
+        self.batcher = None
+        self.cache: Optional[ResultCache] = None
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue(maxsize=max(1, cfg.serve_queue_size))
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._workers: List[threading.Thread] = []
+        self._busy = 0
+        # promedio móvil de segundos por PDF (para estimar la espera)
+        self._avg_s: Optional[float] = None
+        self._draining = False
+
+    # -- ciclo de vida ------------------------------------------------------
+
+    def start(self) -> "ExtractionService":
+        ensure_out_dir(self.cfg.out_dir)
+        self.llm = self._llm if self._llm is not None else build_provider(self.cfg)
+        self.batcher = build_batcher(self.cfg, self.llm)
+        self.cache = ResultCache.from_settings(self.cfg) if self.cfg.cache_enabled else None
+        for i in range(self.threads):
+            t = threading.Thread(target=self._work, name=f"extract-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+        return self
+
+    def stop(self) -> None:
+        """Deja de aceptar, termina lo encolado y cierra."""
+        with self._lock:
+            self._draining = True
+        for _ in self._workers:
+            self._queue.put(None)
+        for t in self._workers:
+            t.join()
+        self._workers = []
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    # -- requests -----------------------------------------------------------
+
+    def _estimated_wait(self, queued: int) -> float:
+        if self._avg_s is None:
+            return 0.0
+        return self._avg_s * (queued + self._busy) / self.threads
+
+    def submit(self, data: bytes) -> Tuple[Job, str]:
+        """Encola el PDF (o se suma a uno idéntico). Devuelve (job, origen)
+        con origen "scan", "coalesced" o "cache"; `Rejected` si no entra."""
+        sha = hashlib.sha256(data).hexdigest()
+        METRICS.inc("serve.requests")
+        with self._lock:
+            if self._draining:
+                raise Rejected(503, "El servicio se está deteniendo", 5.0)
+            job = self._jobs.get(sha)
+        if job is not None:
+            METRICS.inc("serve.coalesced")
+            return job, "coalesced"
+        if self.cache is not None:
+            payload = self.cache.get(self.cache.key_for_digest(sha))
+            if payload is not None:
+                METRICS.inc("serve.cache_hits")
+                return Job.finished(sha, ScanResult.from_dict(payload)), "cache"
+        with self._lock:
+            # otro hilo pudo encolar el mismo contenido mientras mirábamos el cache
+            job = self._jobs.get(sha)
+            if job is not None:
+                METRICS.inc("serve.coalesced")
+                return job, "coalesced"
+            queued = self._queue.qsize()
+            wait = self._estimated_wait(queued)
+            if wait > self.cfg.serve_timeout_s:
+                METRICS.inc("serve.rejected.503")
+                raise Rejected(503, "Espera estimada mayor al timeout", wait)
+            job = Job(sha, data)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                METRICS.inc("serve.rejected.429")
+                raise Rejected(429, "Cola llena", max(1.0, wait)) from None
+            self._jobs[sha] = job
+        return job, "scan"
+
+    def response(self, job: Job, origin: str, archivo: str) -> Tuple[int, dict, dict]:
+        """(status, cuerpo JSON, headers extra) para la request."""
+        if job.error is not None:
+            return 500, {"error": job.error, "sha256": job.sha256}, {}
+        if job.scan is None:
+            return 422, {"error": "No se pudo abrir el PDF", "sha256": job.sha256}, {}
+        if job.scan.failed:
+            # no se cacheó: el reintento vuelve a escanear
+            METRICS.inc("serve.llm_failed")
+            return 503, {"error": "Fallaron llamadas al LLM; reintentar", "failed": True,
+                         "sha256": job.sha256}, {"Retry-After": str(LLM_RETRY_AFTER_S)}
+        fecha, cuit = pick_result(job.scan)
+        return 200, {
+            "archivo": archivo,
+            "fecha_ddmmyyyy": fecha or "",
+            "cuit": cuit or "",
+            "sha256": job.sha256,
+            "candidates": job.scan.to_dict(),
+            "source": origin,
+            "seconds": round(job.seconds, 4),
+        }, {}
+
+    def health(self) -> dict:
+        with self._lock:
+            return {
+                "status": "draining" if self._draining else "ok",
+                "threads": self.threads,
+                "busy": self._busy,
+                "queued": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                "pending_hashes": len(self._jobs),
+                "avg_seconds": round(self._avg_s, 4) if self._avg_s is not None else None,
+            }
+
+    # -- hilos de extracción ------------------------------------------------
+
+    def _work(self) -> None:
+        # plantillas e índice de páginas (SQLite) son por hilo, como en los
+        # workers del pool
+        templates = build_templates(self.cfg)
+        pages = build_page_index(self.cfg, self.llm)
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    return
+                self._run(job, templates, pages)
+        finally:
+            if templates is not None:
+                templates.close()
+            if pages is not None:
+                pages.close()
+
+    def _run(self, job: Job, templates, pages) -> None:
+        with self._lock:
+            self._busy += 1
+        METRICS.observe("serve.queue_wait", time.monotonic() - job.queued_at)
+        t0 = time.perf_counter()
+        # scan_pdf trabaja sobre una ruta: el upload va a un temporal
+        fd, tmp = tempfile.mkstemp(prefix="pdf_fields_", suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(job.data)
+            job.scan = scan_pdf(Path(tmp), self.cfg, self.llm, templates=templates,
+                                batcher=self.batcher, pages=pages)
+        except Exception as e:
+            log.exception("Error procesando %s", job.sha256[:12])
+            job.error = str(e)
+        finally:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+        job.seconds = time.perf_counter() - t0
+        METRICS.observe("serve.scan", job.seconds)
+        # primero al cache y después se saca de los pendientes: una request
+        # idéntica siempre encuentra uno de los dos. Si falló alguna llamada
+        # al LLM mientras corría (`failed` compara el contador del provider
+        # compartido antes y después de este job) no se cachea: se reintenta
+        if self.cache is not None and job.scan is not None and not job.scan.failed:
+            self.cache.put(self.cache.key_for_digest(job.sha256), job.scan.to_dict())
+        with self._lock:
+            self._busy -= 1
+            self._avg_s = job.seconds if self._avg_s is None else 0.8 * self._avg_s + 0.2 * job.seconds
+            self._jobs.pop(job.sha256, None)
+            job.data = None
+        job.done.set()
+
+
+class ExtractionServer:
+    """HTTP (ThreadingHTTPServer) delante de un `ExtractionService`."""
+
+    def __init__(self, service: ExtractionService, host: str = "127.0.0.1", port: int = 0):
+        self.service = service
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "ExtractionServer":
+        self.service.start()
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self.service.stop()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "ExtractionServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _handler_class(self):
+        service = self.service
+        cfg = service.cfg
+        max_bytes = int(cfg.serve_max_upload_mb * 1024 * 1024)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, fmt, *args):
+                log.debug("%s " + fmt, self.address_string(), *args)
+
+            def _send(self, status: int, payload, headers: Optional[dict] = None,
+                      content_type: str = "application/json"):
+                if isinstance(payload, str):
+                    raw = payload.encode("utf-8")
+                else:
+                    raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(raw)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if path == "/health":
+                    self._send(200, service.health())
+                elif path == "/metrics":
+                    self._send(200, prometheus_text(METRICS), content_type="text/plain; version=0.0.4")
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                if url.path != "/extract":
+                    self._send(404, {"error": "not found"})
+                    return
+                length = self.headers.get("Content-Length")
+                if length is None:
+                    self.close_connection = True
+                    self._send(411, {"error": "Falta Content-Length"})
+                    return
+                try:
+                    length = int(length)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # read(-1) esperaría a que el cliente cierre la conexión
+                    self.close_connection = True
+                    self._send(400, {"error": "Content-Length inválido"})
+                    return
+                if length > max_bytes:
+                    # no se lee el cuerpo: se cierra la conexión
+                    self.close_connection = True
+                    self._send(413, {"error": f"El PDF supera {cfg.serve_max_upload_mb:g} MB"})
+                    return
+                data = self.rfile.read(length)
+                if not data:
+                    self._send(400, {"error": "Cuerpo vacío: enviar el PDF como cuerpo del POST"})
+                    return
+                archivo = parse_qs(url.query).get("archivo", ["documento.pdf"])[0]
+                try:
+                    job, origin = service.submit(data)
+                except Rejected as e:
+                    self._send(e.status, {"error": e.reason},
+                               headers={"Retry-After": str(max(1, math.ceil(e.retry_after_s)))})
+                    return
+                if not job.done.wait(cfg.serve_timeout_s):
+                    # el cálculo sigue: un reintento se suma a él o sale del cache
+                    METRICS.inc("serve.timeouts")
+                    self._send(504, {"error": "Timeout", "sha256": job.sha256})
+                    return
+                status, payload, headers = service.response(job, origin, archivo)
+                self._send(status, payload, headers=headers)
+
+        return Handler
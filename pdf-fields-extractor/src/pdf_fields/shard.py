@@ -0,0 +1,224 @@
+
+# -*- coding: utf-8 -*-
+"""
+Corridas repartidas entre nodos sin coordinador.
+
+Cada nodo corre `--shard i/N` sobre la misma carpeta: el archivo va al shard
+que indica un hash estable de su nombre (SHA-256, igual en cualquier host o
+versión de Python), así que los nodos no necesitan hablar entre sí. Cada
+shard deja un parcial (`lote_resultados.shard-i-of-N.csv`) y un manifest con
+los archivos asignados, conteos, tiempos y fallas. `pdf_fields merge` junta
+los parciales en las salidas finales después de verificar que cada archivo
+del lote quedó cubierto exactamente una vez.
+"""
+from __future__ import annotations
+import csv
+import hashlib
+import json
+import logging
+import socket
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .config import Settings
+from .journal import COLUMNS, Journal
+from .metrics import write_json_report
+
+log = logging.getLogger(__name__)
+
+
+class CoverageError(Exception):
+    """Los parciales no cubren el lote exactamente una vez."""
+
+    def __init__(self, problems: List[str]):
+        super().__init__(f"{len(problems)} problema(s) de cobertura")
+        self.problems = problems
+
+
+def shard_of(name: str, count: int) -> int:
+    """Shard (1..count) de un archivo según el hash de su nombre."""
+    h = int.from_bytes(hashlib.sha256(name.encode("utf-8")).digest()[:8], "big")
+    return h % count + 1
+
+
+def select_shard(paths: Sequence[Path], shard: Tuple[int, int]) -> List[Path]:
+    index, count = shard
+    return [p for p in paths if shard_of(p.name, count) == index]
+
+
+def listing_digest(names: Iterable[str]) -> str:
+    """Huella del listado del lote: todos los shards deben ver el mismo."""
+    h = hashlib.sha256()
+    for name in sorted(names):
+        h.update(name.encode("utf-8") + b"\n")
+    return h.hexdigest()
+
+
+def write_manifest(cfg: Settings, universe: Sequence[Path], assigned: Sequence[Path],
+                   summary: dict, failures: List[str], started: datetime) -> None:
+    index, count = cfg.shard
+    manifest = {
+        "shard": f"{index}/{count}",
+        "index": index,
+        "count": count,
+        "host": socket.gethostname(),
+        "input_dir": str(cfg.input_dir),
+        "universe_files": len(universe),
+        "universe_digest": listing_digest(p.name for p in universe),
+        "partial": cfg.partial_path().name,
+        "started_at": started.isoformat(timespec="seconds"),
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "failures": sorted(failures),
+        "assigned": sorted(p.name for p in assigned),
+    }
+    manifest.update(summary)
+    write_json_report(cfg.manifest_path(), manifest)
+
+
+def _manifest_glob(cfg: Settings) -> str:
+    p = Path(cfg.manifest_name)
+    return f"{p.stem}.shard-*-of-*{p.suffix}"
+
+
+def find_manifests(cfg: Settings, dirs: Sequence[Path]) -> List[Tuple[Path, dict]]:
+    found = []
+    for d in dirs:
+        for path in sorted(Path(d).glob(_manifest_glob(cfg))):
+            found.append((path, json.loads(path.read_text(encoding="utf-8"))))
+    return found
+
+
+def _read_partial(path: Path) -> Iterator[dict]:
+    with path.open(encoding="utf-8", newline="") as fh:
+        reader = csv.reader(fh, delimiter=";")
+        header = next(reader, None)
+        if header != COLUMNS:
+            raise ValueError(f"{path.name}: encabezado inesperado {header}")
+        for values in reader:
+            yield dict(zip(COLUMNS, values))
+
+
+def _check_shards(manifests: List[Tuple[Path, dict]]) -> Tuple[int, List[str]]:
+    problems = []
+    counts = {m["count"] for _, m in manifests}
+    digests = {m["universe_digest"] for _, m in manifests}
+    if len(counts) > 1:
+        problems.append(f"Los manifests no coinciden en N: {sorted(counts)}")
+    if len(digests) > 1:
+        problems.append("Los shards vieron listados distintos del lote (universe_digest)")
+    count = max(counts)
+    by_index: Dict[int, List[Path]] = {}
+    for path, m in manifests:
+        by_index.setdefault(m["index"], []).append(path)
+    for index in range(1, count + 1):
+        paths = by_index.get(index, [])
+        if not paths:
+            problems.append(f"Falta el shard {index}/{count}")
+        elif len(paths) > 1:
+            problems.append(f"El shard {index}/{count} aparece {len(paths)} veces: "
+                            + ", ".join(str(p) for p in paths))
+    return count, problems
+
+
+def merge_shards(cfg: Settings, dirs: Optional[Sequence[Path]] = None) -> dict:
+    """Une los parciales en `cfg.out_dir` (CSV/XLSX/Parquet finales).
+
+    Busca los manifests en `dirs` (por defecto `out_dir`) y verifica que
+    estén todos los shards 1..N, que hayan visto el mismo lote, que cada
+    archivo esté en el shard que le corresponde y aparezca una sola vez, y
+    que la unión sea el lote completo (y, si `cfg.input_dir` está, que
+    coincida con lo que hay hoy en la carpeta). Ante cualquier problema
+    levanta `CoverageError` sin escribir las salidas finales.
+    """
+    from .pipeline import ensure_out_dir, write_outputs
+
+    dirs = list(dirs or [cfg.out_dir])
+    manifests = find_manifests(cfg, dirs)
+    if not manifests:
+        raise CoverageError([f"No hay manifests de shards en: {', '.join(map(str, dirs))}"])
+    count, problems = _check_shards(manifests)
+    if problems:
+        raise CoverageError(problems)
+
+    ensure_out_dir(cfg.out_dir)
+    journal = Journal(cfg.journal_path())
+    journal.reset()
+    seen: Dict[str, int] = {}
+    universe = set()
+    per_shard = []
+    try:
+        for path, m in sorted(manifests, key=lambda pm: pm[1]["index"]):
+            index = m["index"]
+            assigned = set(m["assigned"])
+            universe |= assigned
+            wrong = sorted(a for a in assigned if shard_of(a, count) != index)
+            if wrong:
+                problems.append(f"Shard {index}/{count}: {len(wrong)} archivos de otro shard "
+                                f"(ej. {wrong[0]})")
+            got = set()
+
+            def _rows():
+                for row in _read_partial(path.parent / m["partial"]):
+                    name = row["archivo"]
+                    if name in seen:
+                        problems.append(f"{name} está en los shards {seen[name]} y {index}")
+                        continue
+                    if name not in assigned:
+                        problems.append(f"{name} está en el parcial del shard {index} "
+                                        "pero no en su manifest")
+                        continue
+                    seen[name] = index
+                    got.add(name)
+                    yield row
+
+            try:
+                rows = journal.extend(_rows())
+            except (OSError, ValueError) as e:
+                problems.append(f"Shard {index}/{count}: no se pudo leer el parcial ({e})")
+                continue
+            missing = sorted(assigned - got)
+            if missing:
+                problems.append(f"Shard {index}/{count}: faltan {len(missing)} filas "
+                                f"(ej. {missing[0]})")
+            per_shard.append({
+                "shard": m["shard"],
+                "host": m.get("host"),
+                "rows": rows,
+                "failures": len(m.get("failures", [])),
+                "wall_seconds": m.get("wall_seconds"),
+            })
+
+        expected = manifests[0][1]
+        if len(universe) != expected["universe_files"] \
+                or listing_digest(universe) != expected["universe_digest"]:
+            problems.append(f"Los shards cubren {len(universe)} archivos y el lote tiene "
+                            f"{expected['universe_files']}")
+        if cfg.input_dir is not None:
+            current = sorted(p.name for p in Path(cfg.input_dir).glob("*.pdf"))
+            if cfg.max_files is not None:
+                current = current[:cfg.max_files]
+            if listing_digest(current) != expected["universe_digest"]:
+                problems.append(f"El contenido de {cfg.input_dir} cambió desde las corridas "
+                                f"({len(current)} PDFs hoy)")
+        if problems:
+            raise CoverageError(problems)
+
+        write_outputs(cfg, journal)
+        total = journal.count()
+    finally:
+        journal.close()
+
+    failures = sorted(f for _, m in manifests for f in m.get("failures", []))
+    walls = [s["wall_seconds"] for s in per_shard if s["wall_seconds"] is not None]
+    summary = {
+        "shards": count,
+        "rows": total,
+        "failures": failures,
+        "makespan_seconds": max(walls) if walls else None,
+        "shard_seconds_total": round(sum(walls), 3) if walls else None,
+        "per_shard": per_shard,
+    }
+    write_json_report(cfg.manifest_path(), summary)
+    log.info("Merge: %s shards, %s filas, %s fallas", count, total, len(failures))
+    return summary
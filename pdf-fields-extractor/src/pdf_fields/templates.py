@@ -0,0 +1,213 @@
+
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import fitz
+
+from .cache import open_sqlite
+from .metrics import METRICS
+
+NormRect = Tuple[float, float, float, float]
+# Rects en puntos como tuplas: fitz.Rect es caro de construir en bucles
+Box = Tuple[float, float, float, float]
+
+# Entradas por (layout, campo) y tolerancia antes de descartar una plantilla
+MAX_TEMPLATES_PER_FIELD = 4
+MAX_EXTRA_MISSES = 3
+# Los contadores de uso se escriben en lotes (son estadística, no resultados)
+FLUSH_EVERY = 32
+
+
+def layout_key(doc, page) -> str:
+    """Huella barata del formato: productor/creador del PDF y tamaño de página.
+
+    No distingue por sí sola dos emisores que usen la misma herramienta y
+    tamaño de hoja; por eso cada plantilla además verifica su texto estático
+    (la etiqueta del campo) antes de usarse.
+    """
+    meta = doc.metadata or {}
+    raw = "|".join([
+        (meta.get("producer") or "").strip(),
+        (meta.get("creator") or "").strip(),
+        f"{round(page.rect.width)}x{round(page.rect.height)}",
+    ])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_rect(page, rect: fitz.Rect) -> NormRect:
+    w, h = page.rect.width or 1.0, page.rect.height or 1.0
+    return (round(rect.x0 / w, 4), round(rect.y0 / h, 4), round(rect.x1 / w, 4), round(rect.y1 / h, 4))
+
+
+def denormalize_rect(size: Tuple[float, float], norm: NormRect) -> Box:
+    w, h = size
+    return (max(0.0, norm[0] * w), max(0.0, norm[1] * h), min(w, norm[2] * w), min(h, norm[3] * h))
+
+
+def union_box(boxes) -> Box:
+    x0s, y0s, x1s, y1s = zip(*boxes)
+    return (min(x0s), min(y0s), max(x1s), max(y1s))
+
+
+def pad_rect(rect: fitz.Rect, x: float, y: float) -> fitz.Rect:
+    return fitz.Rect(rect.x0 - x, rect.y0 - y, rect.x1 + x, rect.y1 + y)
+
+
+def _iou(a: NormRect, b: NormRect) -> float:
+    ra, rb = fitz.Rect(a), fitz.Rect(b)
+    inter = abs(ra & rb)
+    union = abs(ra) + abs(rb) - inter
+    return inter / union if union else 0.0
+
+
+def words_in_rect(words, box: Box, partial: bool = False) -> str:
+    """Texto de las palabras dentro de `box` (por su centro, o que lo toquen)."""
+    bx0, by0, bx1, by1 = box
+    out = []
+    for x0, y0, x1, y1, word, *_ in words:
+        if partial:
+            inside = x0 < bx1 and x1 > bx0 and y0 < by1 and y1 > by0
+        else:
+            cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+            inside = bx0 <= cx <= bx1 and by0 <= cy <= by1
+        if inside:
+            out.append(word)
+    return " ".join(out)
+
+
+@dataclass
+class Template:
+    """Dónde apareció un campo en un formato conocido (coordenadas 0-1).
+
+    `source` indica cómo se resolvió al aprenderla: "text" (capa de texto,
+    rect ajustado al valor) o "clip" (recorte a la derecha del ancla que
+    resolvió el LLM).
+    """
+    layout: str
+    field: str
+    label_text: str
+    label_rect: NormRect
+    value_rect: NormRect
+    source: str
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def key(self) -> str:
+        return f"{self.layout}|{self.field}|{self.label_text}|{json.dumps(self.value_rect)}"
+
+    def label(self, size: Tuple[float, float]) -> Box:
+        return denormalize_rect(size, self.label_rect)
+
+    def value(self, size: Tuple[float, float]) -> Box:
+        return denormalize_rect(size, self.value_rect)
+
+    def label_matches(self, words, size: Tuple[float, float]) -> bool:
+        return self.label_text.lower() in words_in_rect(words, self.label(size), partial=True).lower()
+
+    def stale(self) -> bool:
+        return self.misses > 2 * self.hits + MAX_EXTRA_MISSES
+
+
+class TemplateStore:
+    """Plantillas de layout aprendidas (SQLite en out_dir, leídas a memoria).
+
+    Se aprende de cada valor que resolvió el pipeline normal; los documentos
+    siguientes con la misma huella prueban primero esos rects (texto en el
+    rect o un recorte ajustado al LLM) sin buscar anclas ni renderizar los
+    recortes genéricos de `clip_right_rect`.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn = open_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS templates ("
+            " key TEXT PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._by_layout: Dict[Tuple[str, str], List[Template]] = {}
+        self._dirty: Dict[str, Template] = {}
+        self._pending = 0
+        self._load("SELECT payload FROM templates")
+
+    def _load(self, sql: str, params: tuple = ()) -> None:
+        for (payload,) in self._conn.execute(sql, params):
+            d = json.loads(payload)
+            t = Template(**{**d, "label_rect": tuple(d["label_rect"]), "value_rect": tuple(d["value_rect"])})
+            self._by_layout.setdefault((t.layout, t.field), []).append(t)
+
+    def _save(self, *ts: Template) -> None:
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO templates (key, payload, updated) VALUES (?, ?, ?)",
+            [(t.key, json.dumps(t.__dict__), now) for t in ts],
+        )
+        self._conn.commit()
+
+    def _delete(self, t: Template) -> None:
+        self._dirty.pop(t.key, None)
+        self._conn.execute("DELETE FROM templates WHERE key = ?", (t.key,))
+        self._conn.commit()
+
+    def flush(self) -> None:
+        if self._dirty:
+            self._save(*self._dirty.values())
+            self._dirty.clear()
+        self._pending = 0
+
+    def lookup(self, layout: str, field: str) -> List[Template]:
+        """Plantillas vigentes para el layout, las más exitosas primero."""
+        if (layout, field) not in self._by_layout:
+            # puede haberla aprendido otro worker (rango de la clave primaria);
+            # si no hay ninguna, la lista vacía evita repetir la consulta
+            prefix = f"{layout}|{field}|"
+            self._load("SELECT payload FROM templates WHERE key >= ? AND key < ?",
+                       (prefix, prefix[:-1] + "}"))
+            self._by_layout.setdefault((layout, field), [])
+        ts = [t for t in self._by_layout.get((layout, field), []) if not t.stale()]
+        return sorted(ts, key=lambda t: t.hits - t.misses, reverse=True)
+
+    def record(self, t: Template, ok: bool) -> None:
+        if ok:
+            t.hits += 1
+            METRICS.inc("templates.hits")
+        else:
+            t.misses += 1
+            METRICS.inc("templates.misses")
+        if t.stale():
+            self._by_layout.get((t.layout, t.field), []).remove(t)
+            self._delete(t)
+            return
+        self._dirty[t.key] = t
+        self._pending += 1
+        if self._pending >= FLUSH_EVERY:
+            self.flush()
+
+    def learn(self, layout: str, field: str, page, label_text: str, label_rect: fitz.Rect,
+              value_rect: fitz.Rect, source: str) -> None:
+        new = Template(layout, field, label_text, normalize_rect(page, label_rect),
+                       normalize_rect(page, value_rect), source, hits=1)
+        entries = self._by_layout.setdefault((layout, field), [])
+        for t in entries:
+            if t.label_text == new.label_text and _iou(t.value_rect, new.value_rect) > 0.5:
+                return      # ya conocida; los aciertos se cuentan al usarla
+        if len(entries) >= MAX_TEMPLATES_PER_FIELD:
+            worst = min(entries, key=lambda t: t.hits - t.misses)
+            entries.remove(worst)
+            self._delete(worst)
+        entries.append(new)
+        self._save(new)
+        METRICS.inc("templates.learned")
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
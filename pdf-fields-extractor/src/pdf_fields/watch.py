@@ -0,0 +1,387 @@
+
+# -*- coding: utf-8 -*-
+"""
+Modo `watch`: proceso de larga duración que vigila `input_dir` y procesa cada
+PDF nuevo o modificado apenas termina de escribirse.
+
+- Detección con inotify (Linux, vía ctypes, sin dependencias) o por sondeo de
+  (mtime, tamaño) donde no hay inotify o con `--polling`.
+- El pool de workers (o el hilo único con `--workers 1`) se crea una vez: el
+  provider, su pool HTTP, el memo, las plantillas y el batcher quedan
+  calientes entre archivos.
+- Cada resultado va al journal y se agrega al CSV en el momento; XLSX/Parquet
+  (y el CSV ordenado, sin filas repetidas de archivos modificados) se
+  regeneran desde el journal cada `--rebuild-every` segundos si hubo
+  novedades, y al terminar.
+"""
+from __future__ import annotations
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import (BrokenExecutor, Executor, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from datetime import date
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from .cache import ResultCache
+from .config import Settings
+from .journal import COLUMNS, Journal
+from .metrics import Metrics
+from .pipeline import (ScanResult, _close_worker, _init_worker, _result_row, _scan_in_worker,
+                       _track_slowest, ensure_out_dir, write_outputs, write_run_report)
+from .writers import CsvSink
+
+log = logging.getLogger(__name__)
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+_EVENT = struct.Struct("iIII")   # wd, mask, cookie, len (+ nombre)
+
+# cada cuánto vuelve el lazo principal a revisar resultados terminados
+_TICK_S = 0.1
+
+
+def _is_pdf(name: str) -> bool:
+    # mismo criterio que el glob("*.pdf") de process_folder
+    return name.endswith(".pdf")
+
+
+class PollingWatcher:
+    """Sondeo de la carpeta cada `interval_s`.
+
+    Un archivo se informa cuando su (mtime, tamaño) cambió respecto de lo ya
+    informado y se repite en dos pasadas seguidas, o sea que terminó de
+    copiarse. Los PDFs que ya estaban al arrancar no se informan.
+    """
+
+    kind = "polling"
+
+    def __init__(self, folder: Path, interval_s: float = 1.0):
+        self.folder = Path(folder)
+        self.interval_s = max(0.01, interval_s)
+        self._seen = self._snapshot()
+        self._pending: Dict[str, Tuple[int, int]] = {}
+        self._next = time.monotonic() + self.interval_s
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snap = {}
+        for path in self.folder.glob("*.pdf"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            snap[path.name] = (st.st_mtime_ns, st.st_size)
+        return snap
+
+    def poll(self, timeout: float) -> List[Path]:
+        wait = self._next - time.monotonic()
+        if wait > timeout:
+            time.sleep(max(0.0, timeout))
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        self._next = time.monotonic() + self.interval_s
+        snap = self._snapshot()
+        ready = []
+        for name, sig in snap.items():
+            if self._seen.get(name) == sig:
+                self._pending.pop(name, None)
+            elif self._pending.get(name) == sig:
+                del self._pending[name]
+                self._seen[name] = sig
+                ready.append(name)
+            else:
+                self._pending[name] = sig
+        # los borrados se olvidan: si vuelven, son nuevos
+        for gone in set(self._seen) - set(snap):
+            del self._seen[gone]
+        for gone in set(self._pending) - set(snap):
+            del self._pending[gone]
+        return [self.folder / name for name in sorted(ready)]
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """inotify vía ctypes: IN_CLOSE_WRITE (se cerró tras escribir) e
+    IN_MOVED_TO (rename atómico hacia la carpeta). Si la cola del kernel se
+    desborda se informan todos los PDFs (el cache por contenido absorbe los
+    que no cambiaron)."""
+
+    kind = "inotify"
+
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        wd = libc.inotify_add_watch(fd, os.fsencode(self.folder), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, f"inotify_add_watch({self.folder})")
+        self._fd = fd
+
+    def poll(self, timeout: float) -> List[Path]:
+        ready, _, _ = select.select([self._fd], [], [], max(0.0, timeout))
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names: List[str] = []
+        off = 0
+        while off + _EVENT.size <= len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, off)
+            off += _EVENT.size
+            name = os.fsdecode(data[off:off + length].rstrip(b"\0"))
+            off += length
+            if mask & IN_Q_OVERFLOW:
+                log.warning("inotify: cola desbordada, se revisa toda la carpeta")
+                return sorted(self.folder.glob("*.pdf"))
+            if _is_pdf(name):
+                names.append(name)
+        return [self.folder / name for name in dict.fromkeys(names)]
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def open_watcher(folder: Path, interval_s: float, polling: bool = False):
+    """inotify si está disponible (y no se pidió sondeo); si no, sondeo."""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError) as e:
+            log.warning("inotify no disponible (%s); se usa sondeo cada %.1fs", e, interval_s)
+    return PollingWatcher(folder, interval_s)
+
+
+# Un PDF en proceso: (future, clave de cache, momento en que se detectó)
+_InFlight = Tuple[Future, Optional[str], float]
+
+
+class WatchService:
+    """Lazo principal del modo watch. `stop()` (desde otro hilo o un handler
+    de señal) termina lo que está en curso, regenera las salidas y sale."""
+
+    def __init__(self, cfg: Settings, watcher=None):
+        self.cfg = cfg
+        self.watcher = watcher
+        self._stop = threading.Event()
+        self._inflight: Dict[Path, _InFlight] = {}
+        self._again: Set[Path] = set()
+        self._executor: Optional[Executor] = None
+        self._csv: Optional[CsvSink] = None
+        self._journal: Optional[Journal] = None
+        self._cache: Optional[ResultCache] = None
+        self._run = Metrics()
+        self._slowest: list = []
+        self._dirty = False
+        self._last_rebuild = 0.0
+        self._started = 0.0
+        self.processed = 0
+        self._scanned = self._by_text = 0
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # -- pool ---------------------------------------------------------------
+
+    def _start_executor(self) -> None:
+        cfg = self.cfg
+        # hoy=None: la fecha de referencia se toma en cada PDF (el proceso
+        # puede cruzar la medianoche)
+        if cfg.workers > 1:
+            ex: Executor = ProcessPoolExecutor(max_workers=cfg.workers, initializer=_init_worker,
+                                               initargs=(cfg, None))
+        else:
+            # un solo hilo: provider, memo y plantillas (SQLite) viven en él
+            ex = ThreadPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(cfg, None))
+        # se calientan ya: los errores de configuración salen al arrancar
+        for fut in [ex.submit(int) for _ in range(max(1, cfg.workers))]:
+            fut.result()
+        self._executor = ex
+
+    def _stop_executor(self) -> None:
+        ex, self._executor = self._executor, None
+        if ex is None:
+            return
+        if isinstance(ex, ThreadPoolExecutor):
+            try:
+                ex.submit(_close_worker).result()
+            except Exception:
+                log.exception("No se pudo cerrar el worker")
+        ex.shutdown(wait=True)
+
+    # -- archivos -----------------------------------------------------------
+
+    def schedule(self, path: Path) -> None:
+        if path in self._inflight:
+            # cambió mientras se procesaba: se repite al terminar
+            self._again.add(path)
+            return
+        arrived = time.monotonic()
+        key = None
+        if self._cache is not None:
+            try:
+                key = self._cache.key(path)
+            except FileNotFoundError:
+                return
+            payload = self._cache.get(key)
+            if payload is not None:
+                self._record(path, ScanResult.from_dict(payload), None, arrived)
+                return
+        elif not path.exists():
+            return
+        try:
+            fut = self._executor.submit(_scan_in_worker, path)
+        except BrokenExecutor:
+            self._restart_executor()
+            fut = self._executor.submit(_scan_in_worker, path)
+        self._inflight[path] = (fut, key, arrived)
+
+    def _restart_executor(self) -> None:
+        log.error("El pool de workers se cayó; se vuelve a crear")
+        ex, self._executor = self._executor, None
+        if ex is not None:
+            ex.shutdown(wait=False, cancel_futures=True)
+        self._start_executor()
+
+    def _collect(self, block: bool = False) -> None:
+        for path, (fut, key, arrived) in list(self._inflight.items()):
+            if not block and not fut.done():
+                continue
+            del self._inflight[path]
+            try:
+                _, scan, snap = fut.result()
+            except BrokenExecutor:
+                # se reintenta si el archivo vuelve a cambiar
+                log.error("Worker caído procesando %s", path.name)
+                self._run.inc("watch.errors")
+                if not self._stop.is_set():
+                    self._restart_executor()
+                continue
+            except Exception:
+                log.exception("Error procesando %s", path.name)
+                self._run.inc("watch.errors")
+                continue
+            # con llamadas fallidas no se cachea: el próximo drop lo reintenta
+            if self._cache is not None and scan is not None and key is not None and not scan.failed:
+                self._cache.put(key, scan.to_dict())
+            self._record(path, scan, snap, arrived)
+            if path in self._again:
+                self._again.discard(path)
+                if not self._stop.is_set():
+                    self.schedule(path)
+
+    def _record(self, path: Path, scan: Optional[ScanResult], snap: Optional[dict],
+                arrived: float) -> None:
+        row = _result_row(path, scan, date.today())
+        self._journal.append(row, ok=scan is not None and not scan.failed)
+        if self._csv is not None:
+            self._csv.write(row)
+            self._csv.flush()
+        if snap is not None:
+            self._run.merge(snap)
+            self._run.observe("pdf.total", snap["seconds"])
+            if self.cfg.profile:
+                _track_slowest(self._slowest, path, snap, self.cfg.profile_top)
+        if scan is not None:
+            self._scanned += 1
+            self._by_text += scan.resolved_by_text
+        latency = time.monotonic() - arrived
+        self._run.observe("watch.latency", latency)
+        self.processed += 1
+        self._dirty = True
+        log.info("%s -> fecha=%s cuit=%s (%.1fs)", path.name, row["fecha_ddmmyyyy"] or "-",
+                 row["cuit"] or "-", latency)
+
+    # -- salidas ------------------------------------------------------------
+
+    def _rebuild(self) -> None:
+        """Regenera CSV/XLSX/Parquet y el reporte desde el journal."""
+        if self._csv is not None:
+            self._csv.close()
+            self._csv = None
+        with self._run.timer("stage.write_outputs"):
+            write_outputs(self.cfg, self._journal)
+        if self.cfg.write_csv:
+            self._csv = CsvSink(self.cfg.csv_path(), COLUMNS, append=True)
+        self._write_report()
+        self._dirty = False
+        self._last_rebuild = time.monotonic()
+
+    def _write_report(self) -> None:
+        summary = {
+            "mode": "watch",
+            "watcher": getattr(self.watcher, "kind", None),
+            "rows": self._journal.count(),
+            "processed": self.processed,
+            "scanned": self._scanned,
+            "text_only_share": round(self._by_text / self._scanned, 4) if self._scanned else None,
+            "uptime_seconds": round(time.monotonic() - self._started, 3),
+        }
+        if self._cache is not None:
+            summary["cache_hits"] = self._cache.hits
+            summary["cache_misses"] = self._cache.misses
+        write_run_report(self.cfg, self._run, summary, self._slowest)
+
+    # -- lazo ---------------------------------------------------------------
+
+    def run(self) -> int:
+        """Vigila hasta `stop()`. Devuelve la cantidad de filas del journal."""
+        cfg = self.cfg
+        self._started = time.monotonic()
+        ensure_out_dir(cfg.out_dir)
+        self._journal = Journal(cfg.journal_path())
+        self._cache = ResultCache.from_settings(cfg) if cfg.cache_enabled else None
+        # el watcher se abre antes de listar la carpeta: lo que llegue en el
+        # medio se informa igual (y el cache evita procesarlo dos veces)
+        if self.watcher is None:
+            self.watcher = open_watcher(Path(cfg.input_dir), cfg.watch_poll_s, cfg.watch_polling)
+        try:
+            self._start_executor()
+            # pendientes al arrancar: con cache se revisa todo (los archivos sin
+            # cambios son un hit); sin cache, sólo lo que no está en el journal
+            for path in sorted(Path(cfg.input_dir).glob("*.pdf")):
+                if self._cache is None and self._journal.has(path.name):
+                    continue
+                self.schedule(path)
+            self._rebuild()
+            log.info("Vigilando %s (%s, %s workers)", cfg.input_dir, self.watcher.kind,
+                     max(1, cfg.workers))
+            while not self._stop.is_set():
+                for path in self.watcher.poll(_TICK_S):
+                    self.schedule(path)
+                self._collect()
+                if self._dirty and time.monotonic() - self._last_rebuild >= cfg.watch_rebuild_s:
+                    self._rebuild()
+        finally:
+            self.watcher.close()
+            self._collect(block=True)
+            self._stop_executor()
+            self._rebuild()
+            if self._csv is not None:
+                self._csv.close()
+                self._csv = None
+            total = self._journal.count()
+            self._journal.close()
+            if self._cache is not None:
+                self._cache.evict(cfg.cache_max_entries, cfg.cache_max_age_days)
+                self._cache.close()
+        return total
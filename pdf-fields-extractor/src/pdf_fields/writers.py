@@ -0,0 +1,145 @@
+
+# -*- coding: utf-8 -*-
+"""
+Salidas en streaming: cada fila se escribe apenas se lee del journal, sin
+armar un DataFrame ni recorrer la hoja al final. openpyxl y pyarrow se
+importan sólo si se pide esa salida.
+"""
+from __future__ import annotations
+import csv
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+# ancho máximo de columna en el XLSX (caracteres)
+MAX_COL_WIDTH = 60
+# filas por row group en Parquet (lo único que se acumula en memoria)
+PARQUET_BATCH_ROWS = 4096
+
+
+class ColumnWidths:
+    """Largo máximo por columna, actualizado a medida que llegan las filas.
+
+    En modo `write_only` openpyxl escribe los anchos antes que la primera
+    fila, así que se calculan mientras se procesa el lote y no con una
+    pasada extra sobre las celdas.
+    """
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = list(columns)
+        self._max: Dict[str, int] = {c: len(c) for c in self.columns}
+
+    def observe(self, row: dict) -> None:
+        for c in self.columns:
+            n = len(str(row.get(c) or ""))
+            if n > self._max[c]:
+                self._max[c] = n
+
+    def seed(self, lengths: Dict[str, int]) -> None:
+        for c, n in lengths.items():
+            if c in self._max and n > self._max[c]:
+                self._max[c] = n
+
+    def widths(self) -> Dict[str, int]:
+        return {c: min(n + 2, MAX_COL_WIDTH) for c, n in self._max.items()}
+
+
+class CsvSink:
+    """CSV con ";". Con `append` se agregan filas a un archivo existente
+    (el encabezado sólo se escribe si está vacío)."""
+
+    def __init__(self, path: Path, columns: Sequence[str], append: bool = False):
+        self.columns = list(columns)
+        header = not append or not path.exists() or path.stat().st_size == 0
+        self._fh = path.open("a" if append else "w", encoding="utf-8", newline="")
+        self._wr = csv.writer(self._fh, delimiter=";")
+        if header:
+            self._wr.writerow(self.columns)
+
+    def write(self, row: dict) -> None:
+        self._wr.writerow([row[c] for c in self.columns])
+
+    def flush(self) -> None:
+        self._fh.flush()
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+class XlsxSink:
+    """Workbook `write_only`: las filas van directo al XML comprimido."""
+
+    def __init__(self, path: Path, columns: Sequence[str], widths: Dict[str, int],
+                 sheet: str = "Resumen Lote"):
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Alignment, Font
+        from openpyxl.utils import get_column_letter
+
+        self.path = path
+        self.columns = list(columns)
+        self._wb = Workbook(write_only=True)
+        self._ws = self._wb.create_sheet(sheet)
+        for i, c in enumerate(self.columns, start=1):
+            self._ws.column_dimensions[get_column_letter(i)].width = widths.get(c, len(c) + 2)
+        header = []
+        for c in self.columns:
+            cell = WriteOnlyCell(self._ws, value=c)
+            cell.font = Font(bold=True)
+            cell.alignment = Alignment(horizontal="center")
+            header.append(cell)
+        self._ws.append(header)
+
+    def write(self, row: dict) -> None:
+        self._ws.append([row[c] for c in self.columns])
+
+    def close(self) -> None:
+        self._wb.save(self.path)
+
+
+class ParquetSink:
+    """Parquet (pyarrow, opcional) en row groups de `batch_rows` filas."""
+
+    def __init__(self, path: Path, columns: Sequence[str], batch_rows: int = PARQUET_BATCH_ROWS):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("La salida Parquet requiere pyarrow (pip install pyarrow)") from e
+        self._pa = pa
+        self.columns = list(columns)
+        self.batch_rows = max(1, batch_rows)
+        self._schema = pa.schema([(c, pa.string()) for c in self.columns])
+        self._writer = pq.ParquetWriter(path.as_posix(), self._schema)
+        self._buf: Dict[str, List[str]] = {c: [] for c in self.columns}
+        self._n = 0
+
+    def write(self, row: dict) -> None:
+        for c in self.columns:
+            self._buf[c].append(row[c])
+        self._n += 1
+        if self._n >= self.batch_rows:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._n:
+            self._writer.write_table(self._pa.table(self._buf, schema=self._schema))
+            self._buf = {c: [] for c in self.columns}
+            self._n = 0
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+
+def write_rows(rows, sinks: List) -> int:
+    """Una sola pasada sobre `rows` alimentando todas las salidas."""
+    n = 0
+    try:
+        for row in rows:
+            for sink in sinks:
+                sink.write(row)
+            n += 1
+    finally:
+        for sink in sinks:
+            sink.close()
+    return n
@@ -0,0 +1,62 @@
+import threading
+
+import numpy as np
+
+from benchmarks.mock_llm import MockLLMServer
+from benchmarks.synth import make_corpus
+from pdf_fields.batching import ClipBatcher
+from pdf_fields.config import Settings
+from pdf_fields.llm_provider import BaseLLMProvider, OpenAIProvider, Throttle
+from pdf_fields.pipeline import build_batcher, scan_pdf
+
+
+class CountingProvider(BaseLLMProvider):
+    def __init__(self):
+        self.batches = []
+
+    def extract_batch(self, jobs):
+        self.batches.append([field for _, field in jobs])
+        return [f"{field}-ok" for _, field in jobs]
+
+
+def _img():
+    return np.zeros((8, 8, 3), dtype=np.uint8)
+
+
+def test_batcher_joins_callers_within_window():
+    llm = CountingProvider()
+    batcher = ClipBatcher(llm, max_size=8, window_s=0.2)
+    out = {}
+
+    def worker(name, field):
+        out[name] = batcher.extract([(_img(), field), (_img(), field)])
+
+    threads = [threading.Thread(target=worker, args=(n, f)) for n, f in (("a", "fecha"), ("b", "cuit"))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert out == {"a": ["fecha-ok", "fecha-ok"], "b": ["cuit-ok", "cuit-ok"]}
+    assert len(llm.batches) == 1 and len(llm.batches[0]) == 4
+
+
+def test_batched_scan_matches_single_crop_requests(tmp_path, monkeypatch):
+    make_corpus(tmp_path, 2, seed=2, kinds=("stamped",), min_pages=3, max_pages=3)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path, min_call_interval_s=0.0, llm_batch_size=4)
+    throttle = Throttle(0.0, 2, 0.01, 0.05)
+    pdfs = sorted(tmp_path.glob("*.pdf"))
+    with MockLLMServer(responses={"cuit": "30-71234567-1"}) as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        single = [scan_pdf(p, cfg, OpenAIProvider("mock", throttle)) for p in pdfs]
+        plain_requests = server.requests
+
+        llm = OpenAIProvider("mock", throttle, batch_size=cfg.llm_batch_size)
+        batcher = build_batcher(cfg, llm)
+        batched = [scan_pdf(p, cfg, llm, batcher=batcher) for p in pdfs]
+        batched_requests = server.requests - plain_requests
+
+    assert [r.to_dict() for r in batched] == [r.to_dict() for r in single]
+    assert batched[0].cuits == ["30-71234567-1"]
+    # 3 páginas x (fecha) + 1 CUIT por PDF: 4 recortes en una sola request
+    assert plain_requests == 8 and batched_requests == 2
@@ -0,0 +1,31 @@
+
+import csv
+import json
+
+from benchmarks.mock_llm import MockLLMServer
+from benchmarks.run import run_benchmark
+from benchmarks.synth import make_corpus
+from pdf_fields.config import Settings
+
+
+def test_pipeline_against_mock_llm(tmp_path, monkeypatch):
+    manifest = make_corpus(tmp_path / "corpus", 3, seed=1, kinds=("text", "scanned"), max_pages=2)
+    assert json.loads((tmp_path / "corpus" / "manifest.json").read_text())[0]["cuit"] == manifest[0]["cuit"]
+
+    monkeypatch.delenv("OPENAI_BASE_URL", raising=False)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    cfg = Settings(input_dir=tmp_path / "corpus", out_dir=tmp_path / "out")
+    cfg.llm_provider = "openai"
+    cfg.workers = 1
+    cfg.min_call_interval_s = 0.0
+    cfg.cache_enabled = cfg.memo_enabled = False
+    with MockLLMServer(responses={"cuit": "30-71234567-1"}, seed=1) as server:
+        result = run_benchmark(cfg, server)
+
+    assert result["rows"] == 3
+    assert result["mock_requests"] > 0
+    assert result["llm_calls_per_doc"] > 0
+    with cfg.csv_path().open(encoding="utf-8") as fh:
+        rows = list(csv.DictReader(fh, delimiter=";"))
+    # el documento escaneado sólo se resuelve vía el mock
+    assert rows[1]["cuit"] == "30-71234567-1"
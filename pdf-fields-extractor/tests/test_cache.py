@@ -0,0 +1,60 @@
+
+import csv
+import time
+
+from benchmarks.mock_llm import MockLLMServer
+from benchmarks.synth import make_corpus
+from pdf_fields.cache import ResultCache, settings_fingerprint
+from pdf_fields.config import Settings
+from pdf_fields.pipeline import process_folder
+
+
+def _rows(cfg):
+    with cfg.csv_path().open(encoding="utf-8") as fh:
+        return list(csv.DictReader(fh, delimiter=";"))
+
+
+def test_result_cache_roundtrip_and_eviction(tmp_path):
+    pdf = tmp_path / "a.pdf"
+    pdf.write_bytes(b"%PDF-1.4 demo")
+    cache = ResultCache(tmp_path / "cache.sqlite", fingerprint="fp")
+    key = cache.key(pdf)
+    assert cache.get(key) is None
+    cache.put(key, {"fechas": ["01/02/2023"], "cuits": []})
+    assert cache.get(key) == {"fechas": ["01/02/2023"], "cuits": []}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # otro fingerprint (ajustes distintos) => otra clave
+    assert ResultCache(tmp_path / "cache.sqlite", fingerprint="otro").key(pdf) != key
+    base = Settings(input_dir=tmp_path, out_dir=tmp_path)
+    for change in ({"templates_enabled": False}, {"llm_batch_size": 4}, {"page_dedup_enabled": False}):
+        other = Settings(input_dir=tmp_path, out_dir=tmp_path, **change)
+        assert settings_fingerprint(other) != settings_fingerprint(base)
+
+    cache.put("viejo", {})
+    cache._conn.execute("UPDATE results SET last_used = ? WHERE key = 'viejo'", (time.time() - 10 * 86400,))
+    assert cache.evict(max_age_days=1) == 1
+    assert cache.evict(max_entries=1) == 0
+    cache.close()
+
+
+def test_scans_with_failed_llm_calls_are_not_cached(tmp_path, monkeypatch):
+    make_corpus(tmp_path / "corpus", 2, seed=1, kinds=("scanned",), max_pages=1)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    cfg = Settings(input_dir=tmp_path / "corpus", out_dir=tmp_path / "out", write_xlsx=False)
+    cfg.llm_provider = "openai"
+    cfg.adaptive_rate = cfg.memo_enabled = cfg.templates_enabled = cfg.page_dedup_enabled = False
+    cfg.min_call_interval_s = 0.0
+    cfg.max_retries = 1
+
+    # todo 429: filas vacías, pero no quedan en el cache
+    with MockLLMServer(rate_429=1.0) as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        process_folder(cfg)
+    assert not any(row["cuit"] for row in _rows(cfg))
+
+    with MockLLMServer(responses={"cuit": "30-71234567-1"}) as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        process_folder(cfg)
+        assert server.requests > 0
+    assert all(row["cuit"] == "30-71234567-1" for row in _rows(cfg))
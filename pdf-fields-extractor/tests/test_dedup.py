@@ -0,0 +1,106 @@
+import random
+
+import fitz
+import numpy as np
+
+from benchmarks.synth import _scanned_page, _stamped_page, _text_page, make_copy
+from pdf_fields.config import Settings
+from pdf_fields.dedup import PageIndex, _hamming
+from pdf_fields.llm_provider import BaseLLMProvider
+from pdf_fields.metrics import METRICS
+from pdf_fields.pipeline import scan_pdf
+
+
+class CountingProvider(BaseLLMProvider):
+    """Cada llamada devuelve otra fecha: se ve de qué llamada salió un valor."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def _fecha(self):
+        self.calls += 1
+        return f"{self.calls:02d}/01/2020"
+
+    def extract_field(self, img, field):
+        if field == "fecha":
+            return self._fecha()
+        self.calls += 1
+        return "20-12345678-6"
+
+    def extract_all(self, img):
+        return [self._fecha()], ["20-12345678-6"]
+
+
+def _doc(path, make_page, fecha, cuit):
+    doc = fitz.open()
+    # mismo emisor y mismo relleno: sólo cambian los valores
+    make_page(doc, random.Random(1), fecha, cuit, random.Random(2))
+    doc.save(path.as_posix())
+    doc.close()
+
+
+def _scan(path, cfg, llm, pages):
+    METRICS.reset()
+    return scan_pdf(path, cfg, llm, pages=pages)
+
+
+def test_copies_reuse_results_and_siblings_do_not(tmp_path):
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path)
+    llm = CountingProvider()
+    pages = PageIndex(tmp_path / "pages.sqlite", "fp")
+    try:
+        # escaneadas: pHash + mapa de tinta
+        _doc(tmp_path / "a.pdf", _scanned_page, "03/04/2021", "20-12345678-6")
+        make_copy(tmp_path / "a.pdf", tmp_path / "a_rescan.pdf", random.Random(3), rescan=True)
+        _doc(tmp_path / "b.pdf", _scanned_page, "03/04/2022", "20-12345678-6")
+
+        first = _scan(tmp_path / "a.pdf", cfg, llm, pages)
+        assert METRICS.counters["dedup.pages_learned"] == 1
+        copy = _scan(tmp_path / "a_rescan.pdf", cfg, llm, pages)
+        assert copy.fechas == first.fechas and llm.calls == 1
+        assert METRICS.counters["dedup.matches.near"] == 1
+        assert METRICS.counters["dedup.llm_calls_avoided"] == 1
+        # valores del LLM aunque no se lo llamó: no cuenta como capa de texto
+        assert not copy.resolved_by_text
+        sibling = _scan(tmp_path / "b.pdf", cfg, llm, pages)
+        assert sibling.fechas != first.fechas and llm.calls == 2
+        assert METRICS.counters["dedup.ink_rejected"] >= 1
+
+        # digitales con valores sellados: texto + imágenes embebidas
+        _doc(tmp_path / "c.pdf", _stamped_page, "05/06/2021", "27-23456789-1")
+        make_copy(tmp_path / "c.pdf", tmp_path / "c_resend.pdf", random.Random(3), rescan=False)
+        _doc(tmp_path / "d.pdf", _stamped_page, "05/06/2022", "27-23456789-1")
+        stamped = _scan(tmp_path / "c.pdf", cfg, llm, pages)
+        calls = llm.calls
+        resent = _scan(tmp_path / "c_resend.pdf", cfg, llm, pages)
+        assert resent.fechas == stamped.fechas and llm.calls == calls
+        assert METRICS.counters["dedup.matches.exact"] == 1
+        # recortes de fecha y CUIT
+        assert METRICS.counters["dedup.llm_calls_avoided"] == 2
+        other = _scan(tmp_path / "d.pdf", cfg, llm, pages)
+        assert other.fechas != stamped.fechas and llm.calls > calls
+    finally:
+        pages.close()
+
+
+def test_text_layer_pages_skip_the_fingerprint(tmp_path):
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path)
+    llm = CountingProvider()
+    pages = PageIndex(tmp_path / "pages.sqlite", "fp")
+    try:
+        _doc(tmp_path / "t.pdf", _text_page, "07/08/2021", "20-12345678-6")
+        scan = _scan(tmp_path / "t.pdf", cfg, llm, pages)
+        # la capa de texto resolvió todo: ni huella ni búsqueda en el índice
+        assert scan.resolved_by_text and llm.calls == 0
+        assert not any(k.startswith("dedup.") for k in METRICS.counters)
+        assert "stage.page_fingerprint" not in METRICS.timers
+    finally:
+        pages.close()
+
+
+def test_hamming_without_bitwise_count(monkeypatch):
+    hashes = np.array([0, 0xFF, 2 ** 64 - 1, 0x8000000000000001], dtype=np.uint64)
+    assert _hamming(hashes, 3).tolist() == [2, 6, 62, 2]
+    # numpy 1.26 no tiene np.bitwise_count
+    monkeypatch.delattr(np, "bitwise_count", raising=False)
+    assert _hamming(hashes, 3).tolist() == [2, 6, 62, 2]
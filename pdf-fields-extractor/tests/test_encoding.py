@@ -0,0 +1,26 @@
+
+import fitz
+
+from pdf_fields.encoding import ImageEncoder
+
+
+def _pixmap():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "CUIT 20-12345678-6")
+    return page.get_pixmap(matrix=fitz.Matrix(3, 3), alpha=False)
+
+
+def test_encoder_formats_and_budgets():
+    pix = _pixmap()
+    url, png_bytes = ImageEncoder().encode(pix)
+    assert url.startswith("data:image/png;base64,")
+
+    url, jpg_bytes = ImageEncoder(fmt="jpeg", grayscale=True, quality=50).encode(pix)
+    assert url.startswith("data:image/jpeg;base64,")
+    assert jpg_bytes < png_bytes
+
+    _, small = ImageEncoder(max_pixels=pix.width * pix.height // 16).encode(pix)
+    assert small < png_bytes
+    _, capped = ImageEncoder(fmt="webp", max_bytes=2000).encode(pix)
+    assert capped <= 2000
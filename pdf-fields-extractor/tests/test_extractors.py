@@ -0,0 +1,51 @@
+
+import fitz
+
+from pdf_fields.extractors import AnchorIndex
+
+
+def test_anchor_index_single_pass():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Fecha de visita: 12/03/2023   Nº CUIT 20-12345678-6")
+    page.insert_text((72, 100), "FECHA: hoy y CUIT:20123456786")
+    idx = AnchorIndex.from_page(page)
+
+    fechas = idx.rects("fecha")
+    cuits = idx.rects("cuit")
+    assert len(fechas) == 2 and len(cuits) == 2
+    assert fechas[0].y0 < fechas[1].y0
+    # "CUIT:2012..." es una sola palabra: el rect se recorta al término
+    assert cuits[1].x1 < page.search_for("CUIT:20123456786")[0].x1
+
+
+def test_page_raster_crops_match_direct_render():
+    from pdf_fields.extractors import PageRaster, clip_right_rect
+
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Fecha: 12/03/2023")
+    page.insert_text((72, 100), "CUIT 20-12345678-6")
+    clips = [clip_right_rect(page, r) for r in (page.search_for("Fecha")[0], page.search_for("CUIT")[0])]
+
+    raster = PageRaster(page)
+    raster.plan(5.0, clips)
+    for clip in clips:
+        ref = page.get_pixmap(matrix=fitz.Matrix(5.0, 5.0), clip=clip, alpha=False)
+        # pixmap: el encoder lo pasa a PNG/JPEG sin PIL
+        crop = raster.crop(clip, 5.0)
+        assert isinstance(crop, fitz.Pixmap)
+        assert (crop.irect, crop.samples) == (ref.irect, ref.samples)
+    assert len(raster._regions[5.0]) == 1   # una sola rasterización para ambos
+    raster.close()
+
+
+def test_text_candidates_skip_invalid_and_rank_by_anchor():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Tel: 11-45678901-2   Vence 01/01/1950")
+    page.insert_text((72, 100), "Emitido 05/06/2021")
+    page.insert_text((72, 130), "Fecha de visita: 12/03/2023   CUIT 20-12345678-6")
+    idx = AnchorIndex.from_page(page)
+    assert idx.text_candidates("fecha", 1990, 2100) == ["12/03/2023", "05/06/2021"]
+    assert idx.best_text_value("cuit", 1990, 2100) == "20-12345678-6"
@@ -0,0 +1,54 @@
+import csv
+import json
+import sqlite3
+
+from benchmarks.mock_llm import MockLLMServer
+from benchmarks.synth import make_corpus
+from pdf_fields.config import Settings
+from pdf_fields.journal import Journal
+from pdf_fields.pipeline import process_folder
+
+
+def test_failed_rows_are_not_done(tmp_path):
+    # journal de una versión anterior, sin la columna `ok`
+    conn = sqlite3.connect(tmp_path / "j.sqlite")
+    conn.execute("CREATE TABLE rows (archivo TEXT PRIMARY KEY, fecha_ddmmyyyy TEXT NOT NULL,"
+                 " cuit TEXT NOT NULL, ts REAL NOT NULL)")
+    conn.execute("INSERT INTO rows VALUES ('viejo.pdf', '', '', 0)")
+    conn.commit()
+    conn.close()
+
+    journal = Journal(tmp_path / "j.sqlite")
+    assert journal.has("viejo.pdf")
+    journal.append({"archivo": "roto.pdf", "fecha_ddmmyyyy": "", "cuit": ""}, ok=False)
+    assert not journal.has("roto.pdf")
+    assert journal.count() == 2
+    journal.close()
+
+
+def test_resume_retries_failed_files(tmp_path, monkeypatch):
+    make_corpus(tmp_path / "corpus", 2, seed=1, kinds=("scanned",), max_pages=1)
+    (tmp_path / "corpus" / "zz_roto.pdf").write_bytes(b"no es un PDF")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    cfg = Settings(input_dir=tmp_path / "corpus", out_dir=tmp_path / "out", write_xlsx=False)
+    cfg.llm_provider = "openai"
+    cfg.adaptive_rate = cfg.cache_enabled = cfg.memo_enabled = False
+    cfg.templates_enabled = cfg.page_dedup_enabled = False
+    cfg.min_call_interval_s = 0.0
+    cfg.max_retries = 1
+
+    with MockLLMServer(rate_429=1.0) as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        assert process_folder(cfg) == 3
+
+    cfg.resume = True
+    with MockLLMServer(responses={"cuit": "30-71234567-1"}) as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        assert process_folder(cfg) == 3
+        assert server.requests > 0
+    with cfg.csv_path().open(encoding="utf-8") as fh:
+        rows = list(csv.DictReader(fh, delimiter=";"))
+    assert [r["cuit"] for r in rows] == ["30-71234567-1", "30-71234567-1", ""]
+    # nada se salteó: el PDF roto también se reintentó
+    report = json.loads(cfg.report_path().read_text(encoding="utf-8"))
+    assert (report["resumed_skipped"], report["failed"]) == (0, 1)
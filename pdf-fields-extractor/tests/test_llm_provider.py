@@ -0,0 +1,46 @@
+import csv
+
+from benchmarks.mock_llm import MockLLMServer
+from benchmarks.synth import make_corpus
+from pdf_fields.config import Settings
+from pdf_fields.llm_provider import TokenBucket
+from pdf_fields.pipeline import process_folder
+
+
+def test_token_bucket_waits_when_empty():
+    b = TokenBucket(rate_per_min=60)   # 1 unidad por segundo
+    assert b.wait_time(10) == 0.0
+    b.take(60)
+    assert 0.9 < b.wait_time(1) <= 1.0
+    b.adjust(-30)                      # se devolvió lo sobreestimado
+    assert b.wait_time(10) == 0.0
+
+
+def _run(tmp_path, out, llm_async):
+    cfg = Settings(input_dir=tmp_path / "corpus", out_dir=tmp_path / out, write_xlsx=False)
+    cfg.llm_provider = "openai"
+    cfg.llm_async = llm_async
+    cfg.max_in_flight = 4
+    # sin ledger: el async pasa por AsyncRateLimiter
+    cfg.adaptive_rate = False
+    cfg.requests_per_min = 6000
+    cfg.min_call_interval_s = 0.0
+    cfg.cache_enabled = cfg.memo_enabled = cfg.templates_enabled = cfg.page_dedup_enabled = False
+    process_folder(cfg)
+    with cfg.csv_path().open(encoding="utf-8") as fh:
+        return list(csv.reader(fh, delimiter=";"))
+
+
+def test_async_provider_matches_sync_and_overlaps_requests(tmp_path, monkeypatch):
+    # valores sellados: anclas en el texto y recortes de fecha y CUIT al LLM
+    make_corpus(tmp_path / "corpus", 3, seed=5, kinds=("stamped",), max_pages=2)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    with MockLLMServer(latency_ms=50, responses={"cuit": "30-71234567-1"}) as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        sync_rows = _run(tmp_path, "sync", False)
+        assert server.peak_in_flight == 1
+        async_rows = _run(tmp_path, "async", True)
+    assert async_rows == sync_rows
+    assert all(r[1] and r[2] for r in sync_rows[1:])
+    # llm_extract_clips manda los recortes de los dos campos juntos
+    assert server.peak_in_flight > 1
@@ -0,0 +1,30 @@
+
+from PIL import Image
+
+from pdf_fields.llm_provider import BaseLLMProvider
+from pdf_fields.memo import MemoizedProvider, ResponseMemo
+
+
+class FakeProvider(BaseLLMProvider):
+    def __init__(self):
+        self.calls = 0
+
+    def extract_field(self, img, field):
+        self.calls += 1
+        return "01/02/2023" if field == "fecha" else None
+
+
+def test_identical_crops_hit_memo_across_runs(tmp_path):
+    img = Image.new("RGB", (20, 10), "white")
+    inner = FakeProvider()
+    llm = MemoizedProvider(inner, ResponseMemo(tmp_path / "memo.sqlite"), model="m")
+    assert llm.extract_field(img, "fecha") == "01/02/2023"
+    assert llm.extract_field(img.copy(), "fecha") == "01/02/2023"
+    assert llm.extract_field(img, "cuit") is None
+    assert inner.calls == 2
+
+    # otra corrida: LRU vacío, responde el disco
+    otra = MemoizedProvider(inner, ResponseMemo(tmp_path / "memo.sqlite"), model="m")
+    assert otra.extract_fields([(img, "fecha"), (img, "cuit")]) == ["01/02/2023", None]
+    assert inner.calls == 2
+    assert otra.memo.hits_disk == 2
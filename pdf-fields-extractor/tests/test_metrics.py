@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks.synth import make_corpus
+from pdf_fields.config import Settings
+from pdf_fields.metrics import Metrics, prometheus_text
+from pdf_fields.pipeline import process_folder
+
+
+class _SlowCounters(defaultdict):
+    # cede el GIL entre leer y escribir: la carrera del `+=` se da siempre
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        time.sleep(0)
+        return value
+
+
+def test_concurrent_updates_are_not_lost():
+    m = Metrics()
+    m.counters = _SlowCounters(float)
+
+    def work():
+        for _ in range(500):
+            m.inc("a")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert m.counters["a"] == 2000
+
+
+def test_prometheus_text():
+    m = Metrics()
+    m.inc("cache.hits", 3)
+    m.observe("stage.text_tier", 0.5)
+    m.observe("stage.text_tier", 0.25)
+    assert prometheus_text(m).splitlines() == [
+        "# TYPE pdf_fields_cache_hits_total counter",
+        "pdf_fields_cache_hits_total 3",
+        "# TYPE pdf_fields_stage_text_tier_seconds summary",
+        "pdf_fields_stage_text_tier_seconds_sum 0.750000",
+        "pdf_fields_stage_text_tier_seconds_count 2",
+    ]
+
+
+def test_run_report_profile_and_prom_file(tmp_path):
+    make_corpus(tmp_path / "corpus", 4, seed=2, kinds=("text",), max_pages=2)
+    prom = tmp_path / "textfile" / "pdf_fields.prom"
+    cfg = Settings(input_dir=tmp_path / "corpus", out_dir=tmp_path / "out", text_only=True,
+                   write_xlsx=False, cache_enabled=False, profile=True, profile_top=2,
+                   prom_file=prom)
+    assert process_folder(cfg) == 4
+
+    report = json.loads(cfg.report_path().read_text(encoding="utf-8"))
+    assert (report["files"], report["rows"], report["scanned"], report["failed"]) == (4, 4, 4, 0)
+    assert report["counters"]["docs.scanned"] == 4
+    assert report["timers"]["pdf.total"]["count"] == 4
+    assert report["text_only_share"] == 1.0
+    # --profile: los 2 más lentos, del más lento al más rápido, con sus etapas
+    slowest = report["slowest"]
+    assert len(slowest) == 2
+    assert slowest[0]["seconds"] >= slowest[1]["seconds"]
+    assert "stage.text_tier" in slowest[0]["stages"]
+    assert abs(slowest[0]["seconds"] - report["timers"]["pdf.total"]["max_s"]) < 1e-3
+
+    text = prom.read_text(encoding="utf-8")
+    assert "pdf_fields_docs_scanned_total 4" in text
+    assert "pdf_fields_pdf_total_seconds_count 4" in text
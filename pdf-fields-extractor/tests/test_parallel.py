@@ -0,0 +1,38 @@
+import csv
+
+from benchmarks.mock_llm import MockLLMServer
+from benchmarks.synth import make_corpus
+from pdf_fields.config import Settings
+from pdf_fields.pipeline import process_folder
+
+
+def _rows(cfg):
+    with cfg.csv_path().open(encoding="utf-8") as fh:
+        return list(csv.reader(fh, delimiter=";"))
+
+
+def _settings(tmp_path, out, workers):
+    cfg = Settings(input_dir=tmp_path / "corpus", out_dir=tmp_path / out, write_xlsx=False)
+    cfg.llm_provider = "openai"
+    cfg.workers = workers
+    cfg.min_call_interval_s = 0.0
+    cfg.cache_enabled = cfg.memo_enabled = False
+    return cfg
+
+
+def test_workers_match_serial_run(tmp_path, monkeypatch):
+    make_corpus(tmp_path / "corpus", 6, seed=3, kinds=("text", "scanned"), max_pages=2)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    with MockLLMServer(responses={"cuit": "30-71234567-1"}, seed=1) as server:
+        # los procesos del pool heredan el entorno
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        serial = _settings(tmp_path, "serial", 1)
+        assert process_folder(serial) == 6
+        parallel = _settings(tmp_path, "parallel", 3)
+        assert process_folder(parallel) == 6
+
+    rows = _rows(parallel)
+    assert rows == _rows(serial)
+    # el journal se llena en orden de finalización; la salida va por nombre
+    assert [r[0] for r in rows[1:]] == [f"bench_{i:05d}.pdf" for i in range(6)]
+    assert all(r[2] for r in rows[1:])
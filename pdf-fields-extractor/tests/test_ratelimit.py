@@ -0,0 +1,60 @@
+import time
+
+from pdf_fields.llm_provider import Throttle
+from pdf_fields.ratelimit import AIMDWindow, RateLimitInfo, SharedLedger, parse_duration
+
+
+def test_headers_and_durations():
+    info = RateLimitInfo.from_headers({
+        "x-ratelimit-limit-requests": "100",
+        "x-ratelimit-remaining-requests": "5",
+        "x-ratelimit-reset-requests": "6m0s",
+        "retry-after-ms": "250",
+    })
+    assert info.reset_requests_s == 360.0
+    assert info.retry_after_s == 0.25
+    assert info.remaining_fraction() == 0.05
+    assert parse_duration("1m30.5s") == 90.5
+    assert parse_duration("20ms") == 0.02
+
+
+def test_ledger_budget_is_shared_between_instances(tmp_path):
+    path = tmp_path / "rate.json"
+    a = SharedLedger(path, requests_per_min=2)
+    b = SharedLedger(path, requests_per_min=2)   # otro proceso, mismo archivo
+    assert a.reserve(0) == 0.0
+    assert b.reserve(0) == 0.0
+    assert 0 < a.reserve(0) <= 30.0              # cupo agotado para ambos
+
+    c = SharedLedger(tmp_path / "learned.json")  # sin límite configurado
+    assert c.reserve(0) == 0.0
+    c.observe(RateLimitInfo(limit_requests=60, remaining_requests=0, reset_requests_s=2.0), 0, None)
+    assert 1.0 < c.reserve(0) <= 2.0             # la API dijo que no queda cupo
+    c.block(5.0)
+    assert 4.0 < SharedLedger(tmp_path / "learned.json").reserve(0) <= 5.0
+
+
+def test_aimd_window():
+    w = AIMDWindow(max_limit=8, start=4, cooldown_s=0.0)
+    for _ in range(5):
+        w.on_success(RateLimitInfo())
+    assert w.size == 5                           # ~+1 por ventana completa de respuestas
+    w.on_throttled()
+    assert w.size == 2
+    w.on_success(RateLimitInfo(limit_requests=100, remaining_requests=1))
+    assert w.size == 1                           # cupo restante bajo: se achica
+
+
+def test_adaptive_controller_replaces_fixed_interval():
+    class Controller:
+        waits = 0
+
+        def wait(self):
+            self.waits += 1
+
+    controller = Controller()
+    throttle = Throttle(min_call_interval_s=5.0, max_retries=1, initial_backoff_s=0.0,
+                        max_backoff_s=0.0, controller=controller)
+    t0 = time.monotonic()
+    assert [throttle.call_with_backoff(lambda: n) for n in range(3)] == [0, 1, 2]
+    assert time.monotonic() - t0 < 1.0 and controller.waits == 3
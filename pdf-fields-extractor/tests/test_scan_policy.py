@@ -0,0 +1,88 @@
+from datetime import date
+
+import fitz
+
+from pdf_fields import pipeline
+from pdf_fields.config import Settings
+from pdf_fields.llm_provider import BaseLLMProvider
+from pdf_fields.pipeline import process_one_pdf
+
+HOY = date(2024, 1, 1)
+
+
+class PageProvider(BaseLLMProvider):
+    """Página completa: cuenta las llamadas y no encuentra nada."""
+
+    def __init__(self):
+        self.full_pages = 0
+
+    def extract_field(self, img, field):
+        return None
+
+    def extract_all(self, img):
+        self.full_pages += 1
+        return [], []
+
+
+def _pdf(path, texts):
+    doc = fitz.open()
+    for text in texts:
+        page = doc.new_page()
+        if text:
+            page.insert_text((72, 72), text)
+    doc.save(path.as_posix())
+    return path
+
+
+def _visited(monkeypatch):
+    pages = []
+    prepare = pipeline._prepare_page
+
+    def spy(doc, i, *args, **kwargs):
+        pages.append(i)
+        return prepare(doc, i, *args, **kwargs)
+
+    monkeypatch.setattr(pipeline, "_prepare_page", spy)
+    return pages
+
+
+PAGES = ["Fecha: 01/02/2022", "CUIT: 20-12345678-6", "Fecha: 03/04/2023", "CUIT: 27-23456789-1"]
+
+
+def test_all_and_first_hit(tmp_path, monkeypatch):
+    pdf = _pdf(tmp_path / "a.pdf", PAGES)
+    visited = _visited(monkeypatch)
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path, text_only=True, scan_policy="all")
+    # todas: la fecha pasada más cercana está en la página 3; gana el primer CUIT
+    assert process_one_pdf(pdf, cfg, None, hoy=HOY) == ("03/04/2023", "20-12345678-6")
+    assert visited == [0, 1, 2, 3]
+
+    visited.clear()
+    cfg.scan_policy = "first-hit"
+    assert process_one_pdf(pdf, cfg, None, hoy=HOY) == ("01/02/2022", "20-12345678-6")
+    assert visited == [0, 1]
+
+
+def test_first_n_pages(tmp_path, monkeypatch):
+    pdf = _pdf(tmp_path / "a.pdf", PAGES)
+    visited = _visited(monkeypatch)
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path, text_only=True,
+                   scan_policy="first-n-pages", scan_max_pages=1)
+    assert process_one_pdf(pdf, cfg, None, hoy=HOY) == ("01/02/2022", None)
+    assert visited == [0]
+
+
+def test_full_page_fallbacks_cap_per_document(tmp_path, monkeypatch):
+    # páginas sin capa de texto: sólo las resuelve la página completa
+    pdf = _pdf(tmp_path / "a.pdf", ["", "", "", ""])
+    visited = _visited(monkeypatch)
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path, scan_policy="all", full_page_fallbacks=2)
+    llm = PageProvider()
+    assert process_one_pdf(pdf, cfg, llm, hoy=HOY) == (None, None)
+    assert visited == [0, 1, 2, 3] and llm.full_pages == 2
+
+    visited.clear()
+    cfg.full_page_fallbacks = -1
+    llm = PageProvider()
+    assert process_one_pdf(pdf, cfg, llm, hoy=HOY) == (None, None)
+    assert visited == [0, 1, 2, 3] and llm.full_pages == 4
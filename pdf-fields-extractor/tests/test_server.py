@@ -0,0 +1,151 @@
+import http.client
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks.synth import make_corpus
+from pdf_fields.config import Settings
+from pdf_fields.llm_provider import BaseLLMProvider
+from pdf_fields.server import ExtractionServer, ExtractionService, Rejected
+
+VALUES = {"fecha": "15/03/2023", "cuit": "20-12345678-6"}
+
+
+class GatedProvider(BaseLLMProvider):
+    """Responde valores fijos; cada llamada espera `gate` y `delay_s`."""
+
+    def __init__(self, delay_s=0.0):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.delay_s = delay_s
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        with self._lock:
+            self.calls += 1
+        self.gate.wait()
+        time.sleep(self.delay_s)
+
+    def extract_field(self, img, field):
+        self._wait()
+        return VALUES.get(field)
+
+    def extract_all(self, img):
+        self._wait()
+        return [VALUES["fecha"]], [VALUES["cuit"]]
+
+
+def _post(url, data):
+    req = urllib.request.Request(url + "/extract?archivo=x.pdf", data=data, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return resp.status, json.loads(resp.read()), dict(resp.headers)
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read()), dict(e.headers)
+
+
+def _pdfs(tmp_path, n):
+    make_corpus(tmp_path / "src", n, seed=3, kinds=("stamped",), max_pages=1)
+    return [(tmp_path / "src" / f"bench_{i:05d}.pdf").read_bytes() for i in range(n)]
+
+
+def test_identical_uploads_share_one_scan(tmp_path):
+    data, = _pdfs(tmp_path, 1)
+    llm = GatedProvider(delay_s=0.2)
+    cfg = Settings(input_dir=None, out_dir=tmp_path / "out", serve_threads=2)
+    with ExtractionServer(ExtractionService(cfg, llm=llm)) as server:
+        results = [None] * 4
+        def client(i):
+            results[i] = _post(server.base_url, data)
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        calls_once = llm.calls
+        again = _post(server.base_url, data)
+
+    assert all(status == 200 for status, _, _ in results)
+    assert {body["cuit"] for _, body, _ in results} == {VALUES["cuit"]}
+    assert sorted(body["source"] for _, body, _ in results) == ["coalesced"] * 3 + ["scan"]
+    # el quinto upload sale del cache sin llamar al LLM
+    assert again[0] == 200 and again[1]["source"] == "cache"
+    assert llm.calls == calls_once
+
+
+def test_full_queue_answers_429_and_draining_503(tmp_path):
+    a, b, c = _pdfs(tmp_path, 3)
+    llm = GatedProvider()
+    llm.gate.clear()
+    cfg = Settings(input_dir=None, out_dir=tmp_path / "out", serve_threads=1, serve_queue_size=1)
+    service = ExtractionService(cfg, llm=llm)
+    server = ExtractionServer(service).start()
+    try:
+        first, _ = service.submit(a)
+        # el único hilo toma el primero y queda bloqueado en el LLM
+        deadline = time.monotonic() + 10
+        while service.health()["busy"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        second, _ = service.submit(b)
+        status, body, headers = _post(server.base_url, c)
+        assert status == 429 and int(headers["Retry-After"]) >= 1
+        # el mismo contenido que ya está en cola no cuenta contra el límite
+        assert service.submit(b) == (second, "coalesced")
+    finally:
+        llm.gate.set()
+        server.stop()
+    assert first.done.is_set() and second.done.is_set()
+    with pytest.raises(Rejected) as exc:
+        service.submit(c)
+    assert exc.value.status == 503
+
+
+class FlakyProvider(GatedProvider):
+    """Mientras `down`, cada llamada agota los reintentos (como un 429 sostenido)."""
+
+    def __init__(self):
+        super().__init__()
+        self.down = True
+
+    def extract_field(self, img, field):
+        if self.down:
+            self.failed_calls += 1
+            return None
+        return super().extract_field(img, field)
+
+    def extract_all(self, img):
+        if self.down:
+            self.failed_calls += 1
+            return [], []
+        return super().extract_all(img)
+
+
+def test_failed_scans_are_not_served_from_cache(tmp_path):
+    data, = _pdfs(tmp_path, 1)
+    llm = FlakyProvider()
+    cfg = Settings(input_dir=None, out_dir=tmp_path / "out", serve_threads=1)
+    with ExtractionServer(ExtractionService(cfg, llm=llm)) as server:
+        status, body, headers = _post(server.base_url, data)
+        assert status == 503 and body["failed"] and int(headers["Retry-After"]) >= 1
+        llm.down = False
+        status, body, _ = _post(server.base_url, data)
+    assert status == 200 and body["source"] == "scan" and body["cuit"] == VALUES["cuit"]
+
+
+def test_invalid_content_length_answers_400(tmp_path):
+    cfg = Settings(input_dir=None, out_dir=tmp_path / "out", serve_threads=1)
+    with ExtractionServer(ExtractionService(cfg, llm=GatedProvider())) as server:
+        host, port = server.base_url[len("http://"):].split(":")
+        for length in ("abc", "-5"):
+            conn = http.client.HTTPConnection(host, int(port), timeout=10)
+            conn.putrequest("POST", "/extract")
+            conn.putheader("Content-Length", length)
+            conn.endheaders()
+            resp = conn.getresponse()
+            assert resp.status == 400 and "Content-Length" in json.loads(resp.read())["error"]
+            conn.close()
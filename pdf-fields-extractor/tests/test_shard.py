@@ -0,0 +1,86 @@
+import csv
+import json
+
+import pytest
+
+from benchmarks.mock_llm import MockLLMServer
+from benchmarks.synth import make_corpus
+from pdf_fields.config import Settings, parse_shard
+from pdf_fields.pipeline import process_folder
+from pdf_fields.shard import CoverageError, merge_shards, shard_of
+
+
+def _rows(path):
+    with path.open(encoding="utf-8") as fh:
+        return list(csv.reader(fh, delimiter=";"))
+
+
+def test_shard_of_is_stable_and_partitions():
+    # fijo: cambiar el hash reparte distinto un lote a medio procesar
+    assert shard_of("bench_00000.pdf", 4) == 4
+    assert shard_of("factura_0001.pdf", 3) == 1
+    names = [f"doc_{i}.pdf" for i in range(400)]
+    counts = [sum(shard_of(n, 4) == i for n in names) for i in range(1, 5)]
+    assert sum(counts) == 400 and min(counts) > 60
+    assert parse_shard("2/4") == (2, 4)
+    with pytest.raises(ValueError):
+        parse_shard("5/4")
+
+
+def _run_shards(tmp_path, corpus, n):
+    parts = []
+    for i in range(1, n + 1):
+        out = tmp_path / f"nodo{i}"
+        process_folder(Settings(input_dir=corpus, out_dir=out, text_only=True, shard=(i, n)))
+        parts.append(out)
+    return parts
+
+
+def test_merge_matches_single_run_and_checks_coverage(tmp_path):
+    corpus = tmp_path / "lote"
+    make_corpus(corpus, 7, seed=5, kinds=("text",), max_pages=2)
+    parts = _run_shards(tmp_path, corpus, 3)
+    manifest = json.loads((parts[0] / "lote_manifest.shard-1-of-3.json").read_text(encoding="utf-8"))
+    assert manifest["universe_files"] == 7 and manifest["files"] == len(manifest["assigned"])
+
+    final = Settings(input_dir=corpus, out_dir=tmp_path / "final", write_xlsx=False)
+    summary = merge_shards(final, parts)
+    assert summary["shards"] == 3 and summary["rows"] == 7
+
+    single = Settings(input_dir=corpus, out_dir=tmp_path / "single", text_only=True, write_xlsx=False)
+    process_folder(single)
+    assert _rows(final.csv_path()) == _rows(single.csv_path())
+
+    # un shard que falta
+    with pytest.raises(CoverageError) as exc:
+        merge_shards(final, parts[:2])
+    assert exc.value.problems == ["Falta el shard 3/3"]
+
+    # una fila repetida en otro parcial
+    name = manifest["assigned"][0]
+    with (parts[1] / "lote_resultados.shard-2-of-3.csv").open("a", encoding="utf-8") as fh:
+        fh.write(f"{name};;\n")
+    with pytest.raises(CoverageError) as exc:
+        merge_shards(final, parts)
+    assert any(name in p for p in exc.value.problems)
+
+
+def test_manifest_lists_failed_llm_calls(tmp_path, monkeypatch):
+    corpus = tmp_path / "lote"
+    make_corpus(corpus, 2, seed=1, kinds=("scanned",), max_pages=1)
+    (corpus / "zz_roto.pdf").write_bytes(b"no es un PDF")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    cfg = Settings(input_dir=corpus, out_dir=tmp_path / "nodo1", write_xlsx=False, shard=(1, 1))
+    cfg.llm_provider = "openai"
+    cfg.adaptive_rate = cfg.cache_enabled = cfg.memo_enabled = False
+    cfg.templates_enabled = cfg.page_dedup_enabled = False
+    cfg.min_call_interval_s = 0.0
+    cfg.max_retries = 1
+
+    with MockLLMServer(rate_429=1.0) as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        process_folder(cfg)
+    manifest = json.loads(cfg.manifest_path().read_text(encoding="utf-8"))
+    # los escaneados con 429 cuentan como falla, no sólo el PDF que no abre
+    assert manifest["failures"] == ["bench_00000.pdf", "bench_00001.pdf", "zz_roto.pdf"]
+    assert manifest["failed"] == 3
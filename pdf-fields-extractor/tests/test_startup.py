@@ -0,0 +1,11 @@
+from benchmarks.startup import measure
+
+
+def test_startup_imports_stay_lazy():
+    r = measure(repeat=1)
+    # --help y --text-only no cargan el cliente LLM ni pandas/openpyxl
+    assert r["cli_help"]["heavy"] == []
+    assert r["text_only_run"]["heavy"] == ["fitz"]
+    assert "openai" not in r["import_pipeline"]["heavy"]
+    # el provider sí los carga: la sonda ve los módulos pesados importados
+    assert {"openai", "PIL"} <= set(r["import_llm_provider"]["heavy"])
@@ -0,0 +1,115 @@
+
+import fitz
+
+from pdf_fields.config import Settings
+from pdf_fields.encoding import image_size
+from pdf_fields.extractors import PageRaster, clip_right_rect
+from pdf_fields.llm_provider import BaseLLMProvider
+from pdf_fields.metrics import METRICS
+from pdf_fields.pipeline import scan_pdf, template_tier
+from pdf_fields.templates import Template, TemplateStore, normalize_rect
+
+
+class CropProvider(BaseLLMProvider):
+    def __init__(self):
+        self.sizes = []
+
+    def extract_field(self, img, field):
+        self.sizes.append(image_size(img))
+        return "30-71234567-1" if field == "cuit" else None
+
+    def extract_all(self, img):
+        return [], []
+
+
+def _form(path, fecha, cuit=None, cuit_as_image=False):
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 100), "Fecha de visita:", fontsize=11)
+    page.insert_text((180, 100), fecha, fontsize=11)
+    page.insert_text((72, 160), "CUIT:", fontsize=11)
+    if cuit_as_image:
+        # valor escaneado: sólo imagen, sin capa de texto
+        tmp = fitz.open()
+        tmp.new_page(width=120, height=20).insert_text((2, 14), "30-71234567-1", fontsize=11)
+        pix = tmp[0].get_pixmap(matrix=fitz.Matrix(3, 3))
+        page.insert_image(fitz.Rect(180, 146, 300, 166), pixmap=pix)
+    else:
+        page.insert_text((180, 160), cuit, fontsize=11)
+    doc.set_metadata({"producer": "Emisor A"})
+    doc.save(path.as_posix())
+
+
+def test_learned_layout_skips_anchor_search(tmp_path):
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path)
+    store = TemplateStore(tmp_path / "tpl.sqlite")
+    llm = CropProvider()
+    _form(tmp_path / "a.pdf", "01/02/2023", "20-12345678-6")
+    _form(tmp_path / "b.pdf", "05/06/2022", "27-23456789-1")
+    _form(tmp_path / "c.pdf", "07/08/2021", cuit_as_image=True)
+
+    METRICS.reset()
+    a = scan_pdf(tmp_path / "a.pdf", cfg, llm, templates=store)
+    assert a.fechas == ["01/02/2023"] and METRICS.counters["templates.learned"] == 2
+
+    METRICS.reset()
+    b = scan_pdf(tmp_path / "b.pdf", cfg, llm, templates=store)
+    assert b.fechas == ["05/06/2022"] and b.cuits == ["27-23456789-1"]
+    assert METRICS.counters["templates.hits"] == 2
+    assert "stage.anchor_index" not in METRICS.timers
+
+    # mismo formato con el CUIT escaneado: un único recorte ajustado al rect aprendido
+    METRICS.reset()
+    c = scan_pdf(tmp_path / "c.pdf", cfg, llm, templates=store)
+    assert c.cuits == ["30-71234567-1"] and not c.text_only
+    assert len(llm.sizes) == 1
+    with fitz.open(tmp_path / "c.pdf") as doc:
+        generic = clip_right_rect(doc[0], doc[0].search_for("CUIT:")[0])
+    w, h = llm.sizes[0]
+    assert w * h < 0.5 * abs(generic) * cfg.render_zoom_clip ** 2
+    layout = next(iter(store._by_layout))[0]
+    store.close()
+
+    # otra corrida lee las plantillas del disco
+    assert TemplateStore(tmp_path / "tpl.sqlite").lookup(layout, "fecha")
+
+
+class DateProvider(BaseLLMProvider):
+    def extract_field(self, img, field):
+        return "03/04/2021" if field == "fecha" else None
+
+    def extract_all(self, img):
+        return [], []
+
+
+def test_llm_clip_for_one_field_does_not_stop_the_other(tmp_path):
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 100), "Fecha:", fontsize=11)
+    # fecha manuscrita: sólo imagen
+    tmp = fitz.open()
+    tmp.new_page(width=120, height=20).insert_text((2, 14), "03/04/2021", fontsize=11)
+    page.insert_image(fitz.Rect(180, 86, 300, 106), pixmap=tmp[0].get_pixmap(matrix=fitz.Matrix(3, 3)))
+    page.insert_text((72, 160), "CUIT:", fontsize=11)
+    page.insert_text((180, 160), "20-12345678-6", fontsize=11)
+    page.insert_text((72, 200), "CUIT anterior:", fontsize=11)
+    page.insert_text((180, 200), "s/d", fontsize=11)
+
+    def tpl(field, label, label_rect, value_rect, source, hits):
+        return Template("L", field, label, normalize_rect(page, fitz.Rect(label_rect)),
+                        normalize_rect(page, fitz.Rect(value_rect)), source, hits=hits)
+
+    store = TemplateStore(tmp_path / "tpl.sqlite")
+    store._by_layout[("L", "fecha")] = [tpl("fecha", "Fecha", (70, 88, 110, 104), (178, 84, 302, 108), "clip", 1)]
+    # la primera plantilla de CUIT ya no sirve (sin valor); la segunda sí
+    store._by_layout[("L", "cuit")] = [
+        tpl("cuit", "CUIT anterior", (70, 188, 160, 204), (178, 188, 260, 204), "text", 5),
+        tpl("cuit", "CUIT", (70, 148, 110, 164), (178, 148, 300, 164), "text", 1),
+    ]
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path)
+    found, used_llm = template_tier(page, PageRaster(page), DateProvider(), store, "L", ["fecha", "cuit"], cfg)
+    assert found == {"fecha": "03/04/2021", "cuit": "20-12345678-6"} and used_llm
+
+    # un layout sin plantillas no vuelve a consultar SQLite
+    assert store.lookup("otro", "fecha") == [] and ("otro", "fecha") in store._by_layout
+    store.close()
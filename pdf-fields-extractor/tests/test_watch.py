@@ -0,0 +1,106 @@
+import csv
+import shutil
+import threading
+import time
+
+import pytest
+
+from benchmarks.mock_llm import MockLLMServer
+from benchmarks.synth import make_corpus
+from pdf_fields.cache import ResultCache
+from pdf_fields.config import Settings
+from pdf_fields.pipeline import process_folder
+from pdf_fields.watch import InotifyWatcher, PollingWatcher, WatchService
+
+
+def _wait_for(cond, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _csv_rows(cfg):
+    if not cfg.csv_path().exists():
+        return []
+    with cfg.csv_path().open(encoding="utf-8") as fh:
+        return list(csv.reader(fh, delimiter=";"))[1:]
+
+
+def test_polling_reports_only_settled_new_files(tmp_path):
+    (tmp_path / "viejo.pdf").write_bytes(b"%PDF-1.4 viejo")
+    w = PollingWatcher(tmp_path, interval_s=0.01)
+    (tmp_path / "nuevo.pdf").write_bytes(b"%PDF-1.4 a medias")
+    (tmp_path / "notas.txt").write_text("x")
+    # primera pasada: todavía puede estar copiándose
+    assert w.poll(1.0) == []
+    assert w.poll(1.0) == [tmp_path / "nuevo.pdf"]
+    assert w.poll(1.0) == []
+
+
+def test_inotify_reports_closed_and_moved_pdfs(tmp_path):
+    try:
+        w = InotifyWatcher(tmp_path)
+    except (OSError, AttributeError):
+        pytest.skip("inotify no disponible")
+    (tmp_path / "a.pdf").write_bytes(b"%PDF-1.4")
+    (tmp_path / "b.tmp").write_bytes(b"%PDF-1.4")
+    (tmp_path / "b.tmp").rename(tmp_path / "b.pdf")
+    seen = []
+    assert _wait_for(lambda: seen.extend(w.poll(0.1)) or len(seen) >= 2, timeout=5)
+    assert seen == [tmp_path / "a.pdf", tmp_path / "b.pdf"]
+    w.close()
+
+
+def test_watch_processes_backlog_and_new_files(tmp_path):
+    src, inbox, out = tmp_path / "src", tmp_path / "inbox", tmp_path / "out"
+    inbox.mkdir()
+    make_corpus(src, 2, seed=4, kinds=("text",), max_pages=2)
+    shutil.copy(src / "bench_00000.pdf", inbox)
+    cfg = Settings(input_dir=inbox, out_dir=out, text_only=True, write_xlsx=False,
+                   watch_rebuild_s=0.0)
+    service = WatchService(cfg, watcher=PollingWatcher(inbox, interval_s=0.05))
+    thread = threading.Thread(target=service.run)
+    thread.start()
+    try:
+        assert _wait_for(lambda: len(_csv_rows(cfg)) == 1)
+        shutil.copy(src / "bench_00001.pdf", inbox)
+        assert _wait_for(lambda: len(_csv_rows(cfg)) == 2)
+    finally:
+        service.stop()
+        thread.join(timeout=20)
+    assert not thread.is_alive()
+    assert service.processed == 2
+
+    # mismas filas que una corrida por lotes sobre los mismos PDFs
+    batch = Settings(input_dir=src, out_dir=tmp_path / "batch", text_only=True, write_xlsx=False)
+    process_folder(batch)
+    assert _csv_rows(cfg) == _csv_rows(batch)
+    assert [r[0] for r in _csv_rows(cfg)] == ["bench_00000.pdf", "bench_00001.pdf"]
+
+
+def test_watch_does_not_cache_failed_scans(tmp_path, monkeypatch):
+    inbox = tmp_path / "inbox"
+    make_corpus(inbox, 1, seed=1, kinds=("scanned",), max_pages=1)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    cfg = Settings(input_dir=inbox, out_dir=tmp_path / "out", write_xlsx=False, watch_rebuild_s=0.0)
+    cfg.llm_provider = "openai"
+    cfg.adaptive_rate = cfg.memo_enabled = cfg.templates_enabled = cfg.page_dedup_enabled = False
+    cfg.min_call_interval_s = 0.0
+    cfg.max_retries = 1
+    with MockLLMServer(rate_429=1.0) as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        service = WatchService(cfg, watcher=PollingWatcher(inbox, interval_s=0.05))
+        thread = threading.Thread(target=service.run)
+        thread.start()
+        try:
+            assert _wait_for(lambda: service.processed == 1)
+        finally:
+            service.stop()
+            thread.join(timeout=20)
+
+    cache = ResultCache.from_settings(cfg)
+    assert cache.get(cache.key(inbox / "bench_00000.pdf")) is None
+    cache.close()
@@ -0,0 +1,59 @@
+import csv
+import tracemalloc
+
+from openpyxl import load_workbook
+
+from pdf_fields.config import Settings
+from pdf_fields.journal import COLUMNS, Journal
+from pdf_fields.pipeline import write_outputs
+from pdf_fields.writers import ColumnWidths
+
+
+def _journal(tmp_path, n):
+    j = Journal(tmp_path / "journal.sqlite")
+    for i in range(n):
+        j.append({"archivo": f"doc_{i:06d}.pdf", "fecha_ddmmyyyy": "01/02/2023",
+                  "cuit": "20-12345678-6" if i % 2 else ""})
+    return j
+
+
+def test_streaming_outputs_match_and_keep_widths(tmp_path):
+    j = _journal(tmp_path, 3)
+    j.append({"archivo": "nombre_" + "x" * 80 + ".pdf", "fecha_ddmmyyyy": "", "cuit": ""})
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path)
+    write_outputs(cfg, j)
+
+    with cfg.csv_path().open(encoding="utf-8") as fh:
+        rows = list(csv.reader(fh, delimiter=";"))
+    ws = load_workbook(cfg.xlsx_path())["Resumen Lote"]
+    assert [[c.value or "" for c in r] for r in ws.iter_rows()] == rows
+    assert ws["A1"].font.bold
+    assert ws.column_dimensions["A"].width == 60          # tope
+    assert ws.column_dimensions["C"].width == len("20-12345678-6") + 2
+    j.close()
+
+    # al reabrir (resume) los anchos salen de las filas ya registradas
+    assert Journal(tmp_path / "journal.sqlite").widths.widths()["archivo"] == 60
+
+
+class _Rows:
+    """Journal mínimo: filas generadas al vuelo (como el cursor SQLite)."""
+
+    def __init__(self, n):
+        self.n = n
+        self.widths = ColumnWidths(COLUMNS)
+
+    def rows(self):
+        for i in range(self.n):
+            yield {"archivo": f"doc_{i:06d}.pdf", "fecha_ddmmyyyy": "01/02/2023", "cuit": "20-12345678-6"}
+
+
+def test_outputs_run_in_constant_memory(tmp_path):
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path)
+    peaks = []
+    for n in (1000, 10000):
+        tracemalloc.start()
+        write_outputs(cfg, _Rows(n))
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < 2 * peaks[0]
@@ -0,0 +1,76 @@
+import fitz
+
+from pdf_fields.config import Settings, parse_zooms
+from pdf_fields.encoding import image_size
+from pdf_fields.llm_provider import BaseLLMProvider
+from pdf_fields.metrics import METRICS, zoom_ladder_summary
+from pdf_fields.pipeline import scan_pdf
+
+
+class BlurryProvider(BaseLLMProvider):
+    """Lee mal (dígito verificador inválido) hasta ver la imagen 1.4x más grande."""
+
+    def __init__(self):
+        self.widths = []
+
+    def _read(self, img):
+        w, _ = image_size(img)
+        self.widths.append(w)
+        return "30-71234567-1" if w >= 1.4 * self.widths[0] else "30-71234567-9"
+
+    def extract_field(self, img, field):
+        return self._read(img)
+
+    def extract_all(self, img):
+        return [], [self._read(img)]
+
+
+def _scanned(path, with_anchor=True):
+    doc = fitz.open()
+    page = doc.new_page()
+    if with_anchor:
+        page.insert_text((72, 160), "CUIT:", fontsize=11)
+    tmp = fitz.open()
+    tmp.new_page(width=120, height=20).insert_text((2, 14), "30-71234567-1", fontsize=11)
+    page.insert_image(fitz.Rect(180, 146, 300, 166), pixmap=tmp[0].get_pixmap(matrix=fitz.Matrix(3, 3)))
+    doc.save(path.as_posix())
+
+
+def test_parse_zooms():
+    assert parse_zooms("") == ()
+    assert parse_zooms("5, 2.5,2.5") == (2.5, 5.0)
+
+
+def test_clip_escalates_until_value_validates(tmp_path):
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path, zoom_ladder_clip=(2.0, 3.0, 5.0),
+                   full_page_fallbacks=0)
+    _scanned(tmp_path / "a.pdf")
+    llm = BlurryProvider()      # basta el nivel 3x
+
+    METRICS.reset()
+    r = scan_pdf(tmp_path / "a.pdf", cfg, llm)
+    assert r.cuits == ["30-71234567-1"]
+    assert len(llm.widths) == 2 and llm.widths[0] < llm.widths[1]
+    ladder = zoom_ladder_summary(METRICS.counters)["clip"]
+    assert ladder["2x"] == {"tries": 1, "ok": 0, "ok_rate": 0.0}
+    assert ladder["3x"]["ok"] == 1 and "5x" not in ladder
+
+
+def test_full_page_escalates_only_on_invalid_candidates(tmp_path):
+    cfg = Settings(input_dir=tmp_path, out_dir=tmp_path, zoom_ladder_full=(1.0, 2.0))
+    _scanned(tmp_path / "a.pdf", with_anchor=False)
+    llm = BlurryProvider()
+
+    METRICS.reset()
+    r = scan_pdf(tmp_path / "a.pdf", cfg, llm)
+    assert r.cuits == ["30-71234567-1"] and len(llm.widths) == 2
+
+    # una página sin datos (respuesta vacía) no se re-renderiza
+    class Empty(BlurryProvider):
+        def extract_all(self, img):
+            self.widths.append(image_size(img)[0])
+            return [], []
+
+    llm = Empty()
+    scan_pdf(tmp_path / "a.pdf", cfg, llm)
+    assert len(llm.widths) == 1